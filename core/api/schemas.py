@@ -1,4 +1,4 @@
-from ninja import Schema
+from ninja import Field, Schema
 
 from core.choices import BlogPostStatus
 
@@ -61,6 +61,29 @@ class RenderMetricsOut(Schema):
     error_counts: dict[str, int]
 
 
+class RenderCacheStatsOut(Schema):
+    layers: dict[str, dict[str, float]]
+    memory_entries: int
+    memory_bytes: int
+    memory_max_bytes: int
+    font_cache: dict[str, float]
+
+
+class RenderPoolStatsOut(Schema):
+    enabled: bool
+    workers: int = 0
+    max_queue: int = 0
+    in_flight: int = 0
+    queue_depth: int = 0
+    submitted: int = 0
+    rejected: int = 0
+    completed: int = 0
+    failed: int = 0
+    avg_wait_ms: float = 0.0
+    max_wait_ms: float = 0.0
+    worker_utilization_percent: dict[str, float] = Field(default_factory=dict)
+
+
 class WordPressHelperIn(Schema):
     page_url: str
     post_title: str = ""
@@ -11,14 +11,19 @@ from core.api.schemas import (
     BlogPostOut,
     OnboardingWizardIn,
     OnboardingWizardOut,
+    RenderCacheStatsOut,
     RenderMetricsOut,
+    RenderPoolStatsOut,
     SignOgUrlIn,
     SignOgUrlOut,
     WordPressHelperIn,
     WordPressHelperOut,
 )
+from core.image_utils import get_font_cache_stats
 from core.models import BlogPost
-from core.render_observability import build_render_metrics
+from core.render_cache import get_render_cache_stats
+from core.render_observability import MAX_METRICS_WINDOW_HOURS, build_render_metrics
+from core.render_pool import get_render_pool_stats, render_pool_enabled
 from core.signing import build_signed_params
 from core.wordpress_helper import build_wordpress_render_params, wordpress_helper_snippet
 
@@ -197,7 +202,7 @@ def build_wordpress_helper_payload(request: HttpRequest, data: WordPressHelperIn
 
 @api.get("/admin/render-metrics", response=RenderMetricsOut, auth=[superuser_api_auth])
 def get_render_metrics(request: HttpRequest, hours: int = 24):
-    window_hours = max(1, min(int(hours), 24 * 30))
+    window_hours = max(1, min(int(hours), MAX_METRICS_WINDOW_HOURS))
     metrics = build_render_metrics(window_hours=window_hours)
 
     return RenderMetricsOut(
@@ -208,3 +213,27 @@ def get_render_metrics(request: HttpRequest, hours: int = 24):
         p95_render_ms=metrics.p95_render_ms,
         error_counts=metrics.error_counts,
     )
+
+
+@api.get("/admin/render-cache-stats", response=RenderCacheStatsOut, auth=[superuser_api_auth])
+def get_render_cache_stats_view(request: HttpRequest):
+    stats = get_render_cache_stats()
+    font_stats = get_font_cache_stats()
+
+    return RenderCacheStatsOut(
+        layers=stats["layers"],
+        memory_entries=stats["memory_entries"],
+        memory_bytes=stats["memory_bytes"],
+        memory_max_bytes=stats["memory_max_bytes"],
+        font_cache={
+            "hits": font_stats.hits,
+            "misses": font_stats.misses,
+            "size": font_stats.size,
+            "hit_rate_percent": font_stats.hit_rate_percent,
+        },
+    )
+
+
+@api.get("/admin/render-pool-stats", response=RenderPoolStatsOut, auth=[superuser_api_auth])
+def get_render_pool_stats_view(request: HttpRequest):
+    return RenderPoolStatsOut(enabled=render_pool_enabled(), **(get_render_pool_stats() or {}))
@@ -12,6 +12,7 @@ class CoreConfig(AppConfig):
     name = "core"
 
     def ready(self):
+        import core.checks  # noqa
         import core.signals  # noqa
         import core.webhooks  # noqa
 
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(name: str, setting_name: str, default_workers: int) -> ThreadPoolExecutor:
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, setting_name, default_workers),
+                thread_name_prefix=f"osig-{name}",
+            )
+            _executors[name] = executor
+        return executor
+
+
+def _run_with_connection_cleanup(fn, *args, **kwargs):
+    """Run `fn` on a pool thread the way Django runs a request.
+
+    Stale connections are closed before the job. After it, the thread's connections are
+    released like at the end of a request. Pool threads live for the whole process, and
+    without this the connections they open (a usage flush, a save schedule) would never be
+    closed.
+    """
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_render(fn, *args, **kwargs):
+    """Run CPU-bound Pillow work on the bounded render pool, off the event loop."""
+    executor = _executor("render", "OSIG_ASYNC_RENDER_WORKERS", 4)
+    return await sync_to_async(_run_with_connection_cleanup, thread_sensitive=False, executor=executor)(
+        fn, *args, **kwargs
+    )
+
+
+async def run_fetch(fn, *args, **kwargs):
+    """Run blocking upstream I/O on its own pool so slow hosts can't occupy render threads."""
+    executor = _executor("fetch", "OSIG_ASYNC_FETCH_WORKERS", 32)
+    return await sync_to_async(_run_with_connection_cleanup, thread_sensitive=False, executor=executor)(
+        fn, *args, **kwargs
+    )
+
+
+def shutdown_executors():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=True)
+        _executors.clear()
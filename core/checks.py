@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Warning, register
+
+# Backends whose entries are only visible to the process that wrote them.
+PER_PROCESS_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+SHARED_CACHE_ALIAS_SETTINGS = ("OSIG_RENDER_CACHE_ALIAS", "OSIG_USAGE_CACHE_ALIAS")
+
+
+def cache_is_shared(alias: str) -> bool:
+    """Whether `alias` is visible to other processes, i.e. web workers and the qcluster."""
+    return settings.CACHES[alias]["BACKEND"] not in PER_PROCESS_CACHE_BACKENDS
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    errors = []
+    for setting_name in SHARED_CACHE_ALIAS_SETTINGS:
+        alias = getattr(settings, setting_name, "default")
+        if alias in caches.settings and not cache_is_shared(alias):
+            errors.append(
+                Warning(
+                    f"Cache alias {alias!r} ({setting_name}) is per-process.",
+                    hint=(
+                        "Render coalescing, the save spool, usage counters and regeneration markers "
+                        "need a cache shared across processes. Point CACHE_URL at Redis."
+                    ),
+                    id="osig.W001",
+                )
+            )
+    return errors
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+
+from PIL import ImageFont
+
+DEFAULT_FONT_NAME = "__default__"
+
+
+@dataclass(frozen=True)
+class FontCacheStats:
+    hits: int
+    misses: int
+    size: int
+    max_entries: int
+
+    @property
+    def hit_rate_percent(self) -> float:
+        total = self.hits + self.misses
+        return round((self.hits / total) * 100, 2) if total else 0.0
+
+
+class FontRegistry:
+    """Bounded LRU of parsed font faces keyed by (font name, size, face index)."""
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max(1, int(max_entries))
+        self._fonts: OrderedDict[Hashable, ImageFont.FreeTypeFont] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], ImageFont.FreeTypeFont]) -> ImageFont.FreeTypeFont:
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self._hits += 1
+                return font
+
+            self._misses += 1
+
+        # Parse outside the lock so a slow cold load doesn't block warm lookups.
+        font = loader()
+
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.max_entries:
+                self._fonts.popitem(last=False)
+
+        return font
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._fonts
+
+    def stats(self) -> FontCacheStats:
+        with self._lock:
+            return FontCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                size=len(self._fonts),
+                max_entries=self.max_entries,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+            self._hits = 0
+            self._misses = 0
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+import threading
+import weakref
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+RETRY_STATUS_CODES = (502, 503, 504)
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class HostConcurrencyTimeout(requests.exceptions.Timeout):
+    """Waited too long for a free slot to the upstream host."""
+
+
+class ResponseTooLargeError(ValueError):
+    """The upstream body is larger than OSIG_IMAGE_FETCH_MAX_BYTES."""
+
+
+@dataclass(frozen=True)
+class FetchedResponse:
+    status_code: int
+    headers: dict[str, str]
+    content: bytes
+
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_session_lock = threading.Lock()
+
+# Hosts come from user-supplied URLs, so a slot only lives while a fetch holds or waits on it.
+_host_slots: weakref.WeakValueDictionary[str, threading.BoundedSemaphore] = weakref.WeakValueDictionary()
+_host_slots_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=getattr(settings, "OSIG_HTTP_MAX_RETRIES", 2),
+        backoff_factor=getattr(settings, "OSIG_HTTP_RETRY_BACKOFF_SECONDS", 0.2),
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=getattr(settings, "OSIG_HTTP_POOL_CONNECTIONS", 10),
+        pool_maxsize=getattr(settings, "OSIG_HTTP_POOL_MAXSIZE", 20),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Process-wide session. Rebuilt after a fork so workers never share sockets."""
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = _build_session()
+            _session_pid = pid
+        return _session
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = urlsplit(url).netloc.lower()
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(getattr(settings, "OSIG_HTTP_MAX_CONNECTIONS_PER_HOST", 4))
+            _host_slots[host] = slot
+        return slot
+
+
+def _read_limited(response: requests.Response, max_bytes: int) -> bytes:
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise ResponseTooLargeError(f"Response is {content_length} bytes, limit is {max_bytes}")
+
+    chunks = []
+    received = 0
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+        received += len(chunk)
+        if received > max_bytes:
+            raise ResponseTooLargeError(f"Response exceeded {max_bytes} bytes")
+        chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+def fetch_url(url: str, headers: dict[str, str] | None = None) -> FetchedResponse:
+    """GET `url` through the shared pooled session.
+
+    Raises `requests.exceptions.HTTPError` for 4xx/5xx (after retrying 502/503/504),
+    `HostConcurrencyTimeout` when the host is saturated, and `ResponseTooLargeError`
+    as soon as the body passes the size limit.
+    """
+    timeout_seconds = getattr(settings, "OSIG_IMAGE_FETCH_TIMEOUT_SECONDS", 8)
+    max_bytes = getattr(settings, "OSIG_IMAGE_FETCH_MAX_BYTES", 10 * 1024 * 1024)
+
+    slot = _host_slot(url)
+    if not slot.acquire(timeout=timeout_seconds):
+        raise HostConcurrencyTimeout(f"No free connection slot for {urlsplit(url).netloc}")
+
+    try:
+        with get_session().get(url, headers=headers, timeout=timeout_seconds, stream=True) as response:
+            if response.status_code == 304:
+                return FetchedResponse(status_code=304, headers=dict(response.headers), content=b"")
+
+            response.raise_for_status()
+            content = _read_limited(response, max_bytes)
+            return FetchedResponse(status_code=response.status_code, headers=dict(response.headers), content=content)
+    finally:
+        slot.release()
+
+
+def reset_http_client():
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+    with _host_slots_lock:
+        _host_slots.clear()
@@ -1,18 +1,60 @@
+import functools
+
+from django.conf import settings
 from PIL import Image, ImageDraw
 
 from core.image_utils import (
     add_watermark,
     create_image_buffer,
+    draw_title_line,
     draw_wrapped_text,
     get_image_dimensions,
     load_and_resize_image,
     load_font,
+    warm_font_cache,
 )
+from core.models import Sites
+from core.render_cache import build_render_key
+from core.render_timing import render_stage
+from core.text_layout import layout_text
 from core.utils import check_if_profile_has_pro_subscription
 from osig.utils import get_osig_logger
 
 logger = get_osig_logger(__name__)
 
+# Every `load_font(font, int(height * ratio))` ratio used by the styles below.
+FONT_SIZE_RATIOS = (0.1, 0.09, 0.085, 0.082, 0.08, 0.05, 0.048, 0.032, 0.03, 0.028)
+
+
+STYLES = ("base", "logo", "job_classic", "job_logo", "job_clean")
+
+BASE_OVERLAY_COLOR = (0, 0, 0, 180)
+JOB_CLASSIC_OVERLAY_COLOR = (0, 0, 0, 130)
+
+
+def warm_style_fonts():
+    return warm_font_cache(Sites.values, FONT_SIZE_RATIOS)
+
+
+def warm_style_canvases():
+    for site in Sites.values:
+        size = get_image_dimensions(site)
+        for style in STYLES:
+            _precomposed_canvas(style, size)
+
+
+def warm_serving_process():
+    """Warm fonts and canvases in a web server process, unless OSIG_RENDER_WARM_ON_STARTUP is off.
+
+    Called from the WSGI and ASGI entry points rather than `CoreConfig.ready`, so management
+    commands and the django-q cluster don't read every font file on start.
+    """
+    if not getattr(settings, "OSIG_RENDER_WARM_ON_STARTUP", True):
+        return
+
+    warm_style_fonts()
+    warm_style_canvases()
+
 
 def _safe_truncate(text, max_chars):
     if not text:
@@ -43,37 +85,13 @@ def _draw_wrapped_text_block(draw, text, font, max_width, x_position, y_position
     is_title = kwargs.get("is_title", False)
     height = kwargs.get("height")
 
-    words = text.split()
-    lines = []
-    current_line = []
-
-    for word in words:
-        test_line = " ".join(current_line + [word])
-        bbox = font.getbbox(test_line)
-        if bbox[2] <= max_width:
-            current_line.append(word)
-        else:
-            if current_line:
-                lines.append(" ".join(current_line))
-                current_line = [word]
-            else:
-                lines.append(word)
-
-    if current_line:
-        lines.append(" ".join(current_line))
-
-    for line in lines:
-        bbox = font.getbbox(line)
-
+    for line in layout_text(text, font, max_width).lines:
         if is_title and height:
-            bold_offset = int(height * 0.002)
-            for offset_x in range(-bold_offset - 1, bold_offset + 1):
-                for offset_y in range(-bold_offset, bold_offset + 1):
-                    draw.text((x_position + offset_x, y_position + offset_y), line, font=font, fill=text_color)
+            draw_title_line(draw, (x_position, y_position), line.text, font, text_color, int(height * 0.002))
         else:
-            draw.text((x_position, y_position), line, font=font, fill=text_color)
+            draw.text((x_position, y_position), line.text, font=font, fill=text_color)
 
-        y_position += bbox[3] - bbox[1] + text_spacing
+        y_position += line.height + text_spacing
 
     return y_position
 
@@ -89,12 +107,62 @@ def _load_optional_image(image_url, width, height):
         return None
 
 
-def generate_image_router(image_data):
+@functools.lru_cache(maxsize=32)
+def _overlay_layer(size, color):
+    return Image.new("RGBA", size, color)
+
+
+@functools.lru_cache(maxsize=32)
+def _precomposed_canvas(style, size):
+    """Constant background layers of a style, composed once per canvas size. Never mutate; copy it."""
+    width, height = size
+
+    if style == "logo":
+        return Image.new("RGB", size, color=(30, 30, 30))
+
+    if style == "job_classic":
+        img = Image.new("RGBA", size, color=(24, 32, 46, 255))
+        return Image.alpha_composite(img, _overlay_layer(size, JOB_CLASSIC_OVERLAY_COLOR))
+
+    if style == "job_logo":
+        return Image.new("RGB", size, color=(17, 24, 39))
+
+    if style == "job_clean":
+        img = Image.new("RGB", size, color=(250, 250, 252))
+        accent_width = int(width * 0.018)
+        ImageDraw.Draw(img).rectangle([0, 0, accent_width, height], fill=(37, 99, 235))
+        return img
+
+    img = Image.new("RGB", size, color=(255, 255, 255)).convert("RGBA")
+    return Image.alpha_composite(img, _overlay_layer(size, BASE_OVERLAY_COLOR))
+
+
+def _new_canvas(style, width, height):
+    return _precomposed_canvas(style, (width, height)).copy()
+
+
+def _compose_over_background(background_image, overlay_color):
+    overlay = _overlay_layer(background_image.size, overlay_color)
+    return Image.alpha_composite(background_image.convert("RGBA"), overlay)
+
+
+@render_stage("draw")
+def generate_image_router(image_data, principal=None):
+    """Render `image_data` with its style.
+
+    `principal` is the request's resolved `RenderPrincipal`; without one (regeneration,
+    direct calls) the subscription is looked up from `profile_id`.
+    """
     style = image_data.get("style", "base")
     image_url = image_data.get("image_url") or image_data.get("image_or_logo")
+    if principal is not None:
+        has_pro_subscription = principal.has_pro_subscription
+    else:
+        has_pro_subscription = check_if_profile_has_pro_subscription(image_data.get("profile_id"))
 
     common_kwargs = {
         "profile_id": image_data.get("profile_id"),
+        "has_pro_subscription": has_pro_subscription,
         "site": image_data.get("site"),
         "font": image_data.get("font"),
         "title": image_data.get("title"),
@@ -102,6 +170,7 @@ def generate_image_router(image_data):
         "output_format": image_data.get("format", "png"),
         "quality": image_data.get("quality"),
         "max_kb": image_data.get("max_kb"),
+        "render_key": build_render_key(image_data),
     }
 
     if style == "logo":
@@ -149,6 +218,8 @@ def generate_base_image(
     output_format="png",
     quality=None,
     max_kb=None,
+    render_key=None,
+    has_pro_subscription=False,
 ):
     logger.info(
         "Generating base OG image",
@@ -160,18 +231,13 @@ def generate_base_image(
         eyebrow=eyebrow,
         image_url=image_url,
     )
-    has_pro_subscription = check_if_profile_has_pro_subscription(profile_id)
     width, height = get_image_dimensions(site)
 
     background_image = _load_optional_image(image_url, width, height)
     if background_image is not None:
-        img = background_image
+        img = _compose_over_background(background_image, BASE_OVERLAY_COLOR)
     else:
-        img = Image.new("RGB", (width, height), color=(255, 255, 255))
-
-    overlay = Image.new("RGBA", (width, height), (0, 0, 0, 180))
-    img = img.convert("RGBA")
-    img = Image.alpha_composite(img, overlay)
+        img = _new_canvas("base", width, height)
 
     draw = ImageDraw.Draw(img)
     text_color = (255, 255, 255)
@@ -234,7 +300,9 @@ def generate_base_image(
     if not has_pro_subscription:
         add_watermark(img, draw, width, height)
 
-    return create_image_buffer(img, output_format=output_format, quality=quality, max_kb=max_kb)
+    return create_image_buffer(
+        img, output_format=output_format, quality=quality, max_kb=max_kb, render_key=render_key, style="base"
+    )
 
 
 def generate_logo_image(
@@ -247,6 +315,8 @@ def generate_logo_image(
     output_format="png",
     quality=None,
     max_kb=None,
+    render_key=None,
+    has_pro_subscription=False,
 ):
     logger.info(
         "Generating logo OG image",
@@ -257,11 +327,9 @@ def generate_logo_image(
         subtitle=subtitle,
         image_url=image_url,
     )
-    has_pro_subscription = check_if_profile_has_pro_subscription(profile_id)
     width, height = get_image_dimensions(site)
 
-    background_color = (30, 30, 30)
-    img = Image.new("RGB", (width, height), color=background_color)
+    img = _new_canvas("logo", width, height)
 
     draw = ImageDraw.Draw(img)
     text_color = (255, 255, 255)
@@ -324,7 +392,9 @@ def generate_logo_image(
     if not has_pro_subscription:
         add_watermark(img, draw, width, height)
 
-    return create_image_buffer(img, output_format=output_format, quality=quality, max_kb=max_kb)
+    return create_image_buffer(
+        img, output_format=output_format, quality=quality, max_kb=max_kb, render_key=render_key, style="logo"
+    )
 
 
 def generate_job_classic_image(
@@ -338,18 +408,16 @@ def generate_job_classic_image(
     output_format="png",
     quality=None,
     max_kb=None,
+    render_key=None,
+    has_pro_subscription=False,
 ):
-    has_pro_subscription = check_if_profile_has_pro_subscription(profile_id)
     width, height = get_image_dimensions(site)
 
     background_image = _load_optional_image(image_url, width, height)
     if background_image is not None:
-        img = background_image.convert("RGBA")
+        img = _compose_over_background(background_image, JOB_CLASSIC_OVERLAY_COLOR)
     else:
-        img = Image.new("RGBA", (width, height), color=(24, 32, 46, 255))
-
-    overlay = Image.new("RGBA", (width, height), (0, 0, 0, 130))
-    img = Image.alpha_composite(img, overlay)
+        img = _new_canvas("job_classic", width, height)
 
     draw = ImageDraw.Draw(img)
 
@@ -409,7 +477,9 @@ def generate_job_classic_image(
     if not has_pro_subscription:
         add_watermark(img, draw, width, height)
 
-    return create_image_buffer(img, output_format=output_format, quality=quality, max_kb=max_kb)
+    return create_image_buffer(
+        img, output_format=output_format, quality=quality, max_kb=max_kb, render_key=render_key, style="job_classic"
+    )
 
 
 def generate_job_logo_image(
@@ -423,11 +493,12 @@ def generate_job_logo_image(
     output_format="png",
     quality=None,
     max_kb=None,
+    render_key=None,
+    has_pro_subscription=False,
 ):
-    has_pro_subscription = check_if_profile_has_pro_subscription(profile_id)
     width, height = get_image_dimensions(site)
 
-    img = Image.new("RGB", (width, height), color=(17, 24, 39))
+    img = _new_canvas("job_logo", width, height)
     draw = ImageDraw.Draw(img)
 
     title, subtitle, eyebrow = _normalize_job_copy(title, subtitle, eyebrow)
@@ -513,7 +584,9 @@ def generate_job_logo_image(
     if not has_pro_subscription:
         add_watermark(img, draw, width, height)
 
-    return create_image_buffer(img, output_format=output_format, quality=quality, max_kb=max_kb)
+    return create_image_buffer(
+        img, output_format=output_format, quality=quality, max_kb=max_kb, render_key=render_key, style="job_logo"
+    )
 
 
 def generate_job_clean_image(
@@ -527,11 +600,12 @@ def generate_job_clean_image(
     output_format="png",
     quality=None,
     max_kb=None,
+    render_key=None,
+    has_pro_subscription=False,
 ):
-    has_pro_subscription = check_if_profile_has_pro_subscription(profile_id)
     width, height = get_image_dimensions(site)
 
-    img = Image.new("RGB", (width, height), color=(250, 250, 252))
+    img = _new_canvas("job_clean", width, height)
     draw = ImageDraw.Draw(img)
 
     title, subtitle, eyebrow = _normalize_job_copy(title, subtitle, eyebrow)
@@ -541,8 +615,6 @@ def generate_job_clean_image(
     eyebrow_font = load_font(font, int(height * 0.028))
 
     accent_width = int(width * 0.018)
-    draw.rectangle([0, 0, accent_width, height], fill=(37, 99, 235))
-
     content_left = accent_width + int(width * 0.06)
     max_text_width = int(width * 0.62)
     text_spacing = int(height * 0.014)
@@ -609,4 +681,6 @@ def generate_job_clean_image(
     if not has_pro_subscription:
         add_watermark(img, draw, width, height)
 
-    return create_image_buffer(img, output_format=output_format, quality=quality, max_kb=max_kb)
+    return create_image_buffer(
+        img, output_format=output_format, quality=quality, max_kb=max_kb, render_key=render_key, style="job_clean"
+    )
@@ -1,14 +1,24 @@
+import functools
 import io
 import os
+import threading
+from collections import OrderedDict
 
-import requests
 from django.conf import settings
-from PIL import Image, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 
+from core.font_registry import DEFAULT_FONT_NAME, FontRegistry
+from core.remote_assets import fetch_remote_image
+from core.render_timing import render_stage
+from core.text_layout import layout_text
 from osig.utils import get_osig_logger
 
 logger = get_osig_logger(__name__)
 
+FONTS_DIR = os.path.join(settings.BASE_DIR, "fonts")
+
+font_registry = FontRegistry(max_entries=getattr(settings, "OSIG_FONT_CACHE_MAX_ENTRIES", 128))
+
 
 def get_image_dimensions(site):
     if site.lower() == "meta":
@@ -19,13 +29,17 @@ def get_image_dimensions(site):
     return int(width / 2), int(height / 2)
 
 
-def add_watermark(img, draw, width, height):
-    watermark_text = "made with osig.app"
-    watermark_font = ImageFont.load_default().font_variant(size=int(height * 0.05))
-    watermark_color = (255, 255, 255, 128)  # White with 50% opacity
+WATERMARK_TEXT = "made with osig.app"
+WATERMARK_COLOR = (255, 255, 255, 128)  # White with 50% opacity
+
+
+@functools.lru_cache(maxsize=16)
+def _watermark_stamp(width, height):
+    """Rasterize the watermark once per canvas size; returns its mask and top-left position."""
+    watermark_font = load_default_font(int(height * 0.05))
 
     # Get the size of the watermark text
-    bbox = watermark_font.getbbox(watermark_text)
+    bbox = watermark_font.getbbox(WATERMARK_TEXT)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
 
@@ -33,87 +47,340 @@ def add_watermark(img, draw, width, height):
     x = width - text_width - int(width * 0.02)
     y = height - text_height - int(height * 0.08)
 
-    # Draw the watermark
-    draw.text((x, y), watermark_text, font=watermark_font, fill=watermark_color)
+    # Keep glyphs that start left of / above the origin inside the mask.
+    origin_x, origin_y = max(0, -bbox[0]), max(0, -bbox[1])
+    mask = Image.new("L", (bbox[2] + origin_x, bbox[3] + origin_y), 0)
+    ImageDraw.Draw(mask).text((origin_x, origin_y), WATERMARK_TEXT, font=watermark_font, fill=255)
+
+    return mask, (x - origin_x, y - origin_y)
+
+
+def add_watermark(img, draw, width, height):
+    mask, position = _watermark_stamp(width, height)
+    draw.bitmap(position, mask, fill=WATERMARK_COLOR)
+
+
+def _bold_offset_ranges(bold_offset):
+    """Horizontal and vertical shifts of the faux-bold passes; the line is drawn at every pair of them."""
+    return range(-bold_offset - 1, bold_offset + 1), range(-bold_offset, bold_offset + 1)
+
+
+def _screen_shifted(source, size, positions):
+    merged = Image.new("L", size, 0)
+    for position in positions:
+        shifted = Image.new("L", size, 0)
+        shifted.paste(source, position)
+        merged = ImageChops.screen(merged, shifted)
+    return merged
+
+
+def _bold_text_mask(line, font, bold_offset):
+    """Rasterize a faux-bold title line once: the glyph mask at every bold offset merged into one mask.
+
+    Screen-merging the shifted masks gives the same coverage as drawing the line once per offset.
+    The offsets form a rectangle, so the merge runs along each axis in turn: one pass per shift
+    instead of one per pair. Returns the mask and the offset of the text origin inside it.
+    """
+    bbox = font.getbbox(line)
+    origin_x, origin_y = max(0, -bbox[0]), max(0, -bbox[1])
+    glyphs = Image.new("L", (max(1, bbox[2] + origin_x), max(1, bbox[3] + origin_y)), 0)
+    ImageDraw.Draw(glyphs).text((origin_x, origin_y), line, font=font, fill=255)
+
+    padding = bold_offset + 1
+    size = (glyphs.width + 2 * padding, glyphs.height + 2 * padding)
+    offsets_x, offsets_y = _bold_offset_ranges(bold_offset)
+    columns = _screen_shifted(glyphs, size, [(padding, padding + offset_y) for offset_y in offsets_y])
+    mask = _screen_shifted(columns, size, [(offset_x, 0) for offset_x in offsets_x])
+
+    return mask, (origin_x + padding, origin_y + padding)
+
+
+def draw_title_line(draw, position, line, font, fill, bold_offset):
+    mask, (origin_x, origin_y) = _bold_text_mask(line, font, bold_offset)
+    draw.bitmap((position[0] - origin_x, position[1] - origin_y), mask, fill=fill)
 
 
 def draw_wrapped_text(
     draw, text, font, max_width, y_position, text_spacing, text_color, width, align="left", is_title=False, height=None
 ):
-    words = text.split()
-    lines = []
-    current_line = []
-
-    for word in words:
-        test_line = " ".join(current_line + [word])
-        bbox = font.getbbox(test_line)
-        if bbox[2] <= max_width:
-            current_line.append(word)
-        else:
-            lines.append(" ".join(current_line))
-            current_line = [word]
-
-    if current_line:
-        lines.append(" ".join(current_line))
-
-    for line in lines:
-        bbox = font.getbbox(line)
-        left_margin = (width - bbox[2]) // 2 if align == "center" else 0
+    for line in layout_text(text, font, max_width).lines:
+        left_margin = (width - line.width) // 2 if align == "center" else 0
 
         if is_title and height:
-            bold_offset = int(height * 0.002)
-            for offset_x in range(-bold_offset - 1, bold_offset + 1):
-                for offset_y in range(-bold_offset, bold_offset + 1):
-                    draw.text((left_margin + offset_x, y_position + offset_y), line, font=font, fill=text_color)
+            draw_title_line(draw, (left_margin, y_position), line.text, font, text_color, int(height * 0.002))
         else:
-            draw.text((left_margin, y_position), line, font=font, fill=text_color)
+            draw.text((left_margin, y_position), line.text, font=font, fill=text_color)
 
-        y_position += bbox[3] - bbox[1] + text_spacing
+        y_position += line.height + text_spacing
 
     return y_position
 
 
-def load_font(font, size):
+def load_default_font(size):
+    return font_registry.get_or_load(
+        (DEFAULT_FONT_NAME, size, 0),
+        lambda: ImageFont.load_default().font_variant(size=size),
+    )
+
+
+def _load_font_face(font, size, index):
     try:
-        font_path = os.path.join(settings.BASE_DIR, "fonts", f"{font}.ttc")
-        return ImageFont.truetype(font_path, size)
+        font_path = os.path.join(FONTS_DIR, f"{font}.ttc")
+        return ImageFont.truetype(font_path, size, index=index)
     except Exception as e:
         logger.error("Error loading font", font=font, error=str(e))
-        return ImageFont.load_default().font_variant(size=size)
+        return load_default_font(size)
+
+
+def load_font(font, size, index=0):
+    if font not in _known_font_names():
+        # `font` comes from the query string; unknown names must not evict the warmed faces.
+        return load_default_font(size)
+    return font_registry.get_or_load((font, size, index), lambda: _load_font_face(font, size, index))
+
+
+def available_font_names():
+    try:
+        return sorted(name[: -len(".ttc")] for name in os.listdir(FONTS_DIR) if name.endswith(".ttc"))
+    except OSError:
+        return []
+
+
+@functools.lru_cache(maxsize=1)
+def _known_font_names() -> frozenset[str]:
+    return frozenset(available_font_names())
 
 
-def _render_jpeg_buffer(img, quality):
+def warm_font_cache(sites, size_ratios, watermark_ratio=0.05):
+    """Parse every bundled font at the sizes the styles will ask for on the given sites."""
+    font_names = available_font_names()
+
+    for site in sites:
+        _, height = get_image_dimensions(site)
+        load_default_font(int(height * watermark_ratio))
+
+        for ratio in size_ratios:
+            for font_name in font_names:
+                load_font(font_name, int(height * ratio))
+
+    stats = font_registry.stats()
+    logger.info("Warmed font cache", fonts=font_names, cached_faces=stats.size, max_entries=stats.max_entries)
+    return stats
+
+
+def get_font_cache_stats():
+    return font_registry.stats()
+
+
+OUTPUT_CONTENT_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+DEFAULT_LOSSY_QUALITY = {"jpeg": 85, "webp": 80, "avif": 60}
+# Flat-color styles written as palette PNGs. They keep Pillow's default zlib level: at 8 bits
+# per pixel it costs ~3 ms, and the fastest level saves under 2 ms for ~25% larger files.
+PALETTE_PNG_STYLES = frozenset({"logo", "job_logo", "job_clean"})
+MIN_LOSSY_QUALITY = 20
+
+_quality_by_render_key: OrderedDict[str, int] = OrderedDict()
+_quality_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def supported_output_formats() -> frozenset[str]:
+    """PNG and JPEG always; WebP and AVIF when this Pillow build can encode them."""
+    try:
+        import pillow_avif  # noqa: F401  (registers the AVIF plugin on Pillow < 11.2)
+    except ImportError:
+        pass
+
+    Image.init()
+    formats = {"png", "jpeg"}
+    if "WEBP" in Image.SAVE:
+        formats.add("webp")
+    if "AVIF" in Image.SAVE:
+        formats.add("avif")
+    return frozenset(formats)
+
+
+def _encode_jpeg(img, quality, optimize=True) -> bytes:
     jpeg_buffer = io.BytesIO()
-    img.convert("RGB").save(
+    img.save(
         jpeg_buffer,
         format="JPEG",
         quality=quality,
-        optimize=True,
+        optimize=optimize,
         progressive=False,
     )
-    jpeg_buffer.seek(0)
-    return jpeg_buffer
+    return jpeg_buffer.getvalue()
+
+
+def _encode_webp(img, quality, optimize=True) -> bytes:
+    webp_buffer = io.BytesIO()
+    # method trades encode time for size, like JPEG's optimize pass.
+    img.save(webp_buffer, format="WEBP", quality=quality, method=4 if optimize else 0)
+    return webp_buffer.getvalue()
+
+
+def _encode_avif(img, quality, optimize=True) -> bytes:
+    avif_buffer = io.BytesIO()
+    img.save(avif_buffer, format="AVIF", quality=quality, speed=6 if optimize else 10)
+    return avif_buffer.getvalue()
+
+
+def _lossy_encoder(output_format):
+    return {"jpeg": _encode_jpeg, "webp": _encode_webp, "avif": _encode_avif}[output_format]
+
+
+def _highest_fitting_quality(fits, low, high, guess=None):
+    """Highest quality in [low, high] for which `fits` holds, assuming size grows with quality.
+
+    With a guess, gallop outwards from it, so a good estimate settles in two or three
+    probes instead of a full bisection. Returns None if not even `low` fits.
+    """
+    best = None
+
+    if guess is not None and low <= guess <= high:
+        step = 1
+        if fits(guess):
+            best, low = guess, guess + 1
+            while low <= high:
+                probe = min(guess + step, high)
+                if not fits(probe):
+                    high = probe - 1
+                    break
+                best, low = probe, probe + 1
+                step *= 2
+        else:
+            high = guess - 1
+            while low <= high:
+                probe = max(guess - step, low)
+                if fits(probe):
+                    best, low = probe, probe + 1
+                    break
+                high = probe - 1
+                step *= 2
+
+    while low <= high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            best, low = middle, middle + 1
+        else:
+            high = middle - 1
+
+    return best
+
+
+def _estimate_quality(img, encode, start_quality, start_size, target_size):
+    """Guess the quality that hits `target_size` from cheap encodes of a half-size copy.
+
+    The full/half size ratio at the starting quality calibrates the half-size encodes.
+    """
+    preview = img.reduce(2)
+    preview_start_size = len(encode(preview, start_quality, optimize=False))
+    if not preview_start_size:
+        return None
+
+    scale = start_size / preview_start_size
+    return _highest_fitting_quality(
+        lambda q: len(encode(preview, q, optimize=False)) * scale <= target_size,
+        MIN_LOSSY_QUALITY,
+        start_quality - 1,
+    )
+
 
+def _remember_quality(render_key, quality):
+    with _quality_lock:
+        _quality_by_render_key[render_key] = quality
+        _quality_by_render_key.move_to_end(render_key)
+        while len(_quality_by_render_key) > getattr(settings, "OSIG_QUALITY_CACHE_MAX_ENTRIES", 4096):
+            _quality_by_render_key.popitem(last=False)
 
-def create_image_buffer(img, output_format="png", quality=None, max_kb=None):
+
+def _recall_quality(render_key):
+    with _quality_lock:
+        return _quality_by_render_key.get(render_key)
+
+
+def clear_quality_cache():
+    with _quality_lock:
+        _quality_by_render_key.clear()
+
+
+def _encode_within_size(img, output_format, start_quality, target_size, render_key=None) -> bytes:
+    """Best-quality lossy encode no larger than `target_size`, bottoming out at MIN_LOSSY_QUALITY."""
+    encode = _lossy_encoder(output_format)
+    encoded: dict[int, bytes] = {}
+
+    def fits(quality):
+        if quality not in encoded:
+            encoded[quality] = encode(img, quality)
+        return len(encoded[quality]) <= target_size
+
+    if render_key is not None:
+        remembered = _recall_quality(render_key)
+        if remembered is not None and (fits(remembered) or remembered == MIN_LOSSY_QUALITY):
+            return encoded[remembered]
+
+    if fits(start_quality) or start_quality <= MIN_LOSSY_QUALITY:
+        return encoded[start_quality]
+
+    guess = _estimate_quality(img, encode, start_quality, len(encoded[start_quality]), target_size)
+    if guess is None and not fits(MIN_LOSSY_QUALITY):
+        # The estimate says even the floor is too big; confirmed, so don't search.
+        quality = None
+    else:
+        quality = _highest_fitting_quality(fits, MIN_LOSSY_QUALITY, start_quality - 1, guess=guess)
+
+    if quality is None:
+        quality = MIN_LOSSY_QUALITY
+        fits(quality)
+
+    if render_key is not None:
+        _remember_quality(render_key, quality)
+
+    return encoded[quality]
+
+
+def _flat_color_palette(img):
+    """Lossless 8-bit palette version of `img`, or None if it has more than 256 colors."""
+    if img.getcolors(256) is None:
+        return None
+
+    # Median cut gives each color its own entry when there are no more colors than entries.
+    # quantize(palette=...) is not exact: it matches colors through a 5-6-5 bit lookup.
+    return img.quantize(256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+
+
+@render_stage("encode")
+def create_image_buffer(img, output_format="png", quality=None, max_kb=None, render_key=None, style=None):
     output_format = (output_format or "png").lower()
 
-    if output_format == "jpeg":
-        jpeg_quality = 85 if quality is None else max(1, min(int(quality), 100))
-        buffer = _render_jpeg_buffer(img, jpeg_quality)
+    if output_format in DEFAULT_LOSSY_QUALITY and output_format in supported_output_formats():
+        img = img.convert("RGB")
+        start_quality = DEFAULT_LOSSY_QUALITY[output_format] if quality is None else max(1, min(int(quality), 100))
 
         if max_kb:
-            target_size = int(max_kb) * 1024
-            while len(buffer.getvalue()) > target_size and jpeg_quality > 20:
-                jpeg_quality = max(20, jpeg_quality - 5)
-                buffer = _render_jpeg_buffer(img, jpeg_quality)
+            content = _encode_within_size(img, output_format, start_quality, int(max_kb) * 1024, render_key=render_key)
+        else:
+            content = _lossy_encoder(output_format)(img, start_quality)
 
+        buffer = io.BytesIO(content)
+        buffer.seek(0)
         return buffer
 
     buffer = io.BytesIO()
     img = img.convert("RGB")
 
-    if quality is None:
+    palette_img = _flat_color_palette(img) if style in PALETTE_PNG_STYLES else None
+    if palette_img is not None and quality is None:
+        palette_img.save(buffer, format="PNG")
+    elif palette_img is not None:
+        compress_level = round((100 - max(1, min(int(quality), 100))) * 9 / 100)
+        palette_img.save(buffer, format="PNG", compress_level=compress_level)
+    elif quality is None:
         img.save(buffer, format="PNG")
     else:
         png_quality = max(1, min(int(quality), 100))
@@ -125,8 +392,4 @@ def create_image_buffer(img, output_format="png", quality=None, max_kb=None):
 
 
 def load_and_resize_image(image_url, width, height):
-    timeout_seconds = getattr(settings, "OSIG_IMAGE_FETCH_TIMEOUT_SECONDS", 8)
-    response = requests.get(image_url, timeout=timeout_seconds)
-    response.raise_for_status()
-    img = Image.open(io.BytesIO(response.content)).convert("RGB")
-    return img.resize((width, height), Image.LANCZOS)
+    return fetch_remote_image(image_url, width, height)
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:47
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Frozen copy of `core.render_cache.build_render_key` as of this migration, so later changes
+# to the live key format can't change what this migration writes.
+RENDER_TEMPLATE_VERSION = "1"
+DERIVED_PARAM_KEYS = frozenset({"profile_id"})
+
+
+def build_render_key(params):
+    canonical = {
+        key: value
+        for key, value in sorted(params.items())
+        if key not in DERIVED_PARAM_KEYS and value not in (None, "")
+    }
+    payload = json.dumps(
+        {"template_version": RENDER_TEMPLATE_VERSION, "params": canonical},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def backfill_render_keys(apps, schema_editor):
+    Image = apps.get_model("core", "Image")
+
+    last_id = 0
+    while True:
+        batch = list(Image.objects.filter(id__gt=last_id, render_key=None).order_by("id")[:BACKFILL_BATCH_SIZE])
+        if not batch:
+            break
+
+        keys_by_image = {image.id: build_render_key(image.image_data or {}) for image in batch}
+        taken_keys = set(
+            Image.objects.filter(render_key__in=set(keys_by_image.values())).values_list("render_key", flat=True)
+        )
+
+        updated = []
+        for image in batch:
+            render_key = keys_by_image[image.id]
+            # Older rows can share identical image_data; the oldest one keeps the key.
+            if render_key in taken_keys:
+                continue
+
+            taken_keys.add(render_key)
+            image.render_key = render_key
+            updated.append(image)
+
+        Image.objects.bulk_update(updated, ["render_key"])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0011_renderattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='render_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_render_keys, migrations.RunPython.noop),
+    ]
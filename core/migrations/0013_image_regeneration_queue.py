@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0012_image_render_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='content_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='regeneration_requested_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_image_regeneration_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renderattempt',
+            name='sample_weight',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
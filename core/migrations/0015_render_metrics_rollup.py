@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:46
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_renderattempt_sample_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderMetricsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bucket_start', models.DateTimeField(db_index=True)),
+                ('style', models.CharField(blank=True, max_length=64)),
+                ('error_type', models.CharField(blank=True, max_length=64)),
+                ('attempts', models.FloatField(default=0)),
+                ('failed_attempts', models.PositiveIntegerField(default=0)),
+                ('latency_histogram', models.JSONField(default=list)),
+                ('max_duration_ms', models.PositiveIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket_start', 'style', 'error_type'), name='unique_render_metrics_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_render_metrics_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renderattempt',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
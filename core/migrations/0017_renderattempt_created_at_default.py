@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_renderattempt_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='renderattempt',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('core', '0017_renderattempt_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='regeneration_queued_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -102,7 +102,11 @@ class Image(BaseModel):
     profile = models.ForeignKey(Profile, null=True, blank=True, on_delete=models.SET_NULL, related_name="images")
     key = models.CharField(max_length=12, blank=True)
     image_data = models.JSONField(null=True, blank=True, default=dict)
+    render_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     generated_image = models.ImageField(upload_to="generated_images/", blank=True)
+    content_sha256 = models.CharField(max_length=64, blank=True, editable=False)
+    regeneration_requested_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+    regeneration_queued_at = models.DateTimeField(null=True, blank=True, editable=False)
 
 
 class RenderAttempt(BaseModel):
@@ -113,6 +117,33 @@ class RenderAttempt(BaseModel):
     error_type = models.CharField(max_length=64, blank=True)
     duration_ms = models.PositiveIntegerField(default=0)
     attempt_number = models.PositiveSmallIntegerField(default=1)
+    # How many attempts this row stands for when successes are sampled.
+    sample_weight = models.FloatField(default=1.0)
+    # Milliseconds per render stage (fetch, decode, layout, draw, encode...) of this attempt.
+    stage_timings = models.JSONField(default=dict, blank=True)
+    # Set when the attempt is recorded, not when its buffered batch is written.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+
+class RenderMetricsRollup(BaseModel):
+    """Render attempts of one hour, style and error type, pre-aggregated for the metrics API."""
+
+    bucket_start = models.DateTimeField(db_index=True)
+    style = models.CharField(max_length=64, blank=True)
+    error_type = models.CharField(max_length=64, blank=True)
+    # Weighted by `RenderAttempt.sample_weight`.
+    attempts = models.FloatField(default=0)
+    failed_attempts = models.PositiveIntegerField(default=0)
+    # Weighted success counts per `LATENCY_BUCKET_BOUNDS_MS` bucket, plus one overflow bucket.
+    latency_histogram = models.JSONField(default=list)
+    max_duration_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=["bucket_start", "style", "error_type"], name="unique_render_metrics_rollup_bucket"
+            ),
+        )
 
 
 class BlogPost(BaseModel):
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.models import Profile
+from core.usage import usage_limits
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+PRINCIPAL_CACHE_KEY_PREFIX = "osig:principal:"
+# Cached for keys that don't belong to any profile, so bad keys don't hit the database either.
+UNKNOWN_KEY = "unknown"
+
+
+@dataclass(frozen=True)
+class RenderPrincipal:
+    """Who a keyed render is for, resolved once per request and passed down to the styles."""
+
+    profile_id: int
+    key: str
+    has_pro_subscription: bool
+    daily_limit: int | None
+    monthly_limit: int | None
+
+    @property
+    def usage_limits(self) -> dict[str, int | None]:
+        return {"daily": self.daily_limit, "monthly": self.monthly_limit}
+
+
+def _principal_cache():
+    return caches[getattr(settings, "OSIG_USAGE_CACHE_ALIAS", "default")]
+
+
+def _cache_key(key: str) -> str:
+    return f"{PRINCIPAL_CACHE_KEY_PREFIX}{key}"
+
+
+def resolve_render_principal(key: str) -> RenderPrincipal | None:
+    """The principal for an API key, from a short-TTL cache or a single query."""
+    cache = _principal_cache()
+    try:
+        cached = cache.get(_cache_key(key))
+    except Exception as e:
+        logger.warning("Render principal cache read failed", error=str(e))
+        cached = None
+
+    if cached == UNKNOWN_KEY:
+        return None
+    if cached is not None:
+        return cached
+
+    row = Profile.objects.filter(key=key).values("id", "subscription_id").first()
+    limits = usage_limits()
+    principal = (
+        RenderPrincipal(
+            profile_id=row["id"],
+            key=key,
+            has_pro_subscription=row["subscription_id"] is not None,
+            daily_limit=limits["daily"],
+            monthly_limit=limits["monthly"],
+        )
+        if row is not None
+        else None
+    )
+
+    try:
+        cache.set(
+            _cache_key(key),
+            principal if principal is not None else UNKNOWN_KEY,
+            timeout=getattr(settings, "OSIG_PRINCIPAL_CACHE_TTL_SECONDS", 60),
+        )
+    except Exception as e:
+        logger.warning("Render principal cache write failed", error=str(e))
+
+    return principal
+
+
+def invalidate_render_principal(key: str):
+    try:
+        _principal_cache().delete(_cache_key(key))
+    except Exception as e:
+        logger.warning("Render principal cache delete failed", error=str(e))
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from core.models import Image
+from core.tasks import regenerate_and_update_image
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+SCHEDULED_MARKER_PREFIX = "osig:regeneration-scheduled:"
+SWEEP_LOCK_KEY = "osig:regeneration-sweep-lock"
+
+
+def _marker_cache():
+    return caches[getattr(settings, "OSIG_RENDER_CACHE_ALIAS", "default")]
+
+
+def max_age_for_style(style: str) -> timedelta | None:
+    """How old a stored render of `style` may get before it's regenerated; None means never."""
+    per_style = getattr(settings, "OSIG_REGENERATION_MAX_AGE_BY_STYLE", {})
+    seconds = per_style.get(style, getattr(settings, "OSIG_REGENERATION_MAX_AGE_SECONDS", None))
+    return timedelta(seconds=seconds) if seconds is not None else None
+
+
+def is_stale(updated_at: datetime | None, style: str, now: datetime | None = None) -> bool:
+    max_age = max_age_for_style(style)
+    if updated_at is None or max_age is None:
+        return False
+    return updated_at <= (now or timezone.now()) - max_age
+
+
+def request_regeneration(image_id: int | None, updated_at: datetime | None, style: str) -> bool:
+    """Queue a stale stored render for the next sweep. Cheap enough to call on every cache hit.
+
+    The per-image marker means a popular image costs one cache `add` per hit and a single
+    UPDATE per marker TTL, instead of one django-q task per hit.
+    """
+    if image_id is None or not is_stale(updated_at, style):
+        return False
+
+    marker_ttl = getattr(settings, "OSIG_REGENERATION_MARKER_TTL_SECONDS", 60 * 60)
+    try:
+        if not _marker_cache().add(f"{SCHEDULED_MARKER_PREFIX}{image_id}", 1, timeout=marker_ttl):
+            return False
+    except Exception as e:
+        logger.warning("Regeneration marker write failed", image_id=image_id, error=str(e))
+        return False
+
+    return bool(
+        Image.objects.filter(id=image_id, regeneration_requested_at__isnull=True).update(
+            regeneration_requested_at=timezone.now()
+        )
+    )
+
+
+def regenerate_requested_image(image_id: int) -> str:
+    """Regenerate one image queued by the sweep, unless an earlier task already did."""
+    requested = Image.objects.filter(id=image_id, regeneration_requested_at__isnull=False).values("image_data").first()
+    if requested is None:
+        return "Skipped, already regenerated"
+
+    try:
+        return regenerate_and_update_image(image_id, requested["image_data"] or {})
+    except Exception:
+        # A later hit requests it again once the marker expires.
+        Image.objects.filter(id=image_id).update(regeneration_requested_at=None, regeneration_queued_at=None)
+        raise
+
+
+def sweep_stale_renders() -> str:
+    """Queue a regeneration task for each of up to OSIG_REGENERATION_SWEEP_BATCH_SIZE requested images.
+
+    Runs from the django-q schedule every OSIG_REGENERATION_SWEEP_MINUTES, so batch size over
+    interval is the global regeneration rate. Each image is its own task, so one render never
+    shares the cluster timeout with the rest of the batch. Overlapping sweeps are skipped.
+
+    Queued images are stamped and left out of later sweeps, so a backed-up queue doesn't get
+    the same batch again every run. A stamp older than OSIG_REGENERATION_REQUEUE_SECONDS is
+    taken as a lost task and the image is queued again.
+    """
+    sweep_minutes = getattr(settings, "OSIG_REGENERATION_SWEEP_MINUTES", 10)
+    if not _marker_cache().add(SWEEP_LOCK_KEY, 1, timeout=sweep_minutes * 60):
+        return "Skipped, a sweep is already running"
+
+    try:
+        batch_size = getattr(settings, "OSIG_REGENERATION_SWEEP_BATCH_SIZE", 50)
+        now = timezone.now()
+        requeue_before = now - timedelta(seconds=getattr(settings, "OSIG_REGENERATION_REQUEUE_SECONDS", 60 * 60))
+        image_ids = list(
+            Image.objects.filter(regeneration_requested_at__isnull=False)
+            .filter(Q(regeneration_queued_at__isnull=True) | Q(regeneration_queued_at__lte=requeue_before))
+            .order_by("regeneration_requested_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        Image.objects.filter(id__in=image_ids).update(regeneration_queued_at=now)
+
+        # A requeued image whose first task does run after all is skipped by the second one.
+        for image_id in image_ids:
+            async_task(regenerate_requested_image, image_id)
+
+        return f"Queued {len(image_ids)} stale images for regeneration"
+    finally:
+        _marker_cache().delete(SWEEP_LOCK_KEY)
@@ -0,0 +1,405 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from PIL import Image
+
+from core.http_client import FetchedResponse, fetch_url
+from core.render_observability import classify_render_error, is_transient_error
+from core.render_timing import render_stage
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+
+# Shrink by integer factors until within this multiple of the target size, then LANCZOS.
+RESIZE_REDUCING_GAP = 3.0
+
+
+class SourceImageTooLargeError(ValueError):
+    """The remote image has more pixels than OSIG_IMAGE_MAX_PIXELS."""
+
+
+@dataclass(frozen=True)
+class AssetMetadata:
+    url: str
+    etag: str = ""
+    last_modified: str = ""
+    fetched_at: float = 0.0
+
+
+def _fresh_seconds() -> int:
+    return getattr(settings, "OSIG_REMOTE_ASSET_FRESH_SECONDS", 60 * 60)
+
+
+def _negative_ttl_seconds() -> int:
+    return getattr(settings, "OSIG_REMOTE_ASSET_NEGATIVE_TTL_SECONDS", 5 * 60)
+
+
+def _cache_dir() -> str:
+    return getattr(settings, "OSIG_REMOTE_ASSET_CACHE_DIR", "") or os.path.join(
+        tempfile.gettempdir(), "osig-remote-assets"
+    )
+
+
+def _disk_max_bytes() -> int:
+    return getattr(settings, "OSIG_REMOTE_ASSET_DISK_MAX_BYTES", 512 * 1024 * 1024)
+
+
+def _image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class _DecodedImageCache:
+    """LRU of decoded, resized images keyed by (url, width, height), bounded by pixel bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: OrderedDict[tuple[str, int, int], tuple[float, Image.Image]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, key) -> tuple[float, Image.Image] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, fresh_until: float, image: Image.Image):
+        size = _image_bytes(image)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= _image_bytes(previous[1])
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (fresh_until, image)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._total_bytes -= _image_bytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+class _NegativeCache:
+    """Recent non-transient failures per URL. URLs come from users, so entries are capped."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, int(max_entries))
+        self._failures: OrderedDict[str, tuple[float, Exception]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._failures)
+
+    def get(self, url: str) -> Exception | None:
+        with self._lock:
+            entry = self._failures.get(url)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._failures[url]
+                return None
+            return entry[1]
+
+    def set(self, url: str, error: Exception, ttl_seconds: int):
+        now = time.monotonic()
+        with self._lock:
+            self._failures.pop(url, None)
+            # Don't keep the failed call's frames (and the bytes they hold) alive.
+            self._failures[url] = (now + ttl_seconds, error.with_traceback(None))
+            # Entries are kept in insertion order, so expired ones are at the front.
+            while self._failures and next(iter(self._failures.values()))[0] <= now:
+                self._failures.popitem(last=False)
+            while len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._failures.clear()
+
+
+class _DiskBudget:
+    """Keeps the disk cache under OSIG_REMOTE_ASSET_DISK_MAX_BYTES, evicting the least recently used.
+
+    Writes are tallied in memory. The directory is only scanned, and pruned to 90% of the
+    budget, once the tally crosses the budget or a minute has passed since the last scan,
+    since other processes write to it too.
+    """
+
+    RESCAN_SECONDS = 60
+
+    def __init__(self):
+        self._estimated_bytes: int | None = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def record_write(self, directory: str, size: int):
+        max_bytes = _disk_max_bytes()
+        with self._lock:
+            if (
+                self._estimated_bytes is not None
+                and time.monotonic() - self._scanned_at < self.RESCAN_SECONDS
+                and self._estimated_bytes + size <= max_bytes
+            ):
+                self._estimated_bytes += size
+                return
+
+            self._estimated_bytes = _prune_disk_cache(directory, max_bytes)
+            self._scanned_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._estimated_bytes = None
+
+
+def _prune_disk_cache(directory: str, max_bytes: int) -> int:
+    """Delete the least recently used entries until `directory` fits; returns its size after."""
+    total_bytes = 0
+    entries = []
+    try:
+        with os.scandir(directory) as scanned:
+            for entry in scanned:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                total_bytes += stat.st_size
+                if entry.name.endswith(".bin"):
+                    entries.append((stat.st_mtime, entry.path))
+    except OSError as e:
+        logger.warning("Failed to scan remote asset cache", directory=directory, error=str(e))
+        return total_bytes
+
+    if total_bytes <= max_bytes:
+        return total_bytes
+
+    for _, content_path in sorted(entries):
+        if total_bytes <= max_bytes * 0.9:
+            break
+        for path in (content_path, f"{content_path[: -len('.bin')]}.json"):
+            try:
+                size = os.path.getsize(path)
+                os.unlink(path)
+                total_bytes -= size
+            except OSError:
+                pass
+
+    return total_bytes
+
+
+_decoded_images = _DecodedImageCache(getattr(settings, "OSIG_REMOTE_ASSET_MEMORY_MAX_BYTES", 64 * 1024 * 1024))
+_negative_cache = _NegativeCache(getattr(settings, "OSIG_REMOTE_ASSET_NEGATIVE_MAX_ENTRIES", 4096))
+_disk_budget = _DiskBudget()
+
+
+def _asset_paths(url: str) -> tuple[str, str]:
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    directory = _cache_dir()
+    return os.path.join(directory, f"{digest}.bin"), os.path.join(directory, f"{digest}.json")
+
+
+def _atomic_write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _read_disk_entry(url: str) -> tuple[AssetMetadata, bytes] | None:
+    content_path, metadata_path = _asset_paths(url)
+    try:
+        with open(metadata_path, encoding="utf-8") as metadata_file:
+            metadata = AssetMetadata(**json.load(metadata_file))
+        with open(content_path, "rb") as content_file:
+            content = content_file.read()
+    except (OSError, ValueError, TypeError):
+        return None
+
+    if metadata.url != url:
+        return None
+
+    try:
+        # Reads count as use, so eviction drops the least recently used entries.
+        os.utime(content_path)
+    except OSError:
+        pass
+
+    return metadata, content
+
+
+def _write_disk_entry(metadata: AssetMetadata, content: bytes | None):
+    content_path, metadata_path = _asset_paths(metadata.url)
+    encoded_metadata = json.dumps(metadata.__dict__).encode("utf-8")
+    try:
+        if content is not None:
+            _atomic_write(content_path, content)
+        _atomic_write(metadata_path, encoded_metadata)
+    except OSError as e:
+        logger.warning("Failed to write remote asset cache", url=metadata.url, error=str(e))
+        return
+
+    if content is not None:
+        _disk_budget.record_write(os.path.dirname(content_path), len(content) + len(encoded_metadata))
+
+
+def _fetch(url: str, cached_metadata: AssetMetadata | None) -> FetchedResponse:
+    headers = {}
+    if cached_metadata is not None:
+        if cached_metadata.etag:
+            headers["If-None-Match"] = cached_metadata.etag
+        if cached_metadata.last_modified:
+            headers["If-Modified-Since"] = cached_metadata.last_modified
+
+    return fetch_url(url, headers=headers)
+
+
+@render_stage("fetch")
+def _load_content(url: str) -> tuple[bytes, bool]:
+    """Return the asset bytes and whether they changed since the last time we decoded them.
+
+    Fresh disk entries are used as-is. Stale ones are revalidated with the stored ETag /
+    Last-Modified; on a transient upstream failure the stale bytes are served instead.
+    """
+    disk_entry = _read_disk_entry(url)
+    if disk_entry is not None:
+        metadata, content = disk_entry
+        if time.time() - metadata.fetched_at < _fresh_seconds():
+            return content, False
+    else:
+        metadata, content = None, None
+
+    try:
+        response = _fetch(url, metadata)
+    except Exception as exc:
+        if content is not None and is_transient_error(classify_render_error(exc)):
+            logger.warning("Serving stale remote asset after failed revalidation", url=url, error=str(exc))
+            return content, False
+        raise
+
+    if response.status_code == 304 and content is not None:
+        _write_disk_entry(
+            AssetMetadata(
+                url=url,
+                etag=response.headers.get("ETag", metadata.etag),
+                last_modified=response.headers.get("Last-Modified", metadata.last_modified),
+                fetched_at=time.time(),
+            ),
+            content=None,
+        )
+        return content, False
+
+    content = response.content
+    _write_disk_entry(
+        AssetMetadata(
+            url=url,
+            etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""),
+            fetched_at=time.time(),
+        ),
+        content=content,
+    )
+    return content, True
+
+
+@render_stage("decode")
+def decode_and_resize(content: bytes, width: int, height: int) -> Image.Image:
+    """Decode `content` no larger than it needs to be and resize it to `width` x `height`.
+
+    `Image.open` only reads the header, so the pixel cap is checked before anything is
+    decoded. JPEGs are then decoded straight at a reduced DCT scale via `draft`, and the
+    resize shrinks by whole factors with `reduce` before the final LANCZOS pass.
+    """
+    img = Image.open(io.BytesIO(content))
+
+    max_pixels = getattr(settings, "OSIG_IMAGE_MAX_PIXELS", 40_000_000)
+    if img.width * img.height > max_pixels:
+        raise SourceImageTooLargeError(f"Source image is {img.width}x{img.height}, limit is {max_pixels} pixels")
+
+    if img.format == "JPEG":
+        img.draft("RGB", (width, height))
+
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    resized = img.resize((width, height), Image.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+    return resized if resized.mode == "RGB" else resized.convert("RGB")
+
+
+def fetch_remote_image(url: str, width: int, height: int) -> Image.Image:
+    """Download (or reuse) `url` and return it decoded and resized to `width` x `height`.
+
+    Callers get their own copy and may mutate it.
+    """
+    memory_key = (url, width, height)
+    cached = _decoded_images.get(memory_key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1].copy()
+
+    cached_error = _negative_cache.get(url)
+    if cached_error is not None:
+        raise cached_error
+
+    try:
+        content, changed = _load_content(url)
+        if cached is not None and not changed:
+            image = cached[1]
+        else:
+            image = decode_and_resize(content, width, height)
+    except Exception as exc:
+        if not is_transient_error(classify_render_error(exc)):
+            _negative_cache.set(url, exc, _negative_ttl_seconds())
+        raise
+
+    _decoded_images.set(memory_key, time.monotonic() + _fresh_seconds(), image)
+    return image.copy()
+
+
+def prefetch_remote_asset(url: str) -> bool:
+    """Make sure fresh bytes for `url` are on disk, so the render itself doesn't hit the network.
+
+    Failures are only logged (and negatively cached as usual); the render surfaces them.
+    """
+    if _negative_cache.get(url) is not None:
+        return False
+
+    try:
+        _load_content(url)
+    except Exception as exc:
+        if not is_transient_error(classify_render_error(exc)):
+            _negative_cache.set(url, exc, _negative_ttl_seconds())
+        logger.info("Remote asset prefetch failed", url=url, error=str(exc))
+        return False
+
+    return True
+
+
+def clear_remote_asset_memory_cache():
+    _decoded_images.clear()
+    _negative_cache.clear()
+    _disk_budget.reset()
@@ -0,0 +1,475 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from typing import Any
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files import File
+
+from core.models import Image
+from core.render_timing import render_stage
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+# Bump whenever a style change should invalidate every previously rendered image.
+RENDER_TEMPLATE_VERSION = "1"
+
+# Params derived server-side from other params; they never change the rendered bytes.
+DERIVED_PARAM_KEYS = frozenset({"profile_id"})
+
+SHARED_CACHE_KEY_PREFIX = "osig:render:"
+LOCATION_CACHE_KEY_PREFIX = "osig:render-location:"
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Hex digits of the content hash carried in ETags.
+CONTENT_VERSION_LENGTH = 16
+
+
+class CacheHitMode:
+    PROXY = "proxy"
+    REDIRECT = "redirect"
+    SIGNED_REDIRECT = "signed_redirect"
+
+
+class CacheLayer:
+    MEMORY = "memory"
+    SHARED = "shared"
+    STORAGE = "storage"
+
+
+CACHE_LAYERS = (CacheLayer.MEMORY, CacheLayer.SHARED, CacheLayer.STORAGE)
+
+
+@dataclass(frozen=True)
+class CachedRender:
+    """Rendered bytes, or for large stored objects only where to stream them from (`content` is None)."""
+
+    content: bytes | None
+    image_id: int | None = None
+    updated_at: datetime | None = None
+    storage_name: str | None = None
+    content_length: int | None = None
+    content_sha256: str | None = None
+    # The opened object a streamed render is read from; never cached with the render.
+    source: Any = field(default=None, compare=False, repr=False)
+
+    @property
+    def size(self) -> int:
+        return len(self.content) if self.content is not None else self.content_length or 0
+
+    @property
+    def is_streamed(self) -> bool:
+        return self.content is None
+
+    @property
+    def content_version(self) -> str | None:
+        """Short hash of the rendered bytes, or None for a streamed render stored without one."""
+        if self.content_sha256:
+            return self.content_sha256[:CONTENT_VERSION_LENGTH]
+        if self.content is not None:
+            return content_version(self.content)
+        return None
+
+
+def content_version(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()[:CONTENT_VERSION_LENGTH]
+
+
+def canonical_render_params(params: Mapping[str, Any]) -> dict[str, Any]:
+    return {
+        key: value for key, value in sorted(params.items()) if key not in DERIVED_PARAM_KEYS and value not in (None, "")
+    }
+
+
+def build_render_key(params: Mapping[str, Any]) -> str:
+    payload = json.dumps(
+        {"template_version": RENDER_TEMPLATE_VERSION, "params": canonical_render_params(params)},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ByteBudgetLRU:
+    """Thread-safe LRU of `CachedRender`s bounded by total content bytes and entry age."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl_seconds = max(0, int(ttl_seconds))
+        self._entries: OrderedDict[str, tuple[float, CachedRender]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> CachedRender | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, cached = entry
+            if expires_at <= time.monotonic():
+                self._pop(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return cached
+
+    def set(self, key: str, cached: CachedRender):
+        if cached.size > self.max_bytes or self.ttl_seconds == 0:
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, cached)
+            self._total_bytes += cached.size
+
+            while self._total_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._pop(oldest_key)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1].size
+
+
+class _LayerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {layer: {"hits": 0, "misses": 0} for layer in CACHE_LAYERS}
+
+    def record(self, layer: str, hit: bool):
+        with self._lock:
+            self._counts[layer]["hits" if hit else "misses"] += 1
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            snapshot = {}
+            for layer, counts in self._counts.items():
+                total = counts["hits"] + counts["misses"]
+                snapshot[layer] = {
+                    "hits": counts["hits"],
+                    "misses": counts["misses"],
+                    "hit_rate_percent": round((counts["hits"] / total) * 100, 2) if total else 0.0,
+                }
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            for counts in self._counts.values():
+                counts["hits"] = 0
+                counts["misses"] = 0
+
+
+_memory_cache = ByteBudgetLRU(
+    max_bytes=getattr(settings, "OSIG_RENDER_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    ttl_seconds=getattr(settings, "OSIG_RENDER_CACHE_TTL_SECONDS", 300),
+)
+_stats = _LayerStats()
+
+
+def _shared_cache():
+    return caches[getattr(settings, "OSIG_RENDER_CACHE_ALIAS", "default")]
+
+
+def _shared_cache_key(render_key: str) -> str:
+    return f"{SHARED_CACHE_KEY_PREFIX}{render_key}"
+
+
+def _max_shared_item_bytes() -> int:
+    return getattr(settings, "OSIG_RENDER_CACHE_MAX_ITEM_BYTES", 2 * 1024 * 1024)
+
+
+def _get_shared(render_key: str) -> CachedRender | None:
+    try:
+        return _shared_cache().get(_shared_cache_key(render_key))
+    except Exception as e:
+        logger.warning("Shared render cache read failed", render_key=render_key, error=str(e))
+        return None
+
+
+def _set_shared(render_key: str, cached: CachedRender):
+    if cached.size > _max_shared_item_bytes():
+        return
+
+    try:
+        _shared_cache().set(
+            _shared_cache_key(render_key),
+            cached,
+            timeout=getattr(settings, "OSIG_RENDER_CACHE_SHARED_TTL_SECONDS", 60 * 60 * 24),
+        )
+    except Exception as e:
+        logger.warning("Shared render cache write failed", render_key=render_key, error=str(e))
+
+
+def _stream_min_bytes() -> int:
+    return getattr(settings, "OSIG_RENDER_STREAM_MIN_BYTES", 1024 * 1024)
+
+
+def _open_stored_render(storage_name: str) -> tuple[Any, int]:
+    """Open a stored render once, returning a readable source and its size in bytes.
+
+    On local disk this is the file itself. For S3 it is the body of a single GET, whose
+    ContentLength gives the size without a separate HEAD (`S3File` would also download the
+    whole object before its first read). Other storages return their `File`.
+    """
+    storage = Image._meta.get_field("generated_image").storage
+    try:
+        path = storage.path(storage_name)
+    except NotImplementedError:
+        path = None
+    if path is not None:
+        return open(path, "rb"), os.path.getsize(path)
+
+    stored_file = storage.open(storage_name, "rb")
+    s3_object = getattr(stored_file, "obj", None)
+    if s3_object is not None:
+        response = s3_object.get()
+        return response["Body"], response["ContentLength"]
+
+    return stored_file, stored_file.size
+
+
+@render_stage("storage")
+def _load_from_storage(render_key: str) -> CachedRender | None:
+    """Load the stored render, or for a large one keep its opened source to stream from."""
+    existing_image = Image.objects.filter(render_key=render_key).first()
+    if not existing_image or not existing_image.generated_image:
+        return None
+
+    try:
+        source, size = _open_stored_render(existing_image.generated_image.name)
+    except FileNotFoundError:
+        logger.error(f"Generated image file not found for image_id: {existing_image.id}")
+        return None
+
+    if size > _stream_min_bytes():
+        return CachedRender(
+            content=None,
+            image_id=existing_image.id,
+            updated_at=existing_image.updated_at,
+            storage_name=existing_image.generated_image.name,
+            content_length=size,
+            content_sha256=existing_image.content_sha256 or None,
+            source=source,
+        )
+
+    try:
+        content = source.read()
+    finally:
+        source.close()
+
+    return CachedRender(
+        content=content,
+        image_id=existing_image.id,
+        updated_at=existing_image.updated_at,
+        storage_name=existing_image.generated_image.name,
+        content_sha256=existing_image.content_sha256 or hashlib.sha256(content).hexdigest(),
+    )
+
+
+def stored_render_body(source):
+    """Response body for a source opened by `_open_stored_render`, without loading it into memory.
+
+    A local file is returned as is, so `FileResponse` can hand it to the server's sendfile.
+    Anything else becomes an iterator of chunks.
+    """
+    if hasattr(source, "iter_chunks"):
+        return source.iter_chunks(STREAM_CHUNK_BYTES)
+    if isinstance(source, File):
+        return source.chunks(STREAM_CHUNK_BYTES)
+    return source
+
+
+async def stream_stored_render_async(source):
+    """`stored_render_body` for ASGI responses, reading each chunk on a worker thread.
+
+    Under ASGI Django collects a sync streaming iterator into a list on the event loop
+    before sending it, so a sync iterator over storage would load the whole body there.
+    """
+    body = stored_render_body(source)
+    chunks = iter(partial(body.read, STREAM_CHUNK_BYTES), b"") if hasattr(body, "read") else iter(body)
+    read_chunk = sync_to_async(next, thread_sensitive=False)
+    try:
+        while (chunk := await read_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(source.close, thread_sensitive=False)()
+
+
+def get_cached_render(render_key: str) -> tuple[CachedRender | None, str | None]:
+    """Look the render up in memory, then the shared cache, then object storage.
+
+    Returns the cached render together with the layer that served it. Hits on a lower
+    layer are promoted into the layers above it.
+    """
+    cached = _memory_cache.get(render_key)
+    _stats.record(CacheLayer.MEMORY, hit=cached is not None)
+    if cached is not None:
+        return cached, CacheLayer.MEMORY
+
+    cached = _get_shared(render_key)
+    _stats.record(CacheLayer.SHARED, hit=cached is not None)
+    if cached is not None:
+        _memory_cache.set(render_key, cached)
+        return cached, CacheLayer.SHARED
+
+    cached = _load_from_storage(render_key)
+    _stats.record(CacheLayer.STORAGE, hit=cached is not None)
+    if cached is not None:
+        if not cached.is_streamed:
+            store_cached_render(render_key, cached)
+        return cached, CacheLayer.STORAGE
+
+    return None, None
+
+
+def get_shared_render_content(render_key: str) -> bytes | None:
+    cached = _get_shared(render_key)
+    return cached.content if cached is not None else None
+
+
+def store_cached_render(render_key: str, cached: CachedRender):
+    _memory_cache.set(render_key, cached)
+    _set_shared(render_key, cached)
+
+
+def render_etag(render_key: str, version: str) -> str:
+    """Strong ETag for a render; it changes with the params, the template version and the rendered bytes.
+
+    `version` is the render's `content_version`, so a regeneration that changes the image
+    also changes the ETag, while one that produces the same bytes keeps it.
+    """
+    return f'"{RENDER_TEMPLATE_VERSION}-{render_key}-{version}"'
+
+
+def get_render_validators(render_key: str, with_last_modified: bool = True) -> tuple[str | None, datetime | None]:
+    """Content version and `Image.updated_at` of the render, from memory when possible. Never touches storage.
+
+    A fresh render is in memory before its row is saved, so it has a content version but no
+    `updated_at` yet; the row is only read when `with_last_modified` needs it.
+    """
+    cached = _memory_cache.get(render_key)
+    if cached is not None and (cached.updated_at is not None or not with_last_modified):
+        return cached.content_version, cached.updated_at
+
+    row = Image.objects.filter(render_key=render_key).values_list("content_sha256", "updated_at").first()
+    if row is None:
+        return (cached.content_version if cached is not None else None), None
+    content_sha256, updated_at = row
+    return content_sha256[:CONTENT_VERSION_LENGTH] or None, updated_at
+
+
+def cache_hit_mode() -> str:
+    return getattr(settings, "OSIG_CACHE_HIT_MODE", CacheHitMode.PROXY)
+
+
+def get_stored_render_location(render_key: str) -> CachedRender | None:
+    """Where the stored render for `render_key` lives, without reading it.
+
+    The object's existence is checked once and the location remembered in the shared
+    cache, so later hits need neither the database nor the storage backend.
+    """
+    try:
+        location = _shared_cache().get(f"{LOCATION_CACHE_KEY_PREFIX}{render_key}")
+    except Exception as e:
+        logger.warning("Shared render location read failed", render_key=render_key, error=str(e))
+        location = None
+
+    if location is None:
+        existing_image = Image.objects.filter(render_key=render_key).only("id", "generated_image", "updated_at").first()
+        if not existing_image or not existing_image.generated_image:
+            _stats.record(CacheLayer.STORAGE, hit=False)
+            return None
+
+        storage_name = existing_image.generated_image.name
+        if not existing_image.generated_image.storage.exists(storage_name):
+            logger.error(f"Generated image file not found for image_id: {existing_image.id}")
+            _stats.record(CacheLayer.STORAGE, hit=False)
+            return None
+
+        location = CachedRender(
+            content=None,
+            image_id=existing_image.id,
+            updated_at=existing_image.updated_at,
+            storage_name=storage_name,
+        )
+        try:
+            _shared_cache().set(
+                f"{LOCATION_CACHE_KEY_PREFIX}{render_key}",
+                location,
+                timeout=getattr(settings, "OSIG_RENDER_CACHE_SHARED_TTL_SECONDS", 60 * 60 * 24),
+            )
+        except Exception as e:
+            logger.warning("Shared render location write failed", render_key=render_key, error=str(e))
+
+    _stats.record(CacheLayer.STORAGE, hit=True)
+    return location
+
+
+def stored_render_url(storage_name: str, signed: bool) -> str:
+    """Public `MEDIA_URL` address of a stored render, or a short-lived signed storage URL."""
+    if not signed:
+        return f"{settings.MEDIA_URL}{quote(storage_name)}"
+
+    storage = Image._meta.get_field("generated_image").storage
+    expire_seconds = getattr(settings, "OSIG_SIGNED_STORAGE_URL_EXPIRE_SECONDS", 60 * 60)
+    try:
+        return storage.url(storage_name, expire=expire_seconds)
+    except TypeError:
+        # Storages without URL signing (e.g. the filesystem) take no expiry.
+        return storage.url(storage_name)
+
+
+def invalidate_cached_render(render_key: str):
+    _memory_cache.delete(render_key)
+
+    try:
+        _shared_cache().delete_many([_shared_cache_key(render_key), f"{LOCATION_CACHE_KEY_PREFIX}{render_key}"])
+    except Exception as e:
+        logger.warning("Shared render cache delete failed", render_key=render_key, error=str(e))
+
+
+def get_render_cache_stats() -> dict[str, Any]:
+    return {
+        "layers": _stats.snapshot(),
+        "memory_entries": len(_memory_cache),
+        "memory_bytes": _memory_cache.total_bytes,
+        "memory_max_bytes": _memory_cache.max_bytes,
+    }
+
+
+def reset_render_cache():
+    _memory_cache.clear()
+    _stats.reset()
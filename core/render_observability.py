@@ -1,15 +1,24 @@
 from __future__ import annotations
 
-import math
+import atexit
+import os
+import random
+import threading
 from dataclasses import dataclass
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 import requests
-from django.db.models import Count
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncHour
 from django.utils import timezone
 from PIL import UnidentifiedImageError
 
-from core.models import Profile, RenderAttempt
+from core.models import RenderAttempt, RenderMetricsRollup
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
 
 
 class RenderErrorType:
@@ -22,6 +31,37 @@ class RenderErrorType:
     UNKNOWN_ERROR = "unknown_error"
 
 
+class RenderFailedError(Exception):
+    def __init__(self, error_type: str):
+        super().__init__(error_type)
+        self.error_type = error_type
+
+
+# Upper bounds of the latency histogram kept per rollup bucket; one overflow bucket follows.
+LATENCY_BUCKET_BOUNDS_MS = (
+    25,
+    50,
+    75,
+    100,
+    150,
+    200,
+    300,
+    400,
+    500,
+    750,
+    1000,
+    1500,
+    2000,
+    3000,
+    5000,
+    7500,
+    10000,
+    20000,
+    30000,
+)
+# The longest window the metrics API serves; older rollups are pruned.
+MAX_METRICS_WINDOW_HOURS = 24 * 30
+
 TRANSIENT_ERROR_TYPES = {
     RenderErrorType.TRANSIENT_UPSTREAM_FETCH,
     RenderErrorType.UPSTREAM_FETCH_5XX,
@@ -39,11 +79,14 @@ class RenderMetrics:
 
 
 def classify_render_error(exc: Exception) -> str:
-    if isinstance(exc, requests.exceptions.Timeout | requests.exceptions.ConnectionError):
+    if isinstance(
+        exc,
+        requests.exceptions.Timeout | requests.exceptions.ConnectionError | requests.exceptions.RetryError,
+    ):
         return RenderErrorType.TRANSIENT_UPSTREAM_FETCH
 
     if isinstance(exc, requests.exceptions.HTTPError):
-        status_code = exc.response.status_code if exc.response else None
+        status_code = exc.response.status_code if exc.response is not None else None
         if status_code is not None and 500 <= status_code <= 599:
             return RenderErrorType.UPSTREAM_FETCH_5XX
         if status_code is not None and 400 <= status_code <= 499:
@@ -65,59 +108,266 @@ def is_transient_error(error_type: str) -> bool:
     return error_type in TRANSIENT_ERROR_TYPES
 
 
+def _success_sample_rate() -> float:
+    return min(1.0, max(0.0, float(getattr(settings, "OSIG_RENDER_ATTEMPT_SUCCESS_SAMPLE_RATE", 1.0))))
+
+
+def _attempt_batch_size() -> int:
+    return getattr(settings, "OSIG_RENDER_ATTEMPT_BATCH_SIZE", 200)
+
+
+class _AttemptBuffer:
+    """In-process buffer of `RenderAttempt`s written with `bulk_create` by a background thread.
+
+    The thread flushes every OSIG_RENDER_ATTEMPT_FLUSH_SECONDS, or early once
+    OSIG_RENDER_ATTEMPT_BATCH_SIZE records are waiting; whatever is left is flushed at exit.
+    A batch that fails to write goes back into the buffer for the next flush; past
+    MAX_BUFFERED_BATCHES batches, the oldest records are dropped and counted in the log.
+    """
+
+    MAX_BUFFERED_BATCHES = 10
+
+    def __init__(self):
+        self._records: list[RenderAttempt] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid: int | None = None
+        self._failing = False
+
+    def add(self, attempt: RenderAttempt):
+        with self._lock:
+            self._ensure_flusher()
+            self._records.append(attempt)
+            # While writes are failing, wait for the next timed flush instead of retrying on every add.
+            full = not self._failing and len(self._records) >= _attempt_batch_size()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        # A forked child must not write its parent's records a second time.
+        self._records = []
+        self._pid = pid
+        threading.Thread(target=self._run, name="render-attempt-flusher", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(timeout=getattr(settings, "OSIG_RENDER_ATTEMPT_FLUSH_SECONDS", 5))
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._records = self._records, []
+
+        if not batch:
+            return 0
+
+        try:
+            RenderAttempt.objects.bulk_create(batch)
+        except Exception as e:
+            with self._lock:
+                self._failing = True
+                self._records[:0] = batch
+                dropped = max(0, len(self._records) - _attempt_batch_size() * self.MAX_BUFFERED_BATCHES)
+                del self._records[:dropped]
+            logger.warning(
+                "Render attempt flush failed, retrying with the next one",
+                count=len(batch),
+                dropped=dropped,
+                error=str(e),
+            )
+            return 0
+
+        self._failing = False
+        return len(batch)
+
+    def clear(self):
+        with self._lock:
+            self._records = []
+
+
+_attempt_buffer = _AttemptBuffer()
+
+
 def record_render_attempt(
     *,
-    profile: Profile | None,
+    profile_id: int | None,
     key: str,
     style: str,
     success: bool,
     duration_ms: int,
     error_type: str = "",
     attempt_number: int = 1,
+    stage_timings: dict[str, float] | None = None,
 ):
-    RenderAttempt.objects.create(
-        profile=profile,
-        key=key,
-        style=style,
-        success=success,
-        duration_ms=max(0, int(duration_ms)),
-        error_type=error_type,
-        attempt_number=max(1, int(attempt_number)),
+    """Buffer one attempt. Failures are always kept; successes are sampled.
+
+    A sampled success stands for `1 / rate` attempts through `sample_weight`, which the
+    metrics use so fail rates stay unbiased.
+    """
+    sample_weight = 1.0
+    if success:
+        rate = _success_sample_rate()
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+        sample_weight = 1 / rate
+
+    _attempt_buffer.add(
+        RenderAttempt(
+            profile_id=profile_id,
+            key=key,
+            style=style,
+            success=success,
+            duration_ms=max(0, int(duration_ms)),
+            error_type=error_type,
+            attempt_number=max(1, int(attempt_number)),
+            sample_weight=sample_weight,
+            stage_timings=stage_timings or {},
+            created_at=timezone.now(),
+        )
+    )
+
+
+def flush_render_attempts() -> int:
+    """Write buffered attempts now; returns how many were written."""
+    return _attempt_buffer.flush()
+
+
+def discard_buffered_render_attempts():
+    _attempt_buffer.clear()
+
+
+def _hour_start(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _latency_bucket_filters() -> list[Q]:
+    filters = []
+    lower = None
+    for upper in (*LATENCY_BUCKET_BOUNDS_MS, None):
+        condition = Q(success=True)
+        if lower is not None:
+            condition &= Q(duration_ms__gt=lower)
+        if upper is not None:
+            condition &= Q(duration_ms__lte=upper)
+        filters.append(condition)
+        lower = upper
+    return filters
+
+
+def _aggregate_attempts(queryset, *group_by: str) -> list[dict]:
+    """Weighted counts, failures, max success duration and a latency histogram per group, in one query."""
+    aggregates = {
+        "attempts": Sum("sample_weight"),
+        "failed_attempts": Count("id", filter=Q(success=False)),
+        "max_duration_ms": Max("duration_ms", filter=Q(success=True)),
+    }
+    bucket_filters = _latency_bucket_filters()
+    for index, condition in enumerate(bucket_filters):
+        aggregates[f"latency_{index}"] = Sum("sample_weight", filter=condition)
+
+    rows = list(queryset.values(*group_by).order_by().annotate(**aggregates))
+    for row in rows:
+        row["attempts"] = row["attempts"] or 0.0
+        row["latency_histogram"] = [row.pop(f"latency_{index}") or 0.0 for index in range(len(bucket_filters))]
+    return rows
+
+
+def rollup_render_attempts() -> str:
+    """Fold every completed hour of `RenderAttempt`s into `RenderMetricsRollup` rows.
+
+    The latest rolled-up hour is folded again, so attempts written just after it was
+    rolled up are not lost. Reruns overwrite buckets, so overlapping runs are harmless.
+    """
+    current_hour = _hour_start(timezone.now())
+    oldest_hour = current_hour - timedelta(hours=MAX_METRICS_WINDOW_HOURS)
+    latest = RenderMetricsRollup.objects.aggregate(latest=Max("bucket_start"))["latest"]
+    start = max(oldest_hour, latest) if latest is not None else oldest_hour
+
+    rows = _aggregate_attempts(
+        RenderAttempt.objects.filter(created_at__gte=start, created_at__lt=current_hour).annotate(
+            bucket_start=TruncHour("created_at")
+        ),
+        "bucket_start",
+        "style",
+        "error_type",
+    )
+    RenderMetricsRollup.objects.bulk_create(
+        [RenderMetricsRollup(**row) for row in rows],
+        update_conflicts=True,
+        unique_fields=["bucket_start", "style", "error_type"],
+        update_fields=["attempts", "failed_attempts", "latency_histogram", "max_duration_ms", "updated_at"],
     )
+    RenderMetricsRollup.objects.filter(bucket_start__lt=oldest_hour).delete()
+
+    return f"Rolled up {len(rows)} buckets since {start.isoformat()}"
 
 
-def _p95(values: list[int]) -> int | None:
-    if not values:
+def _histogram_p95(histogram: list[float], max_duration_ms: int | None) -> int | None:
+    total = sum(histogram)
+    if not total or max_duration_ms is None:
         return None
 
-    sorted_values = sorted(values)
-    index = max(0, math.ceil(len(sorted_values) * 0.95) - 1)
-    return sorted_values[index]
+    running = 0.0
+    for index, count in enumerate(histogram):
+        running += count
+        if running >= total * 0.95:
+            upper = LATENCY_BUCKET_BOUNDS_MS[index] if index < len(LATENCY_BUCKET_BOUNDS_MS) else max_duration_ms
+            # A bucket's upper bound can overshoot every duration in it.
+            return min(upper, max_duration_ms)
+    return max_duration_ms
 
 
 def build_render_metrics(*, window_hours: int = 24) -> RenderMetrics:
-    cutoff = timezone.now() - timedelta(hours=window_hours)
-    queryset = RenderAttempt.objects.filter(created_at__gte=cutoff)
+    """Metrics for the window, merged from hourly rollups plus the raw attempts around them.
 
-    total_attempts = queryset.count()
-    failed_attempts = queryset.filter(success=False).count()
+    Raw attempts are only read for the partial hour at the start of the window and for the
+    hours since the last rollup, so the cost does not grow with traffic.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(hours=window_hours)
+    first_full_hour = _hour_start(cutoff) + timedelta(hours=1)
+    latest = RenderMetricsRollup.objects.aggregate(latest=Max("bucket_start"))["latest"]
 
+    if latest is not None and latest >= first_full_hour:
+        rows = list(
+            RenderMetricsRollup.objects.filter(bucket_start__gte=first_full_hour, bucket_start__lte=latest).values(
+                "error_type", "attempts", "failed_attempts", "latency_histogram", "max_duration_ms"
+            )
+        )
+        raw_attempts = RenderAttempt.objects.filter(
+            Q(created_at__gte=cutoff, created_at__lt=first_full_hour) | Q(created_at__gte=latest + timedelta(hours=1))
+        )
+    else:
+        rows = []
+        raw_attempts = RenderAttempt.objects.filter(created_at__gte=cutoff)
+    rows.extend(_aggregate_attempts(raw_attempts, "error_type"))
+
+    # Successes may be sampled; each stored row counts for its sample weight.
+    total_attempts = round(sum(row["attempts"] for row in rows))
+    failed_attempts = sum(row["failed_attempts"] for row in rows)
     fail_rate_percent = round((failed_attempts / total_attempts) * 100, 2) if total_attempts else 0.0
-    durations = list(queryset.filter(success=True).values_list("duration_ms", flat=True))
-
-    error_counts = {
-        item["error_type"]: item["count"]
-        for item in queryset.filter(success=False)
-        .values("error_type")
-        .annotate(count=Count("id"))
-        .order_by("-count")
-    }
+
+    histogram = [0.0] * (len(LATENCY_BUCKET_BOUNDS_MS) + 1)
+    error_counts: dict[str, int] = {}
+    for row in rows:
+        for index, count in enumerate(row["latency_histogram"]):
+            histogram[index] += count
+        if row["failed_attempts"]:
+            error_counts[row["error_type"]] = error_counts.get(row["error_type"], 0) + row["failed_attempts"]
+    max_durations = [row["max_duration_ms"] for row in rows if row["max_duration_ms"] is not None]
 
     return RenderMetrics(
         window_hours=window_hours,
         total_attempts=total_attempts,
         failed_attempts=failed_attempts,
         fail_rate_percent=fail_rate_percent,
-        p95_render_ms=_p95(durations),
-        error_counts=error_counts,
+        p95_render_ms=_histogram_p95(histogram, max(max_durations, default=None)),
+        error_counts=dict(sorted(error_counts.items(), key=lambda item: item[1], reverse=True)),
     )
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from core.render_timing import merge_stage_timings, start_stage_timings
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+
+class RenderPoolSaturatedError(Exception):
+    """Every worker is busy and the wait queue is full."""
+
+    def __init__(self, retry_after_seconds: int):
+        super().__init__(f"Render pool is saturated, retry after {retry_after_seconds}s")
+        self.retry_after_seconds = retry_after_seconds
+
+
+def render_pool_enabled() -> bool:
+    return getattr(settings, "OSIG_RENDER_POOL_ENABLED", False)
+
+
+def _worker_count() -> int:
+    """Workers for this server process's pool.
+
+    Every gunicorn worker starts its own pool, so by default the cores are split between
+    them (WEB_CONCURRENCY) rather than each one spawning a full set of Django processes.
+    """
+    configured = getattr(settings, "OSIG_RENDER_POOL_WORKERS", 0)
+    if configured:
+        return max(1, configured)
+    return max(1, (os.cpu_count() or 1) // max(1, getattr(settings, "WEB_CONCURRENCY", 1)))
+
+
+def _max_queue() -> int:
+    return max(0, getattr(settings, "OSIG_RENDER_POOL_MAX_QUEUE", 16))
+
+
+def _initialize_worker():
+    import django
+
+    django.setup()
+
+    from django.db import connections
+
+    from core.image_styles import warm_style_canvases, warm_style_fonts
+
+    warm_style_fonts()
+    warm_style_canvases()
+    # Don't carry a connection opened during warm-up into the first render.
+    connections.close_all()
+
+
+def _render_in_worker(
+    params: dict, submitted_at: float, principal=None
+) -> tuple[bytes, int, float, float, dict[str, float]]:
+    from core.image_styles import generate_image_router
+
+    started_at = time.time()
+    # Stage timings don't cross the process boundary on their own; they're sent back.
+    timings = start_stage_timings()
+    content = generate_image_router(params, principal).getvalue()
+    return content, os.getpid(), started_at - submitted_at, time.time() - started_at, timings.as_dict()
+
+
+def _ping_worker() -> int:
+    return os.getpid()
+
+
+@dataclass
+class _PoolStats:
+    started_at: float = field(default_factory=time.monotonic)
+    submitted: int = 0
+    rejected: int = 0
+    completed: int = 0
+    failed: int = 0
+    in_flight: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    busy_seconds_by_worker: dict[int, float] = field(default_factory=dict)
+
+
+class RenderPool:
+    """Pre-started render worker processes behind a bounded admission queue.
+
+    At most `workers + max_queue` renders are admitted at once; the rest are rejected
+    straight away with `RenderPoolSaturatedError` rather than piling up behind the pool.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self._stats = _PoolStats()
+        self._executor = self._start_executor()
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialize_worker,
+        )
+        # Spawn every worker now so the first requests don't pay for process start-up.
+        for future in [executor.submit(_ping_worker) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def render(self, params: dict, principal=None) -> io.BytesIO:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats.rejected += 1
+            raise RenderPoolSaturatedError(getattr(settings, "OSIG_RENDER_POOL_RETRY_AFTER_SECONDS", 2))
+
+        with self._lock:
+            self._stats.submitted += 1
+            self._stats.in_flight += 1
+            executor = self._executor
+
+        try:
+            future = executor.submit(_render_in_worker, params, time.time(), principal)
+        except BaseException:
+            self._release_slot()
+            raise
+        # The slot is held until the worker is really done, even when we stop waiting for it
+        # after a timeout, so admission keeps tracking the load on the workers.
+        future.add_done_callback(lambda _: self._release_slot())
+
+        try:
+            content, worker_pid, wait_seconds, busy_seconds, stage_timings = future.result(
+                timeout=getattr(settings, "OSIG_RENDER_POOL_TIMEOUT_SECONDS", 30)
+            )
+        except BrokenProcessPool:
+            logger.error("Render pool broke, restarting workers")
+            self._restart(executor)
+            self._record_failure()
+            raise
+        except Exception:
+            self._record_failure()
+            raise
+
+        with self._lock:
+            self._stats.completed += 1
+            self._stats.total_wait_seconds += wait_seconds
+            self._stats.max_wait_seconds = max(self._stats.max_wait_seconds, wait_seconds)
+            busy = self._stats.busy_seconds_by_worker
+            busy[worker_pid] = busy.get(worker_pid, 0.0) + busy_seconds
+
+        merge_stage_timings(stage_timings)
+        return io.BytesIO(content)
+
+    def _release_slot(self):
+        with self._lock:
+            self._stats.in_flight -= 1
+        self._slots.release()
+
+    def _record_failure(self):
+        with self._lock:
+            self._stats.failed += 1
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        """Replace `broken` once, however many renders saw it break."""
+        with self._restart_lock:
+            if self._executor is not broken:
+                return
+            replacement = self._start_executor()
+            with self._lock:
+                self._executor = replacement
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = self._stats
+            uptime_seconds = max(time.monotonic() - stats.started_at, 1e-9)
+            finished = stats.completed
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": stats.in_flight,
+                "queue_depth": max(0, stats.in_flight - self.workers),
+                "submitted": stats.submitted,
+                "rejected": stats.rejected,
+                "completed": stats.completed,
+                "failed": stats.failed,
+                "avg_wait_ms": round(stats.total_wait_seconds / finished * 1000, 2) if finished else 0.0,
+                "max_wait_ms": round(stats.max_wait_seconds * 1000, 2),
+                "worker_utilization_percent": {
+                    str(pid): round(busy / uptime_seconds * 100, 2)
+                    for pid, busy in stats.busy_seconds_by_worker.items()
+                },
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_pool: RenderPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> RenderPool:
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RenderPool(workers=_worker_count(), max_queue=_max_queue())
+    return _pool
+
+
+def render_in_pool(params: dict, principal=None) -> io.BytesIO:
+    return get_render_pool().render(params, principal)
+
+
+def get_render_pool_stats() -> dict | None:
+    return _pool.stats() if _pool is not None else None
+
+
+def shutdown_render_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
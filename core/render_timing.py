@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import functools
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+
+# Reported in this order; any other stage name follows them.
+STAGES = ("principal", "usage", "cache", "storage", "fetch", "decode", "layout", "draw", "encode")
+
+_current_timings: ContextVar[StageTimings | None] = ContextVar("osig_stage_timings", default=None)
+
+
+class StageTimings:
+    """Milliseconds spent per render stage during one request.
+
+    Stages nest: time spent in an inner stage is only counted for the inner one, so
+    `draw` is the rendering left over after fetching, layout and encoding.
+    """
+
+    def __init__(self):
+        self.durations_ms: dict[str, float] = {}
+        self._started_at = perf_counter()
+        self._open_child_ms: list[float] = []
+
+    def add(self, stage: str, duration_ms: float):
+        self.durations_ms[stage] = self.durations_ms.get(stage, 0.0) + max(0.0, duration_ms)
+
+    def merge(self, durations_ms: dict[str, float]):
+        for stage, duration_ms in durations_ms.items():
+            self.add(stage, duration_ms)
+
+    @contextmanager
+    def stage(self, name: str):
+        self._open_child_ms.append(0.0)
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (perf_counter() - started_at) * 1000
+            self.add(name, elapsed_ms - self._open_child_ms.pop())
+            if self._open_child_ms:
+                self._open_child_ms[-1] += elapsed_ms
+
+    def as_dict(self) -> dict[str, float]:
+        ordered = sorted(
+            self.durations_ms.items(),
+            key=lambda item: STAGES.index(item[0]) if item[0] in STAGES else len(STAGES),
+        )
+        return {stage: round(duration_ms, 2) for stage, duration_ms in ordered}
+
+    def since(self, snapshot: dict[str, float]) -> dict[str, float]:
+        """Durations added after `snapshot` (a previous `as_dict()`) was taken."""
+        return {
+            stage: round(duration_ms - snapshot.get(stage, 0.0), 2)
+            for stage, duration_ms in self.as_dict().items()
+            if duration_ms - snapshot.get(stage, 0.0) > 0
+        }
+
+    def server_timing_header(self) -> str:
+        entries = [f"{stage};dur={duration_ms}" for stage, duration_ms in self.as_dict().items()]
+        entries.append(f"total;dur={round((perf_counter() - self._started_at) * 1000, 2)}")
+        return ", ".join(entries)
+
+
+def start_stage_timings() -> StageTimings:
+    timings = StageTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_stage_timings() -> StageTimings | None:
+    return _current_timings.get()
+
+
+@contextmanager
+def render_stage(name: str):
+    """Time the block as `name` for the current request; a no-op outside of one.
+
+    Also usable as a decorator.
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    with timings.stage(name):
+        yield
+
+
+def merge_stage_timings(durations_ms: dict[str, float]):
+    """Add stage timings measured elsewhere, e.g. in a render pool worker."""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.merge(durations_ms)
+
+
+def snapshot_stage_timings() -> dict[str, float]:
+    timings = _current_timings.get()
+    return timings.as_dict() if timings is not None else {}
+
+
+def stage_timings_since(snapshot: dict[str, float]) -> dict[str, float]:
+    timings = _current_timings.get()
+    return timings.since(snapshot) if timings is not None else {}
+
+
+def _attach_server_timing(response, timings: StageTimings):
+    if getattr(settings, "OSIG_SERVER_TIMING_ENABLED", False):
+        response["Server-Timing"] = timings.server_timing_header()
+    return response
+
+
+def with_server_timing(view):
+    """Collect stage timings while `view` runs and report them in a `Server-Timing` header."""
+    if inspect.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            timings = StageTimings()
+            token = _current_timings.set(timings)
+            try:
+                return _attach_server_timing(await view(request, *args, **kwargs), timings)
+            finally:
+                _current_timings.reset(token)
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        timings = StageTimings()
+        token = _current_timings.set(timings)
+        try:
+            return _attach_server_timing(view(request, *args, **kwargs), timings)
+        finally:
+            # Worker threads are reused; don't leave this request's timings behind.
+            _current_timings.reset(token)
+
+    return wrapper
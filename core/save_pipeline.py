@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import hashlib
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from django_q.tasks import async_task, schedule
+
+from core.checks import cache_is_shared
+from core.models import Image
+from core.render_cache import build_render_key
+from core.tasks import _get_output_extension, save_generated_image
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+SPOOL_KEY_PREFIX = "osig:save-spool:"
+FLUSH_FUNC = "core.save_pipeline.flush_staged_images"
+
+
+def _spool_cache_alias() -> str:
+    return getattr(settings, "OSIG_RENDER_CACHE_ALIAS", "default")
+
+
+def _spool_cache():
+    return caches[_spool_cache_alias()]
+
+
+def _window_seconds() -> int:
+    return max(1, getattr(settings, "OSIG_SAVE_BATCH_WINDOW_SECONDS", 10))
+
+
+def _spool_ttl_seconds() -> int:
+    return getattr(settings, "OSIG_SAVE_SPOOL_TTL_SECONDS", 15 * 60)
+
+
+def _entry_key(render_key: str) -> str:
+    return f"{SPOOL_KEY_PREFIX}entry:{render_key}"
+
+
+def _batch_key(batch_id: int) -> str:
+    return f"{SPOOL_KEY_PREFIX}batch:{batch_id}"
+
+
+def _add_to_current_batch(cache, render_key: str, ttl: int):
+    batch_id = int(time.time() // _window_seconds())
+    batch_key = _batch_key(batch_id)
+    cache.add(batch_key, 0, timeout=ttl)
+    slot = cache.incr(batch_key)
+    cache.set(f"{batch_key}:{slot}", render_key, timeout=ttl)
+
+    if slot == 1:
+        # The first render of a window schedules its flush for when the window closes.
+        schedule(
+            FLUSH_FUNC,
+            batch_id,
+            name=f"Flush staged images {batch_id}",
+            next_run=timezone.now() + timedelta(seconds=_window_seconds()),
+        )
+
+
+def stage_generated_image(content: bytes, params: dict) -> bool:
+    """Spool a fresh render for saving and queue only a reference to its batch.
+
+    The bytes stay in the shared cache until the batch is flushed; the queue carries just
+    the batch id. A render key that is already spooled is coalesced away. Returns whether
+    the render was staged.
+
+    The qcluster can only read the spool from a cache shared across processes. With a
+    per-process cache, the bytes go into a `save_generated_image` task instead.
+    """
+    if not cache_is_shared(_spool_cache_alias()):
+        async_task(save_generated_image, content, params)
+        return True
+
+    render_key = build_render_key(params)
+    cache = _spool_cache()
+    ttl = _spool_ttl_seconds()
+
+    if not cache.add(_entry_key(render_key), (content, params), timeout=ttl):
+        return False
+
+    _add_to_current_batch(cache, render_key, ttl)
+    return True
+
+
+def _upload(render_key: str, content: bytes, params: dict) -> str:
+    field = Image._meta.get_field("generated_image")
+    prefix = "key_" if params.get("key") else "no_key_"
+    filename = field.generate_filename(None, f"{prefix}{uuid.uuid4().hex[:12]}.{_get_output_extension(params)}")
+    return field.storage.save(filename, ContentFile(content))
+
+
+def flush_staged_images(batch_id: int) -> str:
+    """Upload every spooled render of a batch and write their `Image` rows in one insert."""
+    cache = _spool_cache()
+    batch_key = _batch_key(batch_id)
+    slot_keys = [f"{batch_key}:{slot}" for slot in range(1, (cache.get(batch_key) or 0) + 1)]
+    render_keys = list(dict.fromkeys(cache.get_many(slot_keys).values()))
+    entry_keys = {render_key: _entry_key(render_key) for render_key in render_keys}
+    entries = cache.get_many(list(entry_keys.values()))
+
+    staged = {render_key: entries[entry_key] for render_key, entry_key in entry_keys.items() if entry_key in entries}
+    already_saved = set(
+        Image.objects.filter(render_key__in=staged).exclude(generated_image="").values_list("render_key", flat=True)
+    )
+    to_save = {render_key: entry for render_key, entry in staged.items() if render_key not in already_saved}
+
+    uploaded: dict[str, str] = {}
+    if to_save:
+        workers = max(1, getattr(settings, "OSIG_SAVE_UPLOAD_CONCURRENCY", 8))
+        with ThreadPoolExecutor(max_workers=min(workers, len(to_save))) as executor:
+            futures = {
+                render_key: executor.submit(_upload, render_key, content, params)
+                for render_key, (content, params) in to_save.items()
+            }
+        for render_key, future in futures.items():
+            try:
+                uploaded[render_key] = future.result()
+            except Exception as e:
+                logger.error("Error uploading staged image", render_key=render_key, error=str(e))
+    failed = [render_key for render_key in to_save if render_key not in uploaded]
+
+    Image.objects.bulk_create(
+        [
+            Image(
+                render_key=render_key,
+                image_data=to_save[render_key][1],
+                generated_image=storage_name,
+                content_sha256=hashlib.sha256(to_save[render_key][0]).hexdigest(),
+            )
+            for render_key, storage_name in uploaded.items()
+        ],
+        ignore_conflicts=True,
+    )
+
+    kept = dict(Image.objects.filter(render_key__in=uploaded).values_list("render_key", "generated_image"))
+    storage = Image._meta.get_field("generated_image").storage
+    for render_key, storage_name in uploaded.items():
+        if kept.get(render_key) == storage_name:
+            continue
+        if kept.get(render_key) == "":
+            # An existing row without a file takes this upload.
+            Image.objects.filter(render_key=render_key, generated_image="").update(
+                generated_image=storage_name,
+                content_sha256=hashlib.sha256(to_save[render_key][0]).hexdigest(),
+            )
+            continue
+        # A row that won a race (e.g. a direct save) keeps its file; drop our duplicate upload.
+        storage.delete(storage_name)
+
+    cache.delete_many([batch_key, *slot_keys, *(entry_keys[key] for key in render_keys if key not in failed)])
+
+    # Failed uploads keep their entry and retry with the next batch, until the entry expires.
+    ttl = _spool_ttl_seconds()
+    for render_key in failed:
+        _add_to_current_batch(cache, render_key, ttl)
+
+    return (
+        f"Saved {len(uploaded)} of {len(render_keys)} staged images "
+        f"({len(already_saved)} already stored, {len(failed)} retrying)"
+    )
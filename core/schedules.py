@@ -0,0 +1,38 @@
+from django.conf import settings
+from django_q.models import Schedule
+
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+
+def periodic_schedules() -> dict[str, dict]:
+    """The app's repeating django-q schedules by name, with intervals read from the current settings."""
+    return {
+        "Regenerate stale renders": {
+            "func": "core.regeneration.sweep_stale_renders",
+            "minutes": max(1, getattr(settings, "OSIG_REGENERATION_SWEEP_MINUTES", 10)),
+        },
+        "Flush usage counters": {
+            "func": "core.usage.flush_usage_counters",
+            "minutes": max(1, getattr(settings, "OSIG_USAGE_FLUSH_SECONDS", 60) // 60),
+        },
+        "Roll up render metrics": {
+            "func": "core.render_observability.rollup_render_attempts",
+            "minutes": max(1, getattr(settings, "OSIG_RENDER_METRICS_ROLLUP_MINUTES", 10)),
+        },
+    }
+
+
+def sync_periodic_schedules(using: str = "default"):
+    """Create or update the app's schedules so their intervals follow the settings.
+
+    Runs after every `migrate`, which the server entrypoint runs on each start, so a changed
+    interval setting takes effect on the next deploy.
+    """
+    for name, fields in periodic_schedules().items():
+        Schedule.objects.using(using).update_or_create(
+            name=name,
+            defaults={**fields, "schedule_type": Schedule.MINUTES, "repeats": -1},
+        )
+    logger.info("Synced periodic schedules", schedules=list(periodic_schedules()))
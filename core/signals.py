@@ -1,10 +1,11 @@
 from allauth.account.signals import email_confirmed, user_signed_up
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_migrate, post_save
 from django.dispatch import receiver
 from django_q.tasks import async_task
 
 from core.models import Profile, ProfileStates
+from core.schedules import sync_periodic_schedules
 from core.tasks import add_email_to_buttondown
 from osig.utils import get_osig_logger
 
@@ -51,3 +52,9 @@ def email_confirmation_callback(sender, request, user, **kwargs):
         email = kwargs["sociallogin"].user.email
         if email:
             async_task(add_email_to_buttondown, email, tag="user")
+
+
+@receiver(post_migrate)
+def sync_schedules_after_migrate(sender, using="default", **kwargs):
+    if sender.name == "core":
+        sync_periodic_schedules(using=using)
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from typing import Generic, TypeVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+T = TypeVar("T")
+
+LOCK_KEY_PREFIX = "osig:render-lock:"
+POLL_INTERVAL_SECONDS = 0.05
+
+
+class _Flight(Generic[T]):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: T | None = None
+        self.error: BaseException | None = None
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _lock_cache():
+    return caches[getattr(settings, "OSIG_RENDER_CACHE_ALIAS", "default")]
+
+
+def _lock_key(key: str) -> str:
+    return f"{LOCK_KEY_PREFIX}{key}"
+
+
+def _acquire_lock(key: str, token: str) -> bool:
+    try:
+        return _lock_cache().add(_lock_key(key), token, timeout=getattr(settings, "OSIG_RENDER_LOCK_TTL_SECONDS", 30))
+    except Exception as e:
+        # Without a working lock backend we still coalesce within this process.
+        logger.warning("Render lock backend unavailable", key=key, error=str(e))
+        return True
+
+
+def _release_lock(key: str, token: str):
+    try:
+        cache = _lock_cache()
+        if cache.get(_lock_key(key)) == token:
+            cache.delete(_lock_key(key))
+    except Exception as e:
+        logger.warning("Render lock release failed", key=key, error=str(e))
+
+
+def _lock_is_held(key: str) -> bool:
+    try:
+        return _lock_cache().get(_lock_key(key)) is not None
+    except Exception:
+        return False
+
+
+def _wait_for_remote(key: str, poll: Callable[[], T | None], timeout: float) -> T | None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = poll()
+        if value is not None:
+            return value
+
+        if not _lock_is_held(key):
+            # The remote holder finished (or died) without publishing; one last look.
+            return poll()
+
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+    return None
+
+
+def single_flight(
+    key: str, fn: Callable[[], T], poll: Callable[[], T | None], timeout: float | None = None
+) -> tuple[T, bool]:
+    """Run `fn` once per `key` across threads and processes; everyone else shares its result.
+
+    Callers in this process wait on the in-flight call. Callers in other processes see the
+    shared lock and `poll` for the published result instead. Anyone who waits longer than
+    `timeout` runs `fn` themselves. Returns the value and whether this caller ran `fn`.
+    """
+    if timeout is None:
+        timeout = getattr(settings, "OSIG_RENDER_COALESCE_TIMEOUT_SECONDS", 10)
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _Flight()
+            _flights[key] = flight
+
+    if not is_leader:
+        if flight.done.wait(timeout):
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, False
+
+        logger.warning("Timed out waiting for in-flight render", key=key, timeout=timeout)
+        return fn(), True
+
+    token = uuid.uuid4().hex
+    acquired = _acquire_lock(key, token)
+
+    try:
+        value = None
+        ran_fn = False
+
+        if not acquired:
+            value = _wait_for_remote(key, poll, timeout)
+
+        if value is None:
+            value = fn()
+            ran_fn = True
+
+        flight.value = value
+        return value, ran_fn
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        if acquired:
+            _release_lock(key, token)
+
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
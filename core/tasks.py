@@ -1,20 +1,27 @@
+import hashlib
 import uuid
+from datetime import timedelta
 
 import requests
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.db import transaction
+from django.utils import timezone
+from django_q.tasks import schedule
 
 from core.image_styles import generate_image_router
+from core.image_utils import OUTPUT_CONTENT_TYPES
 from core.models import Image
+from core.render_cache import CacheHitMode, build_render_key, cache_hit_mode, invalidate_cached_render
 from osig.utils import get_osig_logger
 
 logger = get_osig_logger(__name__)
 
 
 def _get_output_extension(image_data):
-    return "jpeg" if image_data.get("format") == "jpeg" else "png"
+    output_format = image_data.get("format")
+    return output_format if output_format in OUTPUT_CONTENT_TYPES else "png"
 
 
 def save_generated_image(image, image_data):
@@ -23,10 +30,17 @@ def save_generated_image(image, image_data):
 
     try:
         with transaction.atomic():
-            image_obj, created = Image.objects.get_or_create(image_data=image_data)
+            image_obj, created = Image.objects.get_or_create(
+                render_key=build_render_key(image_data),
+                defaults={"image_data": image_data},
+            )
 
-            image_content = ContentFile(image.getvalue())
-            image_obj.generated_image.save(image_filename, image_content, save=True)
+            if not created and image_obj.generated_image:
+                return f"Skipped duplicate save for image: {image_obj.id}"
+
+            content = image if isinstance(image, bytes) else image.getvalue()
+            image_obj.content_sha256 = hashlib.sha256(content).hexdigest()
+            image_obj.generated_image.save(image_filename, ContentFile(content), save=True)
 
         action = "Saved new" if created else "Updated existing"
         return f"{action} image: {image_filename}"
@@ -35,6 +49,27 @@ def save_generated_image(image, image_data):
         raise
 
 
+def delete_replaced_image(image_path):
+    logger.info("Deleting old image", extra={"path": image_path})
+    default_storage.delete(image_path)
+    return f"Deleted replaced image: {image_path}"
+
+
+def _delete_replaced_image(image_path):
+    if cache_hit_mode() == CacheHitMode.PROXY:
+        delete_replaced_image(image_path)
+        return
+
+    # Cache-hit redirects to the old object may be cached for up to their max-age; keep it until they expire.
+    max_age = getattr(settings, "OSIG_CACHE_HIT_REDIRECT_MAX_AGE_SECONDS", 60 * 60)
+    schedule(
+        "core.tasks.delete_replaced_image",
+        image_path,
+        name=f"Delete replaced image {image_path}"[:100],
+        next_run=timezone.now() + timedelta(seconds=max_age),
+    )
+
+
 @transaction.atomic
 def regenerate_and_update_image(image_id, image_data):
     try:
@@ -42,22 +77,34 @@ def regenerate_and_update_image(image_id, image_data):
 
         new_image = generate_image_router(image_data)
         old_image_path = image_obj.generated_image.name
+        image_obj.regeneration_requested_at = None
+        image_obj.regeneration_queued_at = None
 
         if not default_storage.exists(old_image_path):
+            image_obj.save(update_fields=["regeneration_requested_at", "regeneration_queued_at"])
             return "Old image not found in S3, skipping regeneration"
 
+        content = new_image.getvalue()
+        content_sha256 = hashlib.sha256(content).hexdigest()
+
+        if content_sha256 == image_obj.content_sha256:
+            # Same bytes as the stored object: only mark it fresh, skip the S3 upload and delete.
+            image_obj.save(update_fields=["regeneration_requested_at", "regeneration_queued_at", "updated_at"])
+            invalidate_cached_render(build_render_key(image_data))
+            return "Regenerated image is unchanged, kept stored file"
+
         prefix = "key_" if image_data.get("key") else "no_key_"
         image_filename = f"{prefix}{uuid.uuid4().hex[:12]}.{_get_output_extension(image_data)}"
-        image_content = ContentFile(new_image.getvalue())
 
         for key, value in image_data.items():
             setattr(image_obj, key, value)
 
-        image_obj.generated_image.save(image_filename, image_content, save=True)
+        image_obj.content_sha256 = content_sha256
+        image_obj.generated_image.save(image_filename, ContentFile(content), save=True)
+        invalidate_cached_render(build_render_key(image_data))
 
         if old_image_path:
-            logger.info("Deleting old image", extra={"path": old_image_path})
-            default_storage.delete(old_image_path)
+            _delete_replaced_image(old_image_path)
 
         return "Regenerated and updated image"
     except Image.DoesNotExist:
@@ -1,5 +1,24 @@
+import pytest
 from django.conf import settings
+from django.core.cache import cache
 
 
 def pytest_configure(config):
     settings.STORAGES["staticfiles"]["BACKEND"] = "django.contrib.staticfiles.storage.StaticFilesStorage"
+    # Tests run in one process, so a local cache behaves like the shared one.
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@pytest.fixture(autouse=True)
+def reset_render_caches():
+    from core.image_utils import clear_quality_cache
+    from core.remote_assets import clear_remote_asset_memory_cache
+    from core.render_cache import reset_render_cache
+    from core.render_observability import discard_buffered_render_attempts
+
+    reset_render_cache()
+    discard_buffered_render_attempts()
+    clear_quality_cache()
+    clear_remote_asset_memory_cache()
+    cache.clear()
+    yield
@@ -0,0 +1,120 @@
+import io
+import threading
+
+import pytest
+from django.contrib.auth.models import User
+from django.test import override_settings
+from PIL import Image
+
+
+def _tiny_png_buffer():
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), color="white").save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def threaded_render(monkeypatch):
+    import core.views as core_views
+
+    threads = {"render": [], "prefetch": []}
+
+    def fake_router(params, principal=None):
+        threads["render"].append(threading.current_thread().name)
+        return _tiny_png_buffer()
+
+    def fake_prefetch(url):
+        threads["prefetch"].append(threading.current_thread().name)
+        return True
+
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
+    monkeypatch.setattr(core_views, "generate_image_router", fake_router)
+    monkeypatch.setattr(core_views, "prefetch_remote_asset", fake_prefetch)
+    return threads
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_endpoint_fetches_and_renders_off_the_event_loop(client, threaded_render):
+    params = {"style": "logo", "title": "Async", "image_url": "https://example.com/logo.png"}
+
+    first = client.get("/g/async", data=params)
+    second = client.get("/g/async", data=params)
+
+    assert first.status_code == 200
+    assert first.content == second.content == _tiny_png_buffer().getvalue()
+    assert first["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert len(threaded_render["render"]) == 1
+    assert threaded_render["render"][0].startswith("osig-render")
+    assert threaded_render["prefetch"][0].startswith("osig-fetch")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_endpoint_shares_render_cache_with_sync_endpoint(client, threaded_render):
+    params = {"style": "base", "title": "Shared"}
+
+    client.get("/g", data=params)
+    response = client.get("/g/async", data=params)
+
+    assert response.status_code == 200
+    assert len(threaded_render["render"]) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_endpoint_streams_large_stored_renders_chunk_by_chunk(
+    async_client, threaded_render, monkeypatch, settings, tmp_path
+):
+    from asgiref.sync import async_to_sync
+
+    import core.render_cache as render_cache
+    from core.tasks import save_generated_image
+
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.OSIG_RENDER_STREAM_MIN_BYTES = 10
+    monkeypatch.setattr(render_cache, "STREAM_CHUNK_BYTES", 16)
+    save_generated_image(_tiny_png_buffer().getvalue(), {"style": "base", "title": "Streamed", "key": "", "site": "x"})
+
+    async def fetch():
+        response = await async_client.get("/g/async", data={"style": "base", "title": "Streamed"})
+        return response, [chunk async for chunk in response.streaming_content]
+
+    response, chunks = async_to_sync(fetch)()
+
+    assert response.is_async
+    assert len(chunks) > 1
+    assert b"".join(chunks) == _tiny_png_buffer().getvalue()
+    assert threaded_render["render"] == []
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(OSIG_DAILY_USAGE_LIMIT=2, OSIG_MONTHLY_USAGE_LIMIT=50, OSIG_USAGE_WARNING_PERCENT=0.8)
+def test_async_endpoint_tracks_usage(client, threaded_render):
+    user = User.objects.create_user(username="async-user", email="async@example.com", password="pass123")
+    key = user.profile.key
+
+    ok = client.get("/g/async", data={"style": "base", "title": "Quota", "key": key})
+    blocked = client.get("/g/async", data={"style": "base", "title": "Quota", "key": key})
+
+    assert ok["X-OSIG-Daily-Usage"] == "1/2"
+    assert blocked.status_code == 429
+
+
+def test_pool_jobs_run_between_connection_cleanups(monkeypatch):
+    from asgiref.sync import async_to_sync
+
+    import core.async_render as async_render
+
+    events = []
+    monkeypatch.setattr(
+        async_render, "close_old_connections", lambda: events.append(("cleanup", threading.current_thread().name))
+    )
+
+    def job():
+        events.append(("job", threading.current_thread().name))
+
+    async_to_sync(async_render.run_render)(job)
+
+    assert [event for event, _ in events] == ["cleanup", "job", "cleanup"]
+    assert len({thread for _, thread in events}) == 1
+    assert events[0][1].startswith("osig-render")
@@ -0,0 +1,72 @@
+from core.font_registry import FontRegistry
+from core.image_styles import FONT_SIZE_RATIOS, warm_serving_process, warm_style_fonts
+from core.image_utils import font_registry, get_image_dimensions, load_default_font, load_font
+
+
+def test_load_font_reuses_parsed_face():
+    font_registry.clear()
+
+    first = load_font("helvetica", 45)
+    second = load_font("helvetica", 45)
+
+    assert first is second
+    stats = font_registry.stats()
+    assert stats.misses == 1
+    assert stats.hits == 1
+
+
+def test_unknown_font_falls_back_to_cached_default():
+    font_registry.clear()
+
+    fallback = load_font("does-not-exist", 20)
+
+    assert fallback is load_default_font(20)
+    assert load_font("does-not-exist", 20) is fallback
+
+
+def test_unknown_font_names_never_take_registry_slots():
+    font_registry.clear()
+    warmed = load_font("helvetica", 45)
+
+    for index in range(font_registry.max_entries * 2):
+        load_font(f"random-{index}", 45)
+
+    assert ("helvetica", 45, 0) in font_registry
+    assert font_registry.stats().size == 2
+    assert load_font("helvetica", 45) is warmed
+
+
+def test_registry_evicts_least_recently_used_entry():
+    registry = FontRegistry(max_entries=2)
+
+    registry.get_or_load("a", lambda: "font-a")
+    registry.get_or_load("b", lambda: "font-b")
+    registry.get_or_load("a", lambda: "font-a")
+    registry.get_or_load("c", lambda: "font-c")
+
+    assert "a" in registry
+    assert "b" not in registry
+    assert "c" in registry
+
+
+def test_warm_style_fonts_preloads_style_sizes_for_every_site():
+    font_registry.clear()
+
+    warm_style_fonts()
+    misses_after_warm = font_registry.stats().misses
+
+    for site in ("x", "meta"):
+        _, height = get_image_dimensions(site)
+        for ratio in FONT_SIZE_RATIOS:
+            load_font("helvetica", int(height * ratio))
+
+    assert font_registry.stats().misses == misses_after_warm
+
+
+def test_serving_process_warm_up_can_be_turned_off(settings):
+    settings.OSIG_RENDER_WARM_ON_STARTUP = False
+    font_registry.clear()
+
+    warm_serving_process()
+
+    assert font_registry.stats().size == 0
@@ -5,6 +5,7 @@ from types import SimpleNamespace
 from urllib.parse import parse_qs, urlparse
 
 import pytest
+from django.core.files.base import ContentFile
 from django.utils import timezone
 from PIL import Image
 
@@ -16,7 +17,7 @@ from core.signing import build_signed_params
 def disable_async_tasks(monkeypatch):
     import core.views as core_views
 
-    monkeypatch.setattr(core_views, "async_task", lambda *args, **kwargs: None)
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
 
 
 def _tiny_png_buffer():
@@ -56,7 +57,7 @@ class TestSignedUrls:
     def test_generate_image_accepts_valid_signature(self, client, disable_async_tasks, monkeypatch):
         import core.views as core_views
 
-        monkeypatch.setattr(core_views, "generate_image_router", lambda params: _tiny_png_buffer())
+        monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: _tiny_png_buffer())
 
         signed_params, _ = build_signed_params(
             {
@@ -78,7 +79,7 @@ class TestSignedUrls:
     def test_generate_image_rejects_tampered_signature(self, client, disable_async_tasks, monkeypatch):
         import core.views as core_views
 
-        monkeypatch.setattr(core_views, "generate_image_router", lambda params: _tiny_png_buffer())
+        monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: _tiny_png_buffer())
 
         signed_params, _ = build_signed_params(
             {
@@ -97,7 +98,7 @@ class TestSignedUrls:
     def test_generate_image_rejects_expired_signature(self, client, disable_async_tasks, monkeypatch):
         import core.views as core_views
 
-        monkeypatch.setattr(core_views, "generate_image_router", lambda params: _tiny_png_buffer())
+        monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: _tiny_png_buffer())
 
         signed_params, _ = build_signed_params(
             {
@@ -153,6 +154,32 @@ class TestOutputFormatAndCompression:
         assert first.content == second.content
         assert first.content != lower_quality.content
 
+    def test_generate_image_supports_webp(self, client, disable_async_tasks):
+        response = client.get("/g", data={"style": "base", "title": "WebP", "format": "webp"})
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "image/webp"
+        assert response.content[8:12] == b"WEBP"
+        assert "Accept" not in response.get("Vary", "")
+
+    def test_auto_format_negotiates_from_accept_header(self, client, disable_async_tasks):
+        params = {"style": "base", "title": "Negotiated", "format": "auto"}
+
+        modern = client.get("/g", data=params, HTTP_ACCEPT="image/avif;q=0,image/webp,image/*;q=0.8")
+        legacy = client.get("/g", data=params, HTTP_ACCEPT="image/*,*/*;q=0.8")
+
+        assert modern["Content-Type"] == "image/webp"
+        assert legacy["Content-Type"] == "image/png"
+        assert "Accept" in modern["Vary"]
+        assert "Accept" in legacy["Vary"]
+        assert modern.content != legacy.content
+
+    def test_negotiated_formats_are_stored_with_matching_extension(self):
+        from core.tasks import _get_output_extension
+
+        assert _get_output_extension({"format": "webp"}) == "webp"
+        assert _get_output_extension({"format": "auto"}) == "png"
+
 
 @pytest.mark.django_db
 class TestJobBoardTemplatePack:
@@ -177,7 +204,7 @@ class TestJobBoardTemplatePack:
 
         captured_params = {}
 
-        def fake_router(params):
+        def fake_router(params, principal=None):
             captured_params.update(params)
             return _tiny_png_buffer()
 
@@ -219,43 +246,101 @@ class TestJobBoardTemplatePack:
 
 @pytest.mark.django_db
 class TestCacheAndVersioning:
-    def test_v_query_param_changes_cache_key_lookup(self, client, disable_async_tasks, monkeypatch):
-        import core.views as core_views
+    def test_v_query_param_changes_cache_key_lookup(self, client, disable_async_tasks, monkeypatch, settings):
+        import core.render_cache as render_cache
 
-        requested_image_data = []
+        # fake_filter stands in for the render-key lookup only. A stale hit also marks the row for
+        # regeneration through the same manager, and the dev default max age of 0 makes every hit stale.
+        settings.OSIG_REGENERATION_MAX_AGE_SECONDS = None
+        requested_render_keys = []
+        stored_payloads = {}
 
         def fake_filter(*args, **kwargs):
-            image_data = kwargs["image_data"]
-            requested_image_data.append(dict(image_data))
+            requested_render_keys.append(kwargs["render_key"])
 
-            version = image_data.get("v")
-            payload = b"image-v1" if version == "1" else b"image-v2"
+            payload = f"image-{len(requested_render_keys)}".encode()
+            name = f"generated_images/image-{len(requested_render_keys)}.png"
+            stored_payloads[name] = payload
             cached_object = SimpleNamespace(
                 id=1,
-                generated_image=payload,
+                generated_image=ContentFile(payload, name=name),
                 updated_at=timezone.now(),
+                content_sha256="",
             )
             return SimpleNamespace(first=lambda: cached_object)
 
-        monkeypatch.setattr(core_views.ImageModel.objects, "filter", fake_filter)
+        monkeypatch.setattr(render_cache.Image.objects, "filter", fake_filter)
+        monkeypatch.setattr(
+            render_cache,
+            "_open_stored_render",
+            lambda name: (io.BytesIO(stored_payloads[name]), len(stored_payloads[name])),
+        )
 
         response_v1 = client.get("/g", data={"style": "base", "title": "Cache", "v": "1"})
         response_v2 = client.get("/g", data={"style": "base", "title": "Cache", "v": "2"})
 
         assert response_v1.status_code == 200
         assert response_v2.status_code == 200
-        assert response_v1.content == b"image-v1"
-        assert response_v2.content == b"image-v2"
+        assert response_v1.content == b"image-1"
+        assert response_v2.content == b"image-2"
 
-        assert requested_image_data[0]["v"] == "1"
-        assert requested_image_data[1]["v"] == "2"
+        assert len(requested_render_keys) == 2
+        assert requested_render_keys[0] != requested_render_keys[1]
 
     def test_generate_image_sets_explicit_cache_headers(self, client, disable_async_tasks, monkeypatch):
         import core.views as core_views
 
-        monkeypatch.setattr(core_views, "generate_image_router", lambda params: _tiny_png_buffer())
+        monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: _tiny_png_buffer())
 
         response = client.get("/g", data={"style": "base", "title": "Cache headers"})
 
         assert response.status_code == 200
         assert response["Cache-Control"] == "public, max-age=31536000, immutable"
+
+    def test_matching_etag_short_circuits_to_304_without_rendering(self, client, disable_async_tasks, monkeypatch):
+        import core.views as core_views
+
+        monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: _tiny_png_buffer())
+
+        first = client.get("/g", data={"style": "base", "title": "Revalidate"})
+        changed = client.get("/g", data={"style": "base", "title": "Other"}, HTTP_IF_NONE_MATCH=first["ETag"])
+
+        monkeypatch.setattr(
+            core_views, "generate_image_router", lambda params, principal=None: pytest.fail("rendered again")
+        )
+        monkeypatch.setattr(core_views, "get_cached_render", lambda render_key: pytest.fail("cache was read"))
+        revalidated = client.get("/g", data={"style": "base", "title": "Revalidate"}, HTTP_IF_NONE_MATCH=first["ETag"])
+
+        assert first["ETag"].startswith('"') and first["ETag"].endswith('"')
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+        assert revalidated["ETag"] == first["ETag"]
+        assert revalidated["Cache-Control"] == "public, max-age=31536000, immutable"
+        assert changed.status_code == 200
+        assert changed["ETag"] != first["ETag"]
+
+    def test_if_modified_since_uses_stored_updated_at(self, client, disable_async_tasks, settings, tmp_path):
+        from django.utils.http import http_date
+
+        from core.models import Image as ImageModel
+        from core.tasks import save_generated_image
+
+        settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+        settings.MEDIA_ROOT = str(tmp_path)
+
+        save_generated_image(_tiny_png_buffer().getvalue(), {"style": "base", "title": "Dated", "key": "", "site": "x"})
+        updated_at = ImageModel.objects.get().updated_at
+
+        stored = client.get("/g", data={"style": "base", "title": "Dated"})
+        not_modified = client.get(
+            "/g", data={"style": "base", "title": "Dated"}, HTTP_IF_MODIFIED_SINCE=stored["Last-Modified"]
+        )
+        modified = client.get(
+            "/g",
+            data={"style": "base", "title": "Dated"},
+            HTTP_IF_MODIFIED_SINCE=http_date((updated_at - timedelta(days=1)).timestamp()),
+        )
+
+        assert stored["Last-Modified"] == http_date(updated_at.timestamp())
+        assert not_modified.status_code == 304
+        assert modified.status_code == 200
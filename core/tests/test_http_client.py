@@ -0,0 +1,83 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+
+import pytest
+
+from core import http_client
+from core.http_client import HostConcurrencyTimeout, ResponseTooLargeError, fetch_url, reset_http_client
+from core.render_observability import RenderErrorType, classify_render_error
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections: ClassVar[set] = set()
+
+    def do_GET(self):
+        _Handler.connections.add(self.client_address)
+        body = b"x" * 4096
+        self.send_response(200)
+        if self.path == "/unsized":
+            # No Content-Length: the client can only notice the size while streaming.
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    reset_http_client()
+    _Handler.connections = set()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+    reset_http_client()
+
+
+def test_sequential_fetches_reuse_one_connection(server):
+    for _ in range(3):
+        assert len(fetch_url(f"{server}/logo.png").content) == 4096
+
+    assert len(_Handler.connections) == 1
+
+
+@pytest.mark.parametrize("path", ["/logo.png", "/unsized"])
+def test_oversized_body_is_rejected_as_validation_error(server, settings, path):
+    settings.OSIG_IMAGE_FETCH_MAX_BYTES = 1024
+
+    with pytest.raises(ResponseTooLargeError) as exc_info:
+        fetch_url(f"{server}{path}")
+
+    assert classify_render_error(exc_info.value) == RenderErrorType.VALIDATION_ERROR
+
+
+def test_saturated_host_times_out_as_transient_error(server, settings):
+    settings.OSIG_HTTP_MAX_CONNECTIONS_PER_HOST = 1
+    settings.OSIG_IMAGE_FETCH_TIMEOUT_SECONDS = 0.1
+    held = http_client._host_slot(f"{server}/a.png")
+    held.acquire()
+
+    with pytest.raises(HostConcurrencyTimeout) as exc_info:
+        fetch_url(f"{server}/b.png")
+
+    assert classify_render_error(exc_info.value) == RenderErrorType.TRANSIENT_UPSTREAM_FETCH
+
+
+def test_host_slots_are_dropped_once_no_fetch_holds_them(server):
+    port = server.rsplit(":", 1)[1]
+    # Each userinfo prefix makes a distinct netloc, standing in for many user-supplied hosts.
+    for i in range(50):
+        fetch_url(f"http://user{i}@127.0.0.1:{port}/logo.png")
+
+    assert len(http_client._host_slots) == 0
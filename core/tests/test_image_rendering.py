@@ -0,0 +1,129 @@
+import io
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+from core.image_styles import _new_canvas, _precomposed_canvas, generate_job_clean_image
+from core.image_utils import (
+    add_watermark,
+    create_image_buffer,
+    draw_title_line,
+    get_image_dimensions,
+    load_default_font,
+    load_font,
+)
+
+
+def test_precomposed_canvas_is_reused_and_copies_are_independent():
+    width, height = get_image_dimensions("x")
+
+    first = _new_canvas("job_clean", width, height)
+    ImageDraw.Draw(first).rectangle([0, 0, width, height], fill=(0, 0, 0))
+    second = _new_canvas("job_clean", width, height)
+
+    assert _precomposed_canvas("job_clean", (width, height)) is _precomposed_canvas("job_clean", (width, height))
+    assert second.getpixel((width - 1, height - 1)) == (250, 250, 252)
+    assert second.getpixel((0, 0)) == (37, 99, 235)
+
+
+def test_base_canvas_matches_overlay_composited_on_white():
+    width, height = get_image_dimensions("meta")
+    expected = Image.alpha_composite(
+        Image.new("RGB", (width, height), color=(255, 255, 255)).convert("RGBA"),
+        Image.new("RGBA", (width, height), (0, 0, 0, 180)),
+    )
+
+    assert _new_canvas("base", width, height).tobytes() == expected.tobytes()
+
+
+def test_watermark_stamp_matches_direct_text_drawing():
+    width, height = get_image_dimensions("x")
+    font = load_default_font(int(height * 0.05))
+    bbox = font.getbbox("made with osig.app")
+
+    expected = Image.new("RGB", (width, height), color=(30, 30, 30))
+    ImageDraw.Draw(expected).text(
+        (width - (bbox[2] - bbox[0]) - int(width * 0.02), height - (bbox[3] - bbox[1]) - int(height * 0.08)),
+        "made with osig.app",
+        font=font,
+        fill=(255, 255, 255, 128),
+    )
+
+    stamped = Image.new("RGB", (width, height), color=(30, 30, 30))
+    add_watermark(stamped, ImageDraw.Draw(stamped), width, height)
+
+    assert stamped.tobytes() == expected.tobytes()
+
+
+def test_renders_do_not_leak_into_cached_canvas():
+    width, height = get_image_dimensions("x")
+    pristine = _precomposed_canvas("job_clean", (width, height)).tobytes()
+
+    generate_job_clean_image(
+        profile_id=None,
+        site="x",
+        font="helvetica",
+        title="Title",
+        subtitle="Subtitle",
+        eyebrow="Eyebrow",
+        image_url=None,
+    )
+
+    assert _precomposed_canvas("job_clean", (width, height)).tobytes() == pristine
+
+
+@pytest.mark.parametrize("bold_offset", [0, 1, 2, 4])
+def test_single_pass_title_matches_multi_pass_faux_bold(bold_offset):
+    font = load_font("helvetica", 45)
+    line = "Senior Django Engineer"
+
+    expected = Image.new("RGB", (800, 120), color=(17, 24, 39))
+    expected_draw = ImageDraw.Draw(expected)
+    for offset_x in range(-bold_offset - 1, bold_offset + 1):
+        for offset_y in range(-bold_offset, bold_offset + 1):
+            expected_draw.text((40 + offset_x, 30 + offset_y), line, font=font, fill=(255, 255, 255))
+
+    actual = Image.new("RGB", (800, 120), color=(17, 24, 39))
+    draw_title_line(ImageDraw.Draw(actual), (40, 30), line, font, (255, 255, 255), bold_offset)
+
+    # Multi-pass drawing rounds to 8 bits after every pass; the merged mask rounds once.
+    max_channel_difference = max(high for _, high in ImageChops.difference(expected, actual).getextrema())
+    assert max_channel_difference <= 6
+
+
+def _flat_card():
+    width, height = get_image_dimensions("x")
+    img = _new_canvas("job_clean", width, height)
+    draw_title_line(
+        ImageDraw.Draw(img), (60, 120), "Senior Django Engineer", load_font("helvetica", 45), (17, 24, 39), 0
+    )
+    return img
+
+
+def test_flat_color_styles_are_written_as_smaller_palette_pngs():
+    img = _flat_card()
+
+    palette_png = create_image_buffer(img, style="job_clean").getvalue()
+    rgb_png = create_image_buffer(img, style="base").getvalue()
+
+    decoded = Image.open(io.BytesIO(palette_png))
+    assert decoded.mode == "P"
+    assert Image.open(io.BytesIO(rgb_png)).mode == "RGB"
+    assert len(palette_png) < len(rgb_png) * 0.7
+    assert ImageChops.difference(img.convert("RGB"), decoded.convert("RGB")).getbbox() is None
+
+
+def test_palette_pngs_keep_near_identical_colors_apart():
+    img = Image.new("RGB", (64, 64), (10, 20, 30))
+    img.paste((11, 20, 30), (0, 0, 32, 64))
+
+    decoded = Image.open(create_image_buffer(img, style="logo"))
+
+    assert decoded.mode == "P"
+    assert ImageChops.difference(img, decoded.convert("RGB")).getbbox() is None
+
+
+def test_photographic_content_stays_rgb_in_flat_styles():
+    noise = Image.merge("RGB", [Image.effect_noise((400, 200), sigma) for sigma in (40, 64, 90)])
+
+    assert Image.open(create_image_buffer(noise, style="logo")).mode == "RGB"
@@ -0,0 +1,71 @@
+from PIL import Image, ImageDraw
+
+from core import image_utils
+from core.image_utils import MIN_LOSSY_QUALITY, _highest_fitting_quality, create_image_buffer
+
+
+def _busy_image():
+    img = Image.linear_gradient("L").resize((800, 450)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for x in range(0, 800, 7):
+        draw.line([(x, 0), (800 - x, 450)], fill=(x % 255, 90, 200), width=2)
+    return img
+
+
+def _encoded_quality(img, target_size):
+    """Highest quality that fits, found the slow way."""
+    for quality in range(85, MIN_LOSSY_QUALITY - 1, -1):
+        if len(image_utils._encode_jpeg(img, quality)) <= target_size:
+            return quality
+    return MIN_LOSSY_QUALITY
+
+
+def test_search_finds_highest_fitting_quality_from_any_guess():
+    for answer in (20, 47, 84):
+        for guess in (None, 20, 46, 47, 48, 84):
+            probes = []
+
+            def fits(quality, probes=probes, answer=answer):
+                probes.append(quality)
+                return quality <= answer
+
+            assert _highest_fitting_quality(fits, 20, 84, guess=guess) == answer
+            # A bad guess costs at most a gallop plus a bisection of what is left.
+            assert len(probes) <= 15
+
+
+def test_max_kb_picks_best_quality_within_budget():
+    img = _busy_image()
+    target_size = 30 * 1024
+
+    buffer = create_image_buffer(img, output_format="jpeg", quality=85, max_kb=30)
+
+    expected = image_utils._encode_jpeg(img, _encoded_quality(img, target_size))
+    assert len(buffer.getvalue()) <= target_size
+    assert buffer.getvalue() == expected
+
+
+def test_chosen_quality_is_reused_for_the_same_render_key(monkeypatch):
+    img = _busy_image()
+    first = create_image_buffer(img, output_format="jpeg", quality=85, max_kb=30, render_key="k").getvalue()
+
+    encodes = []
+    original_encode = image_utils._encode_jpeg
+
+    def counting_encode(img, quality, optimize=True):
+        encodes.append(quality)
+        return original_encode(img, quality, optimize)
+
+    monkeypatch.setattr(image_utils, "_encode_jpeg", counting_encode)
+    second = create_image_buffer(img, output_format="jpeg", quality=85, max_kb=30, render_key="k").getvalue()
+
+    assert second == first
+    assert len(encodes) == 1
+
+
+def test_unreachable_budget_falls_back_to_minimum_quality():
+    img = _busy_image()
+
+    buffer = create_image_buffer(img, output_format="jpeg", quality=85, max_kb=1)
+
+    assert buffer.getvalue() == image_utils._encode_jpeg(img, MIN_LOSSY_QUALITY)
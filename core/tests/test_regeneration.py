@@ -0,0 +1,240 @@
+import io
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+from django_q.models import Schedule
+from PIL import Image
+
+from core import regeneration
+from core.models import Image as ImageModel
+from core.regeneration import request_regeneration, sweep_stale_renders
+from core.schedules import sync_periodic_schedules
+from core.tasks import delete_replaced_image, save_generated_image
+
+
+def _png_bytes(color="white"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def stored_images(settings, tmp_path):
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.OSIG_REGENERATION_MAX_AGE_SECONDS = 60 * 60
+
+    def create(count, style="base"):
+        for index in range(count):
+            save_generated_image(_png_bytes(), {"style": style, "title": f"Stored {index}", "key": "", "site": "x"})
+        ImageModel.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+        return list(ImageModel.objects.order_by("id"))
+
+    return create
+
+
+@pytest.fixture
+def fake_render(monkeypatch):
+    import core.tasks as core_tasks
+
+    rendered = {"color": "white", "count": 0}
+
+    def render(params):
+        rendered["count"] += 1
+        return io.BytesIO(_png_bytes(rendered["color"]))
+
+    monkeypatch.setattr(core_tasks, "generate_image_router", render)
+    return rendered
+
+
+@pytest.fixture
+def queued_tasks(monkeypatch):
+    queued = []
+    monkeypatch.setattr(regeneration, "async_task", lambda func, *args: queued.append((func, args)))
+    return queued
+
+
+def _run(queued_tasks):
+    while queued_tasks:
+        func, args = queued_tasks.pop(0)
+        func(*args)
+
+
+@pytest.mark.django_db
+def test_stale_image_is_requested_once_per_marker(stored_images, django_assert_num_queries):
+    image = stored_images(1)[0]
+
+    assert request_regeneration(image.id, image.updated_at, "base")
+    with django_assert_num_queries(0):
+        assert not request_regeneration(image.id, image.updated_at, "base")
+
+    image.refresh_from_db()
+    assert image.regeneration_requested_at is not None
+
+
+@pytest.mark.django_db
+def test_freshness_policy_is_per_style(stored_images, settings):
+    image = stored_images(1)[0]
+    settings.OSIG_REGENERATION_MAX_AGE_BY_STYLE = {"logo": 60 * 60 * 24}
+
+    assert not request_regeneration(image.id, image.updated_at, "logo")
+    assert not request_regeneration(image.id, timezone.now(), "base")
+
+    settings.OSIG_REGENERATION_MAX_AGE_SECONDS = None
+    assert not request_regeneration(image.id, image.updated_at, "base")
+
+
+@pytest.mark.django_db
+def test_sweep_queues_one_task_per_image_and_skips_unchanged_uploads(
+    stored_images, fake_render, queued_tasks, settings
+):
+    images = stored_images(3)
+    settings.OSIG_REGENERATION_SWEEP_BATCH_SIZE = 2
+    for image in images:
+        request_regeneration(image.id, image.updated_at, "base")
+    stored_names = {image.id: image.generated_image.name for image in images}
+
+    assert sweep_stale_renders() == "Queued 2 stale images for regeneration"
+    assert [args for _, args in queued_tasks] == [(images[0].id,), (images[1].id,)]
+    _run(queued_tasks)
+
+    refreshed = list(ImageModel.objects.order_by("id"))
+    assert fake_render["count"] == 2
+    assert [image.regeneration_requested_at is None for image in refreshed] == [True, True, False]
+    # Identical bytes: the stored object is kept and only marked fresh.
+    assert {image.id: image.generated_image.name for image in refreshed} == stored_names
+    assert refreshed[0].updated_at > images[0].updated_at
+
+    fake_render["color"] = "black"
+    sweep_stale_renders()
+    _run(queued_tasks)
+
+    last = ImageModel.objects.get(id=images[2].id)
+    assert last.regeneration_requested_at is None
+    assert last.generated_image.name != stored_names[last.id]
+
+
+@pytest.mark.django_db
+def test_image_queued_twice_is_regenerated_once(stored_images, fake_render, queued_tasks):
+    image = stored_images(1)[0]
+    request_regeneration(image.id, image.updated_at, "base")
+
+    sweep_stale_renders()
+    sweep_stale_renders()
+    _run(queued_tasks)
+
+    assert fake_render["count"] == 1
+
+
+@pytest.mark.django_db
+def test_backed_up_sweeps_move_on_to_the_next_batch(stored_images, fake_render, queued_tasks, settings):
+    images = stored_images(3)
+    settings.OSIG_REGENERATION_SWEEP_BATCH_SIZE = 2
+    for image in images:
+        request_regeneration(image.id, image.updated_at, "base")
+
+    assert sweep_stale_renders() == "Queued 2 stale images for regeneration"
+    assert sweep_stale_renders() == "Queued 1 stale images for regeneration"
+    assert sweep_stale_renders() == "Queued 0 stale images for regeneration"
+    assert [args for _, args in queued_tasks] == [(images[0].id,), (images[1].id,), (images[2].id,)]
+
+    # Tasks that never ran are queued again once their stamp is old enough.
+    ImageModel.objects.update(regeneration_queued_at=timezone.now() - timedelta(hours=2))
+    assert sweep_stale_renders() == "Queued 2 stale images for regeneration"
+
+
+@pytest.mark.django_db
+def test_failed_regeneration_clears_the_request(stored_images, queued_tasks, monkeypatch):
+    import core.tasks as core_tasks
+
+    def failing_render(params):
+        raise OSError("render failed")
+
+    image = stored_images(1)[0]
+    request_regeneration(image.id, image.updated_at, "base")
+    monkeypatch.setattr(core_tasks, "generate_image_router", failing_render)
+    sweep_stale_renders()
+
+    with pytest.raises(OSError):
+        _run(queued_tasks)
+
+    image.refresh_from_db()
+    assert (image.regeneration_requested_at, image.regeneration_queued_at) == (None, None)
+
+
+@pytest.mark.django_db
+def test_sweep_schedule_follows_the_interval_setting(settings):
+    settings.OSIG_REGENERATION_SWEEP_MINUTES = 15
+
+    sync_periodic_schedules()
+
+    sweep = Schedule.objects.get(func="core.regeneration.sweep_stale_renders")
+    assert (sweep.schedule_type, sweep.minutes, sweep.repeats) == (Schedule.MINUTES, 15, -1)
+
+
+@pytest.mark.django_db
+def test_overlapping_sweeps_are_skipped(stored_images, fake_render, queued_tasks):
+    image = stored_images(1)[0]
+    request_regeneration(image.id, image.updated_at, "base")
+    regeneration._marker_cache().add(regeneration.SWEEP_LOCK_KEY, 1)
+
+    assert sweep_stale_renders() == "Skipped, a sweep is already running"
+    assert queued_tasks == []
+
+
+@pytest.mark.django_db
+def test_cache_hits_on_stale_images_only_mark_them_for_the_sweep(client, stored_images, monkeypatch):
+    import core.tasks as core_tasks
+
+    monkeypatch.setattr(core_tasks, "generate_image_router", lambda params: pytest.fail("regenerated inline"))
+    image = stored_images(1)[0]
+
+    responses = [client.get("/g", data={"style": "base", "title": "Stored 0"}) for _ in range(3)]
+
+    image.refresh_from_db()
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert image.regeneration_requested_at is not None
+
+
+@pytest.mark.django_db
+def test_replaced_object_outlives_cached_redirects_to_it(stored_images, fake_render, queued_tasks, settings):
+    from django.core.files.storage import default_storage
+    from django_q.models import Schedule
+
+    settings.OSIG_CACHE_HIT_MODE = "redirect"
+    settings.OSIG_CACHE_HIT_REDIRECT_MAX_AGE_SECONDS = 60 * 60
+    image = stored_images(1)[0]
+    old_name = image.generated_image.name
+    request_regeneration(image.id, image.updated_at, "base")
+    fake_render["color"] = "black"
+
+    sweep_stale_renders()
+    _run(queued_tasks)
+
+    assert default_storage.exists(old_name)
+    deletion = Schedule.objects.get(func="core.tasks.delete_replaced_image")
+    assert deletion.next_run >= timezone.now() + timedelta(minutes=59)
+
+    assert deletion.args == repr((old_name,))
+
+    delete_replaced_image(old_name)
+    assert not default_storage.exists(old_name)
+
+
+@pytest.mark.django_db
+def test_regenerated_image_gets_a_new_etag(client, stored_images, fake_render, queued_tasks):
+    image = stored_images(1)[0]
+    params = {"style": "base", "title": "Stored 0"}
+    before = client.get("/g", data=params)
+
+    fake_render["color"] = "black"
+    sweep_stale_renders()
+    _run(queued_tasks)
+    revalidated = client.get("/g", data=params, HTTP_IF_NONE_MATCH=before["ETag"])
+
+    image.refresh_from_db()
+    assert image.regeneration_requested_at is None
+    assert revalidated.status_code == 200
+    assert revalidated["ETag"] != before["ETag"]
+    assert client.get("/g", data=params, HTTP_IF_NONE_MATCH=revalidated["ETag"]).status_code == 304
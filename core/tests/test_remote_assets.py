@@ -0,0 +1,205 @@
+import io
+
+import pytest
+import requests
+from PIL import Image, ImageChops
+
+from core import remote_assets
+from core.http_client import FetchedResponse
+from core.remote_assets import SourceImageTooLargeError, clear_remote_asset_memory_cache, fetch_remote_image
+from core.render_observability import RenderErrorType, classify_render_error
+
+
+def _png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(f"{status_code} error", response=response)
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch, settings, tmp_path):
+    settings.OSIG_REMOTE_ASSET_CACHE_DIR = str(tmp_path)
+    calls = []
+    responses = []
+
+    def fetch_url(url, headers=None):
+        calls.append(headers)
+        result = responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(remote_assets, "fetch_url", fetch_url)
+    return calls, responses
+
+
+def test_same_url_is_fetched_once_across_sizes_and_processes(fake_fetch):
+    calls, responses = fake_fetch
+    responses.append(FetchedResponse(200, {"ETag": '"v1"'}, _png_bytes((255, 0, 0))))
+
+    first = fetch_remote_image("https://example.com/a.png", 10, 10)
+    first.putpixel((0, 0), (0, 0, 0))
+    second = fetch_remote_image("https://example.com/a.png", 10, 10)
+    clear_remote_asset_memory_cache()
+    other_size = fetch_remote_image("https://example.com/a.png", 20, 10)
+
+    assert len(calls) == 1
+    assert second.getpixel((0, 0)) == (255, 0, 0)
+    assert other_size.size == (20, 10)
+
+
+def test_stale_entry_is_revalidated_with_validators(fake_fetch, settings):
+    settings.OSIG_REMOTE_ASSET_FRESH_SECONDS = 0
+    calls, responses = fake_fetch
+    responses.append(
+        FetchedResponse(
+            200, {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, _png_bytes((0, 255, 0))
+        )
+    )
+    responses.append(FetchedResponse(304, {}, b""))
+
+    fetch_remote_image("https://example.com/b.png", 10, 10)
+    revalidated = fetch_remote_image("https://example.com/b.png", 10, 10)
+
+    assert calls[1] == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert revalidated.getpixel((0, 0)) == (0, 255, 0)
+
+
+def test_stale_bytes_are_served_when_revalidation_times_out(fake_fetch, settings):
+    settings.OSIG_REMOTE_ASSET_FRESH_SECONDS = 0
+    _, responses = fake_fetch
+    responses.append(FetchedResponse(200, {}, _png_bytes((0, 0, 255))))
+    responses.append(requests.exceptions.Timeout("slow origin"))
+
+    fetch_remote_image("https://example.com/c.png", 10, 10)
+
+    assert fetch_remote_image("https://example.com/c.png", 10, 10).getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_client_errors_are_negatively_cached(fake_fetch):
+    calls, responses = fake_fetch
+    responses.append(_http_error(404))
+
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            fetch_remote_image("https://example.com/missing.png", 10, 10)
+
+    assert len(calls) == 1
+
+
+def test_upstream_5xx_is_not_negatively_cached(fake_fetch):
+    calls, responses = fake_fetch
+    # A real Response is falsy for error statuses, which used to hide the status code.
+    responses.extend([_http_error(503), _http_error(503)])
+
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            fetch_remote_image("https://example.com/flaky.png", 10, 10)
+
+    assert len(calls) == 2
+
+
+def _jpeg_bytes(size):
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize(size).convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale(monkeypatch):
+    content = _jpeg_bytes((4000, 3000))
+    decoded_sizes = []
+    original_load = Image.Image.load
+
+    def recording_load(img):
+        decoded_sizes.append(img.size)
+        return original_load(img)
+
+    monkeypatch.setattr(Image.Image, "load", recording_load)
+    resized = remote_assets.decode_and_resize(content, 400, 225)
+    monkeypatch.undo()
+
+    expected = Image.open(io.BytesIO(content)).convert("RGB").resize((400, 225), Image.LANCZOS)
+    assert resized.size == (400, 225)
+    assert decoded_sizes[0] == (500, 375)
+    max_channel_difference = max(high for _, high in ImageChops.difference(expected, resized).getextrema())
+    assert max_channel_difference <= 8
+
+
+def test_sources_over_the_pixel_cap_are_rejected_before_decoding(fake_fetch, settings):
+    settings.OSIG_IMAGE_MAX_PIXELS = 500
+    calls, responses = fake_fetch
+    responses.append(FetchedResponse(200, {}, _png_bytes((255, 255, 255))))
+
+    for _ in range(2):
+        with pytest.raises(SourceImageTooLargeError) as exc_info:
+            fetch_remote_image("https://example.com/huge.png", 10, 10)
+
+    assert classify_render_error(exc_info.value) == RenderErrorType.VALIDATION_ERROR
+    assert len(calls) == 1
+
+
+def test_prefetch_seeds_the_disk_cache_for_the_render(fake_fetch):
+    calls, responses = fake_fetch
+    responses.append(FetchedResponse(200, {}, _png_bytes((10, 20, 30))))
+
+    assert remote_assets.prefetch_remote_asset("https://example.com/prefetched.png") is True
+    assert fetch_remote_image("https://example.com/prefetched.png", 10, 10).getpixel((0, 0)) == (10, 20, 30)
+    assert len(calls) == 1
+
+
+def test_decoded_images_are_bounded_by_bytes():
+    cache = remote_assets._DecodedImageCache(max_bytes=10 * 10 * 3 * 2)
+
+    for index in range(3):
+        cache.set(("https://example.com/a.png", index, 10), 0.0, Image.new("RGB", (10, 10)))
+    cache.set(("https://example.com/huge.png", 100, 100), 0.0, Image.new("RGB", (100, 100)))
+
+    assert cache.total_bytes == 600
+    assert cache.get(("https://example.com/a.png", 0, 10)) is None
+    assert cache.get(("https://example.com/a.png", 2, 10)) is not None
+    assert cache.get(("https://example.com/huge.png", 100, 100)) is None
+
+
+def test_negative_cache_prunes_expired_entries_and_caps_its_size(monkeypatch):
+    now = {"value": 0.0}
+    monkeypatch.setattr(remote_assets.time, "monotonic", lambda: now["value"])
+    cache = remote_assets._NegativeCache(max_entries=3)
+
+    cache.set("https://example.com/old", ValueError("old"), ttl_seconds=10)
+    now["value"] = 20.0
+    for index in range(5):
+        cache.set(f"https://example.com/{index}", ValueError(str(index)), ttl_seconds=10)
+
+    assert len(cache) == 3
+    assert cache.get("https://example.com/old") is None
+    assert cache.get("https://example.com/4") is not None
+
+
+def test_disk_cache_evicts_least_recently_read_entries(fake_fetch, settings, tmp_path):
+    import os
+
+    _, responses = fake_fetch
+    content = _png_bytes((255, 0, 0))
+    urls = [f"https://example.com/{index}.png" for index in range(3)]
+    for index, url in enumerate(urls):
+        responses.append(FetchedResponse(200, {}, content))
+        fetch_remote_image(url, 10, 10)
+        os.utime(remote_assets._asset_paths(url)[0], (index, index))
+        if index == 0:
+            # Room for three entries and a half, since metadata sizes differ by a few bytes.
+            entry_bytes = sum(path.stat().st_size for path in tmp_path.iterdir())
+            settings.OSIG_REMOTE_ASSET_DISK_MAX_BYTES = entry_bytes * 7 // 2
+    remote_assets._read_disk_entry(urls[0])
+
+    responses.append(FetchedResponse(200, {}, content))
+    fetch_remote_image("https://example.com/new.png", 10, 10)
+
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) <= settings.OSIG_REMOTE_ASSET_DISK_MAX_BYTES
+    assert remote_assets._read_disk_entry(urls[1]) is None
+    assert remote_assets._read_disk_entry(urls[0]) is not None
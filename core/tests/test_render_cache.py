@@ -0,0 +1,260 @@
+import io
+
+import pytest
+from django.contrib.auth.models import User
+from PIL import Image
+
+from core.models import Image as ImageModel
+from core.render_cache import (
+    ByteBudgetLRU,
+    CachedRender,
+    CacheLayer,
+    build_render_key,
+    get_cached_render,
+    get_render_cache_stats,
+)
+from core.tasks import save_generated_image
+
+
+def _tiny_png_buffer():
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), color="white").save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def counting_router(monkeypatch):
+    import core.views as core_views
+
+    calls = {"count": 0}
+
+    def fake_router(params, principal=None):
+        calls["count"] += 1
+        return _tiny_png_buffer()
+
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
+    monkeypatch.setattr(core_views, "generate_image_router", fake_router)
+    return calls
+
+
+def test_render_key_ignores_param_order_empty_values_and_derived_fields():
+    first = build_render_key({"style": "base", "title": "Hello", "subtitle": None, "key": ""})
+    second = build_render_key({"title": "Hello", "style": "base", "profile_id": 7})
+
+    assert first == second
+    assert first != build_render_key({"style": "base", "title": "Hello", "v": "2"})
+
+
+def test_byte_budget_lru_evicts_oldest_entries_over_budget():
+    lru = ByteBudgetLRU(max_bytes=10, ttl_seconds=60)
+
+    lru.set("a", CachedRender(content=b"12345"))
+    lru.set("b", CachedRender(content=b"12345"))
+    lru.set("c", CachedRender(content=b"123"))
+
+    assert lru.get("a") is None
+    assert lru.get("b") is not None
+    assert lru.get("c") is not None
+    assert lru.total_bytes == 8
+
+
+def test_byte_budget_lru_expires_entries_after_ttl():
+    lru = ByteBudgetLRU(max_bytes=100, ttl_seconds=0)
+
+    lru.set("a", CachedRender(content=b"data"))
+
+    assert lru.get("a") is None
+
+
+@pytest.mark.django_db
+def test_repeated_request_is_served_from_memory_without_rendering(client, counting_router):
+    params = {"style": "base", "title": "Popular"}
+
+    first = client.get("/g", data=params)
+    second = client.get("/g", data=params)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert first.content == second.content
+    assert counting_router["count"] == 1
+    assert get_render_cache_stats()["layers"][CacheLayer.MEMORY]["hits"] == 1
+
+
+@pytest.mark.django_db
+def test_shared_cache_hit_skips_storage_lookup(client, counting_router, monkeypatch):
+    from core import render_cache
+
+    params = {"style": "base", "title": "Shared"}
+    client.get("/g", data=params)
+
+    render_cache._memory_cache.clear()
+    monkeypatch.setattr(render_cache, "_load_from_storage", lambda render_key: pytest.fail("storage was queried"))
+
+    response = client.get("/g", data=params)
+
+    assert response.status_code == 200
+    assert counting_router["count"] == 1
+    assert get_render_cache_stats()["layers"][CacheLayer.SHARED]["hits"] == 1
+
+
+@pytest.mark.django_db
+def test_render_cache_stats_endpoint_is_superuser_only(client):
+    admin_user = User.objects.create_superuser(username="admin", email="admin@example.com", password="pass123")
+
+    response = client.get("/api/admin/render-cache-stats", data={"api_key": admin_user.profile.key})
+    anonymous = client.get("/api/admin/render-cache-stats")
+
+    assert response.status_code == 200
+    assert set(response.json()["layers"]) == {CacheLayer.MEMORY, CacheLayer.SHARED, CacheLayer.STORAGE}
+    assert anonymous.status_code == 401
+
+
+@pytest.mark.django_db
+def test_saved_images_are_looked_up_by_indexed_render_key(settings, tmp_path):
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+
+    params = {"style": "base", "title": "Stored", "profile_id": None}
+    save_generated_image(_tiny_png_buffer(), params)
+    save_generated_image(_tiny_png_buffer(), {**params, "profile_id": 3})
+
+    render_key = build_render_key(params)
+    assert ImageModel.objects.count() == 1
+    assert ImageModel.objects.get().render_key == render_key
+
+    cached, layer = get_cached_render(render_key)
+
+    assert layer == CacheLayer.STORAGE
+    assert cached.content == _tiny_png_buffer().getvalue()
+
+
+@pytest.mark.django_db
+def test_fresh_render_shares_one_buffer_with_cache_and_save_task(client, monkeypatch):
+    import core.views as core_views
+
+    queued = []
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: queued.append(args))
+    monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: _tiny_png_buffer())
+
+    response = client.get("/g", data={"style": "base", "title": "Zero copy"})
+
+    cached, _ = get_cached_render(build_render_key({"style": "base", "title": "Zero copy", "key": "", "site": "x"}))
+    assert response["Content-Length"] == str(len(response.content))
+    assert queued[0][0] is cached.content
+
+
+@pytest.mark.django_db
+def test_large_stored_images_stream_from_storage_without_caching(client, counting_router, settings, tmp_path):
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.OSIG_RENDER_STREAM_MIN_BYTES = 10
+
+    params = {"style": "base", "title": "Streamed", "key": "", "site": "x"}
+    save_generated_image(_tiny_png_buffer().getvalue(), params)
+
+    first = client.get("/g", data={"style": "base", "title": "Streamed"})
+    second = client.get("/g", data={"style": "base", "title": "Streamed"})
+
+    assert first.streaming
+    assert b"".join(first.streaming_content) == _tiny_png_buffer().getvalue()
+    assert first["Content-Length"] == str(len(_tiny_png_buffer().getvalue()))
+    assert second.streaming
+    second.close()
+    assert counting_router["count"] == 0
+    assert get_render_cache_stats()["layers"][CacheLayer.STORAGE]["hits"] == 2
+
+
+@pytest.mark.django_db
+def test_streamed_hit_opens_the_stored_object_once(client, counting_router, settings, tmp_path, monkeypatch):
+    import core.render_cache as render_cache
+
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.OSIG_RENDER_STREAM_MIN_BYTES = 10
+    save_generated_image(_tiny_png_buffer().getvalue(), {"style": "base", "title": "Once", "key": "", "site": "x"})
+
+    opened = []
+    open_stored_render = render_cache._open_stored_render
+    monkeypatch.setattr(
+        render_cache, "_open_stored_render", lambda name: opened.append(name) or open_stored_render(name)
+    )
+    response = client.get("/g", data={"style": "base", "title": "Once"})
+
+    assert b"".join(response.streaming_content) == _tiny_png_buffer().getvalue()
+    assert len(opened) == 1
+
+
+@pytest.mark.django_db
+def test_redirect_mode_sends_cache_hits_to_media_url(
+    client, counting_router, settings, tmp_path, django_assert_num_queries
+):
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.MEDIA_URL = "https://cdn.example.com/media/"
+    settings.OSIG_CACHE_HIT_MODE = "redirect"
+
+    params = {"style": "base", "title": "Redirected", "key": "", "site": "x"}
+    save_generated_image(_tiny_png_buffer().getvalue(), params)
+    storage_name = ImageModel.objects.get().generated_image.name
+
+    first = client.get("/g", data={"style": "base", "title": "Redirected"})
+    with django_assert_num_queries(0):
+        second = client.get("/g", data={"style": "base", "title": "Redirected"})
+
+    assert first.status_code == 302
+    assert first["Location"] == f"https://cdn.example.com/media/{storage_name}"
+    assert first["Cache-Control"] == "public, max-age=3600"
+    assert second["Location"] == first["Location"]
+    assert counting_router["count"] == 0
+
+
+@pytest.mark.django_db
+def test_redirect_mode_falls_back_to_proxying_when_the_object_is_missing(client, counting_router, settings, tmp_path):
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.OSIG_CACHE_HIT_MODE = "redirect"
+
+    params = {"style": "base", "title": "Vanished", "key": "", "site": "x"}
+    save_generated_image(_tiny_png_buffer().getvalue(), params)
+    stored = ImageModel.objects.get().generated_image
+    stored.storage.delete(stored.name)
+
+    response = client.get("/g", data={"style": "base", "title": "Vanished"})
+
+    assert response.status_code == 200
+    assert response.content == _tiny_png_buffer().getvalue()
+    assert counting_router["count"] == 1
+
+
+@pytest.mark.django_db
+def test_signed_redirect_caps_max_age_at_the_signed_url_expiry(
+    client, counting_router, settings, tmp_path, monkeypatch
+):
+    import core.views as core_views
+
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.OSIG_CACHE_HIT_MODE = "signed_redirect"
+    settings.OSIG_SIGNED_STORAGE_URL_EXPIRE_SECONDS = 120
+    monkeypatch.setattr(
+        core_views, "stored_render_url", lambda name, signed: f"https://bucket.example.com/{name}?signed={signed}"
+    )
+
+    save_generated_image(_tiny_png_buffer().getvalue(), {"style": "base", "title": "Signed", "key": "", "site": "x"})
+
+    response = client.get("/g", data={"style": "base", "title": "Signed"})
+
+    assert response.status_code == 302
+    assert response["Location"].endswith("?signed=True")
+    assert response["Cache-Control"] == "public, max-age=120"
+
+
+def test_per_process_render_cache_is_flagged(settings):
+    from core.checks import check_shared_caches
+
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://x"}}
+    assert check_shared_caches(None) == []
+
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    assert {warning.id for warning in check_shared_caches(None)} == {"osig.W001"}
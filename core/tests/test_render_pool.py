@@ -0,0 +1,131 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from core.image_styles import generate_image_router
+from core.models import RenderAttempt
+from core.render_pool import RenderPool, RenderPoolSaturatedError
+
+
+class _ManualExecutor:
+    """Stands in for the process pool; futures complete only when the test says so."""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_pool_renders_in_worker_process_and_reports_utilization():
+    pool = RenderPool(workers=1, max_queue=0)
+    params = {"style": "base", "site": "x", "title": "Pooled", "subtitle": "Render"}
+
+    try:
+        rendered = pool.render(params)
+    finally:
+        pool.shutdown()
+
+    stats = pool.stats()
+    assert rendered.getvalue() == generate_image_router(params).getvalue()
+    assert stats["completed"] == 1
+    assert len(stats["worker_utilization_percent"]) == 1
+
+
+def test_pool_rejects_renders_once_workers_and_queue_are_full(monkeypatch, settings):
+    settings.OSIG_RENDER_POOL_RETRY_AFTER_SECONDS = 3
+    executor = _ManualExecutor()
+    monkeypatch.setattr(RenderPool, "_start_executor", lambda self: executor)
+    pool = RenderPool(workers=1, max_queue=1)
+
+    admitted = [threading.Thread(target=pool.render, args=({"title": str(n)},)) for n in range(2)]
+    for thread in admitted:
+        thread.start()
+    while len(executor.futures) < 2:
+        time.sleep(0.01)
+
+    assert pool.stats()["queue_depth"] == 1
+    with pytest.raises(RenderPoolSaturatedError) as exc_info:
+        pool.render({"title": "overflow"})
+    assert exc_info.value.retry_after_seconds == 3
+
+    for future in executor.futures:
+        future.set_result((b"png", 123, 0.25, 0.1, {"draw": 90.0}))
+    for thread in admitted:
+        thread.join(5)
+
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["max_wait_ms"] == 250.0
+
+
+@pytest.mark.django_db
+def test_saturated_pool_returns_fast_503_with_retry_after(client, monkeypatch, settings):
+    import core.views as core_views
+
+    settings.OSIG_RENDER_POOL_ENABLED = True
+
+    def saturated(params, principal=None):
+        raise RenderPoolSaturatedError(2)
+
+    monkeypatch.setattr(core_views, "render_in_pool", saturated)
+
+    response = client.get("/g", data={"style": "base", "title": "Busy"})
+
+    assert response.status_code == 503
+    assert response["Retry-After"] == "2"
+    assert RenderAttempt.objects.count() == 0
+
+
+def test_timed_out_render_keeps_its_slot_until_the_worker_finishes(monkeypatch, settings):
+    from concurrent.futures import TimeoutError as FutureTimeoutError
+
+    settings.OSIG_RENDER_POOL_TIMEOUT_SECONDS = 0
+    executor = _ManualExecutor()
+    monkeypatch.setattr(RenderPool, "_start_executor", lambda self: executor)
+    pool = RenderPool(workers=1, max_queue=0)
+
+    with pytest.raises(FutureTimeoutError):
+        pool.render({"title": "stuck"})
+    with pytest.raises(RenderPoolSaturatedError):
+        pool.render({"title": "next"})
+
+    executor.futures[0].set_result((b"png", 123, 0.0, 31.0, {}))
+    assert pool.stats()["in_flight"] == 0
+    with pytest.raises(FutureTimeoutError):
+        pool.render({"title": "admitted again"})
+
+
+def test_broken_pool_is_replaced_once(monkeypatch):
+    started = []
+    monkeypatch.setattr(RenderPool, "_start_executor", lambda self: started.append(1) or _ManualExecutor())
+    pool = RenderPool(workers=1, max_queue=0)
+    broken = pool._executor
+
+    restarts = [threading.Thread(target=pool._restart, args=(broken,)) for _ in range(4)]
+    for thread in restarts:
+        thread.start()
+    for thread in restarts:
+        thread.join(5)
+
+    assert len(started) == 2
+    assert pool._executor is not broken
+
+
+def test_pool_size_is_split_between_server_workers(monkeypatch, settings):
+    from core import render_pool
+
+    monkeypatch.setattr(render_pool.os, "cpu_count", lambda: 8)
+    settings.OSIG_RENDER_POOL_WORKERS = 0
+    settings.WEB_CONCURRENCY = 3
+
+    assert render_pool._worker_count() == 2
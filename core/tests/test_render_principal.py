@@ -0,0 +1,74 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth.models import User
+from PIL import Image
+
+from core.image_styles import generate_image_router
+from core.principal import RenderPrincipal, resolve_render_principal
+
+
+def _tiny_png_buffer():
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), color="white").save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.django_db
+def test_warm_keyed_render_makes_no_queries(client, monkeypatch, django_assert_num_queries):
+    import core.usage as usage
+    import core.views as core_views
+
+    # Tests run in one process, so the local cache stands in for the shared usage cache.
+    monkeypatch.setattr(usage, "cache_is_shared", lambda alias: True)
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
+    monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: _tiny_png_buffer())
+    key = User.objects.create_user(username="principal", password="pass123").profile.key
+
+    client.get("/g", data={"style": "base", "title": "Warm", "key": key})
+    with django_assert_num_queries(0):
+        response = client.get("/g", data={"style": "base", "title": "Warm", "key": key})
+
+    assert response.status_code == 200
+    assert response["X-OSIG-Daily-Usage"].startswith("2/")
+
+
+@pytest.mark.django_db
+def test_unknown_keys_are_cached_too(django_assert_num_queries):
+    assert resolve_render_principal("missing-key") is None
+    with django_assert_num_queries(0):
+        assert resolve_render_principal("missing-key") is None
+
+
+def test_router_takes_pro_status_from_the_principal(monkeypatch):
+    import core.image_styles as image_styles
+
+    monkeypatch.setattr(
+        image_styles, "check_if_profile_has_pro_subscription", lambda profile_id: pytest.fail("looked up profile")
+    )
+    principal = RenderPrincipal(profile_id=1, key="k", has_pro_subscription=True, daily_limit=None, monthly_limit=None)
+
+    rendered = generate_image_router({"style": "base", "site": "x", "title": "Pro", "profile_id": 1}, principal)
+
+    assert Image.open(rendered).format == "PNG"
+
+
+@pytest.mark.django_db
+def test_subscription_webhooks_invalidate_the_cached_principal(monkeypatch, django_assert_num_queries):
+    import core.webhooks as webhooks
+
+    profile = User.objects.create_user(username="churned", password="pass123").profile
+    resolve_render_principal(profile.key)
+
+    event = SimpleNamespace(data={"object": {"customer": "cus_1", "id": "sub_1"}})
+    monkeypatch.setattr(webhooks.Event.objects, "get", lambda **kwargs: event)
+    monkeypatch.setattr(webhooks.Customer.objects, "get", lambda **kwargs: SimpleNamespace(id="cus_1"))
+    monkeypatch.setattr(webhooks.Profile.objects, "get", lambda **kwargs: profile)
+
+    webhooks.handle_deleted_subscription(event=SimpleNamespace(id=1))
+
+    with django_assert_num_queries(1):
+        principal = resolve_render_principal(profile.key)
+    assert principal.has_pro_subscription is False
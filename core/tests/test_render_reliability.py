@@ -1,13 +1,16 @@
 import io
+from datetime import timedelta
 
 import pytest
 import requests
 from django.contrib.auth.models import User
+from django.db import OperationalError
 from django.test import override_settings
+from django.utils import timezone
 from PIL import Image
 
 from core.models import RenderAttempt
-from core.render_observability import RenderErrorType
+from core.render_observability import RenderErrorType, flush_render_attempts
 
 
 def _tiny_png_buffer():
@@ -24,13 +27,13 @@ def test_retries_transient_render_failures(client, monkeypatch):
 
     call_count = {"value": 0}
 
-    def flaky_router(params):
+    def flaky_router(params, principal=None):
         call_count["value"] += 1
         if call_count["value"] == 1:
             raise requests.exceptions.Timeout("network timeout")
         return _tiny_png_buffer()
 
-    monkeypatch.setattr(core_views, "async_task", lambda *args, **kwargs: None)
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
     monkeypatch.setattr(core_views, "generate_image_router", flaky_router)
 
     response = client.get("/g", data={"style": "base", "title": "Retry test"})
@@ -38,6 +41,7 @@ def test_retries_transient_render_failures(client, monkeypatch):
     assert response.status_code == 200
     assert call_count["value"] == 2
 
+    flush_render_attempts()
     attempts = list(RenderAttempt.objects.order_by("created_at"))
     assert len(attempts) == 2
     assert attempts[0].success is False
@@ -52,11 +56,11 @@ def test_does_not_retry_non_transient_errors(client, monkeypatch):
 
     call_count = {"value": 0}
 
-    def invalid_router(params):
+    def invalid_router(params, principal=None):
         call_count["value"] += 1
         raise ValueError("invalid payload")
 
-    monkeypatch.setattr(core_views, "async_task", lambda *args, **kwargs: None)
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
     monkeypatch.setattr(core_views, "generate_image_router", invalid_router)
 
     response = client.get("/g", data={"style": "base", "title": "Validation failure"})
@@ -65,6 +69,7 @@ def test_does_not_retry_non_transient_errors(client, monkeypatch):
     assert "validation_error" in response.content.decode("utf-8")
     assert call_count["value"] == 1
 
+    flush_render_attempts()
     attempts = list(RenderAttempt.objects.all())
     assert len(attempts) == 1
     assert attempts[0].error_type == RenderErrorType.VALIDATION_ERROR
@@ -97,3 +102,119 @@ def test_render_metrics_dashboard_returns_fail_rate_and_p95(client):
     assert payload["fail_rate_percent"] == 25.0
     assert payload["p95_render_ms"] == 300
     assert payload["error_counts"][RenderErrorType.TRANSIENT_UPSTREAM_FETCH] == 1
+
+
+@pytest.mark.django_db
+def test_attempts_are_buffered_and_written_in_one_insert(django_assert_num_queries):
+    from core.render_observability import record_render_attempt
+
+    with django_assert_num_queries(0):
+        for duration_ms in (100, 200, 300):
+            record_render_attempt(profile_id=None, key="", style="base", success=True, duration_ms=duration_ms)
+
+    with django_assert_num_queries(1):
+        assert flush_render_attempts() == 3
+    assert RenderAttempt.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_attempts_keep_the_time_they_were_recorded(monkeypatch):
+    from core.render_observability import record_render_attempt
+
+    recorded_at = timezone.now() - timedelta(minutes=5)
+    monkeypatch.setattr(timezone, "now", lambda: recorded_at)
+    record_render_attempt(profile_id=None, key="", style="base", success=True, duration_ms=100)
+    monkeypatch.undo()
+
+    flush_render_attempts()
+
+    assert RenderAttempt.objects.get().created_at == recorded_at
+
+
+@pytest.mark.django_db
+def test_failed_flush_keeps_the_batch_for_the_next_one(monkeypatch):
+    from core.render_observability import record_render_attempt
+
+    record_render_attempt(profile_id=None, key="", style="base", success=False, duration_ms=100)
+    bulk_create = RenderAttempt.objects.bulk_create
+
+    def failing_bulk_create(objs, **kwargs):
+        raise OperationalError("database is unavailable")
+
+    monkeypatch.setattr(RenderAttempt.objects, "bulk_create", failing_bulk_create)
+    assert flush_render_attempts() == 0
+
+    monkeypatch.setattr(RenderAttempt.objects, "bulk_create", bulk_create)
+    assert flush_render_attempts() == 1
+    assert RenderAttempt.objects.count() == 1
+
+
+@pytest.mark.django_db
+@override_settings(OSIG_RENDER_ATTEMPT_SUCCESS_SAMPLE_RATE=0.5)
+def test_sampled_successes_are_weighted_and_failures_always_kept(monkeypatch):
+    import core.render_observability as render_observability
+    from core.render_observability import build_render_metrics, record_render_attempt
+
+    draws = iter([0.2, 0.7, 0.4, 0.9])
+    monkeypatch.setattr(render_observability.random, "random", lambda: next(draws))
+
+    for _ in range(4):
+        record_render_attempt(profile_id=None, key="", style="base", success=True, duration_ms=100)
+    record_render_attempt(
+        profile_id=None,
+        key="",
+        style="base",
+        success=False,
+        duration_ms=50,
+        error_type=RenderErrorType.RENDER_ERROR,
+    )
+    flush_render_attempts()
+
+    metrics = build_render_metrics()
+
+    assert RenderAttempt.objects.filter(success=True).count() == 2
+    assert RenderAttempt.objects.filter(success=False).count() == 1
+    assert metrics.total_attempts == 5
+    assert metrics.fail_rate_percent == 20.0
+
+
+@pytest.mark.django_db
+def test_metrics_are_answered_from_rollups_plus_the_raw_tail(django_assert_num_queries):
+    from core.models import RenderMetricsRollup
+    from core.render_observability import build_render_metrics, rollup_render_attempts
+
+    for duration_ms in (100, 200, 300, 5000):
+        RenderAttempt.objects.create(style="base", success=True, duration_ms=duration_ms)
+    RenderAttempt.objects.create(style="logo", success=False, error_type=RenderErrorType.RENDER_ERROR)
+    RenderAttempt.objects.update(created_at=timezone.now() - timedelta(hours=3))
+
+    rollup_render_attempts()
+    rollup_render_attempts()
+    assert RenderMetricsRollup.objects.count() == 2
+
+    # Raw rows of rolled-up hours are no longer read.
+    RenderAttempt.objects.all().delete()
+    RenderAttempt.objects.create(style="base", success=True, duration_ms=250)
+
+    with django_assert_num_queries(3):
+        metrics = build_render_metrics(window_hours=24)
+
+    assert metrics.total_attempts == 6
+    assert metrics.failed_attempts == 1
+    assert metrics.error_counts == {RenderErrorType.RENDER_ERROR: 1}
+    # Five successes: the p95 falls in the bucket of the slowest, clipped to its duration.
+    assert metrics.p95_render_ms == 5000
+
+    assert build_render_metrics(window_hours=1).total_attempts == 1
+
+
+@pytest.mark.django_db
+@override_settings(OSIG_RENDER_METRICS_ROLLUP_MINUTES=30)
+def test_rollup_schedule_follows_the_interval_setting():
+    from django_q.models import Schedule
+
+    from core.schedules import sync_periodic_schedules
+
+    sync_periodic_schedules()
+
+    assert Schedule.objects.get(func="core.render_observability.rollup_render_attempts").minutes == 30
@@ -0,0 +1,61 @@
+import pytest
+
+from core import render_timing
+from core.models import RenderAttempt
+from core.render_observability import flush_render_attempts
+from core.render_timing import render_stage, start_stage_timings
+
+
+def _server_timing(response) -> dict[str, float]:
+    entries = (entry.split(";dur=") for entry in response["Server-Timing"].split(", "))
+    return {stage: float(duration) for stage, duration in entries}
+
+
+def test_nested_stages_count_only_their_own_time(monkeypatch):
+    clock = iter([0.0, 0.0, 0.010, 0.015, 0.040, 0.065, 0.100])
+    monkeypatch.setattr(render_timing, "perf_counter", lambda: next(clock))
+    timings = start_stage_timings()
+
+    with render_stage("draw"):
+        with render_stage("layout"):
+            pass
+        with render_stage("encode"):
+            pass
+
+    assert timings.as_dict() == {"layout": 5.0, "draw": 70.0, "encode": 25.0}
+
+
+@pytest.mark.django_db
+def test_render_miss_reports_stages_in_the_header_and_on_the_attempt(client, monkeypatch, settings):
+    import core.views as core_views
+
+    settings.OSIG_SERVER_TIMING_ENABLED = True
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
+
+    response = client.get("/g", data={"style": "base", "title": "Timed"})
+
+    assert response.status_code == 200
+    stages = _server_timing(response)
+    assert {"cache", "storage", "layout", "draw", "encode", "total"} <= set(stages)
+    assert "fetch" not in stages
+
+    flush_render_attempts()
+    attempt = RenderAttempt.objects.get()
+    assert {"layout", "draw", "encode"} <= set(attempt.stage_timings)
+    assert "cache" not in attempt.stage_timings
+
+
+@pytest.mark.django_db
+def test_cache_hits_only_report_the_lookup(client, monkeypatch, settings):
+    import core.views as core_views
+
+    settings.OSIG_SERVER_TIMING_ENABLED = True
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
+    client.get("/g", data={"style": "base", "title": "Hit"})
+
+    response = client.get("/g", data={"style": "base", "title": "Hit"})
+
+    assert set(_server_timing(response)) == {"cache", "total"}
+
+    del settings.OSIG_SERVER_TIMING_ENABLED
+    assert "Server-Timing" not in client.get("/g", data={"style": "base", "title": "Hit"})
@@ -0,0 +1,114 @@
+import io
+
+import pytest
+from PIL import Image
+
+from core import save_pipeline
+from core.models import Image as ImageModel
+from core.save_pipeline import flush_staged_images, stage_generated_image
+from core.tasks import save_generated_image
+
+
+def _png_bytes(color="white"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), color=color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _params(title):
+    return {"style": "base", "title": title, "key": "", "site": "x"}
+
+
+@pytest.fixture
+def scheduled(monkeypatch, settings, tmp_path):
+    settings.STORAGES = {**settings.STORAGES, "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.OSIG_SAVE_BATCH_WINDOW_SECONDS = 3600
+
+    # Tests run in one process, so the local cache stands in for a shared one.
+    monkeypatch.setattr(save_pipeline, "cache_is_shared", lambda alias: True)
+    calls = []
+    monkeypatch.setattr(save_pipeline, "schedule", lambda func, *args, **kwargs: calls.append((func, args)))
+    return calls
+
+
+@pytest.mark.django_db
+def test_renders_sharing_a_key_are_staged_once_and_only_the_batch_id_is_queued(scheduled):
+    assert stage_generated_image(_png_bytes(), _params("Once"))
+    assert not stage_generated_image(_png_bytes(), _params("Once"))
+    assert stage_generated_image(_png_bytes("black"), _params("Twice"))
+
+    assert len(scheduled) == 1
+    func, args = scheduled[0]
+    assert func == save_pipeline.FLUSH_FUNC
+    assert len(args) == 1 and isinstance(args[0], int)
+
+
+@pytest.mark.django_db
+def test_flush_uploads_a_batch_and_skips_images_already_stored(scheduled):
+    save_generated_image(_png_bytes(), _params("Stored"))
+    for title in ("First", "Second", "Stored"):
+        stage_generated_image(_png_bytes(), _params(title))
+
+    result = flush_staged_images(scheduled[0][1][0])
+
+    assert result == "Saved 2 of 3 staged images (1 already stored, 0 retrying)"
+    assert ImageModel.objects.count() == 3
+    for image in ImageModel.objects.all():
+        with image.generated_image.open("rb") as stored:
+            assert stored.read() == _png_bytes()
+        assert image.content_sha256
+
+    # The spool is emptied, so the same render can be staged again later.
+    assert stage_generated_image(_png_bytes(), _params("First"))
+
+
+@pytest.mark.django_db
+def test_flush_drops_its_upload_when_a_row_won_the_race(scheduled, monkeypatch):
+    stage_generated_image(_png_bytes(), _params("Raced"))
+    bulk_create = ImageModel.objects.bulk_create
+
+    def racing_bulk_create(objs, **kwargs):
+        save_generated_image(_png_bytes(), _params("Raced"))
+        return bulk_create(objs, **kwargs)
+
+    monkeypatch.setattr(ImageModel.objects, "bulk_create", racing_bulk_create)
+
+    flush_staged_images(scheduled[0][1][0])
+
+    image = ImageModel.objects.get()
+    storage = image.generated_image.storage
+    assert storage.listdir("generated_images")[1] == [image.generated_image.name.split("/")[-1]]
+
+
+@pytest.mark.django_db
+def test_failed_upload_keeps_its_entry_and_retries_with_the_next_batch(scheduled, monkeypatch):
+    stage_generated_image(_png_bytes(), _params("Flaky"))
+    stage_generated_image(_png_bytes(), _params("Fine"))
+    upload = save_pipeline._upload
+
+    def flaky_upload(render_key, content, params):
+        if params["title"] == "Flaky":
+            raise OSError("storage unavailable")
+        return upload(render_key, content, params)
+
+    monkeypatch.setattr(save_pipeline, "_upload", flaky_upload)
+    monkeypatch.setattr(save_pipeline.time, "time", lambda: 10_000_000.0)
+    assert flush_staged_images(scheduled[0][1][0]) == "Saved 1 of 2 staged images (0 already stored, 1 retrying)"
+
+    assert not stage_generated_image(_png_bytes(), _params("Flaky"))
+    assert len(scheduled) == 2
+    monkeypatch.setattr(save_pipeline, "_upload", upload)
+    assert flush_staged_images(scheduled[1][1][0]) == "Saved 1 of 1 staged images (0 already stored, 0 retrying)"
+    assert sorted(ImageModel.objects.values_list("image_data__title", flat=True)) == ["Fine", "Flaky"]
+
+
+@pytest.mark.django_db
+def test_renders_are_saved_through_the_task_queue_without_a_shared_cache(monkeypatch):
+    queued = []
+    monkeypatch.setattr(save_pipeline, "async_task", lambda func, *args: queued.append((func, args)))
+    monkeypatch.setattr(save_pipeline, "schedule", lambda *args, **kwargs: pytest.fail("spooled to a local cache"))
+
+    assert stage_generated_image(b"png", _params("Local"))
+
+    assert queued == [(save_generated_image, (b"png", _params("Local")))]
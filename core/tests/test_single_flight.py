@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+from django.core.cache import cache
+
+from core.single_flight import LOCK_KEY_PREFIX, single_flight
+
+
+def test_concurrent_callers_share_one_execution():
+    started = threading.Event()
+    release = threading.Event()
+    calls = {"count": 0}
+
+    def slow_render():
+        calls["count"] += 1
+        started.set()
+        release.wait(5)
+        return b"rendered"
+
+    results = []
+
+    def leader():
+        results.append(single_flight("same-key", slow_render, poll=lambda: None, timeout=5))
+
+    def follower():
+        results.append(
+            single_flight("same-key", lambda: pytest.fail("follower rendered"), poll=lambda: None, timeout=5)
+        )
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    started.wait(5)
+
+    follower_threads = [threading.Thread(target=follower) for _ in range(3)]
+    for thread in follower_threads:
+        thread.start()
+
+    # Give the followers time to join the in-flight call before it completes.
+    time.sleep(0.2)
+    release.set()
+    leader_thread.join(5)
+    for thread in follower_threads:
+        thread.join(5)
+
+    assert calls["count"] == 1
+    assert sorted(results, key=lambda result: result[1]) == [(b"rendered", False)] * 3 + [(b"rendered", True)]
+
+
+def test_follower_reraises_leader_error():
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing_render():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    def call(fn):
+        try:
+            single_flight("failing-key", fn, poll=lambda: None, timeout=5)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader_thread = threading.Thread(target=call, args=(failing_render,))
+    leader_thread.start()
+    started.wait(5)
+    follower_thread = threading.Thread(target=call, args=(lambda: pytest.fail("follower rendered"),))
+    follower_thread.start()
+
+    time.sleep(0.2)
+    release.set()
+    leader_thread.join(5)
+    follower_thread.join(5)
+
+    assert errors == ["boom", "boom"]
+
+
+def test_waits_for_result_published_by_another_process():
+    cache.set(f"{LOCK_KEY_PREFIX}remote-key", "other-worker", timeout=30)
+    polls = {"count": 0}
+
+    def poll():
+        polls["count"] += 1
+        return b"from-other-worker" if polls["count"] >= 2 else None
+
+    value, ran_fn = single_flight("remote-key", lambda: pytest.fail("rendered locally"), poll=poll, timeout=5)
+
+    assert value == b"from-other-worker"
+    assert ran_fn is False
+
+
+def test_renders_locally_when_remote_holder_times_out():
+    cache.set(f"{LOCK_KEY_PREFIX}stuck-key", "other-worker", timeout=30)
+
+    value, ran_fn = single_flight("stuck-key", lambda: b"local", poll=lambda: None, timeout=0.1)
+
+    assert value == b"local"
+    assert ran_fn is True
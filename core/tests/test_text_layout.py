@@ -0,0 +1,62 @@
+from PIL import Image, ImageDraw
+
+from core.image_utils import draw_wrapped_text, load_font
+from core.text_layout import _measure_word, layout_text, wrap_words
+
+
+def _naive_wrap(text, font, max_width):
+    lines = []
+    current_line = []
+
+    for word in text.split():
+        if font.getbbox(" ".join(current_line + [word]))[2] <= max_width:
+            current_line.append(word)
+        elif current_line:
+            lines.append(" ".join(current_line))
+            current_line = [word]
+        else:
+            lines.append(word)
+
+    if current_line:
+        lines.append(" ".join(current_line))
+
+    return tuple(lines)
+
+
+def test_wrap_matches_measuring_the_whole_line():
+    font = load_font("helvetica", 40)
+    text = "Senior Django Engineer building reliable production systems for real users around the world"
+
+    for max_width in (200, 480, 700):
+        assert wrap_words(text, font, max_width) == _naive_wrap(text, font, max_width)
+
+
+def test_overlong_word_gets_its_own_line_without_empty_lines():
+    font = load_font("helvetica", 40)
+
+    assert wrap_words("Supercalifragilisticexpialidocious engineer", font, 100) == (
+        "Supercalifragilisticexpialidocious",
+        "engineer",
+    )
+
+
+def test_draw_wrapped_text_does_not_emit_blank_line_for_overlong_first_word():
+    font = load_font("helvetica", 40)
+    layout = layout_text("Supercalifragilisticexpialidocious", font, 100)
+    draw = ImageDraw.Draw(Image.new("RGB", (800, 450)))
+
+    end_y = draw_wrapped_text(draw, "Supercalifragilisticexpialidocious", font, 100, 0, 10, (255, 255, 255), 800)
+
+    assert end_y == layout.lines[0].height + 10
+
+
+def test_layouts_and_word_measurements_are_memoized():
+    font = load_font("helvetica", 38)
+    layout_text.cache_clear()
+    _measure_word.cache_clear()
+
+    first = layout_text("Hiring hiring hiring", font, 480)
+    second = layout_text("Hiring hiring hiring", font, 480)
+
+    assert first is second
+    assert _measure_word.cache_info().misses == 2
@@ -1,13 +1,17 @@
 import io
+from datetime import timedelta
 
 import pytest
-from django.contrib.auth.models import User
 from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import override_settings
+from django.utils import timezone
 from PIL import Image
 
 from core.admin import ProfileUsageModelAdmin
 from core.models import ProfileUsage
+from core.usage import flush_usage_counters, track_profile_usage
 
 
 @pytest.fixture
@@ -20,13 +24,28 @@ def disable_async_and_image_router(monkeypatch):
         buffer.seek(0)
         return buffer
 
-    monkeypatch.setattr(core_views, "async_task", lambda *args, **kwargs: None)
-    monkeypatch.setattr(core_views, "generate_image_router", lambda params: tiny_png())
+    monkeypatch.setattr(core_views, "stage_generated_image", lambda *args, **kwargs: None)
+    monkeypatch.setattr(core_views, "generate_image_router", lambda params, principal=None: tiny_png())
+
+
+@pytest.fixture
+def shared_usage_cache(monkeypatch):
+    from core import usage
+
+    # Tests run in one process, so the local cache stands in for a shared one.
+    monkeypatch.setattr(usage, "cache_is_shared", lambda alias: True)
+
+
+@pytest.fixture(params=["cache", "database"])
+def usage_backend(request):
+    if request.param == "cache":
+        request.getfixturevalue("shared_usage_cache")
+    return request.param
 
 
 @pytest.mark.django_db
 @override_settings(OSIG_DAILY_USAGE_LIMIT=5, OSIG_MONTHLY_USAGE_LIMIT=50, OSIG_USAGE_WARNING_PERCENT=0.8)
-def test_warns_at_80_percent_daily_limit(client, disable_async_and_image_router):
+def test_warns_at_80_percent_daily_limit(client, disable_async_and_image_router, usage_backend):
     user = User.objects.create_user(username="quota-user", email="quota@example.com", password="pass123")
     key = user.profile.key
 
@@ -42,7 +61,7 @@ def test_warns_at_80_percent_daily_limit(client, disable_async_and_image_router)
 
 @pytest.mark.django_db
 @override_settings(OSIG_DAILY_USAGE_LIMIT=3, OSIG_MONTHLY_USAGE_LIMIT=50, OSIG_USAGE_WARNING_PERCENT=0.8)
-def test_blocks_when_daily_limit_reaches_100_percent(client, disable_async_and_image_router):
+def test_blocks_when_daily_limit_reaches_100_percent(client, disable_async_and_image_router, usage_backend):
     user = User.objects.create_user(username="blocked-user", email="blocked@example.com", password="pass123")
     key = user.profile.key
 
@@ -58,7 +77,7 @@ def test_blocks_when_daily_limit_reaches_100_percent(client, disable_async_and_i
 
 @pytest.mark.django_db
 @override_settings(OSIG_DAILY_USAGE_LIMIT=100, OSIG_MONTHLY_USAGE_LIMIT=2, OSIG_USAGE_WARNING_PERCENT=0.8)
-def test_blocks_when_monthly_limit_reaches_100_percent(client, disable_async_and_image_router):
+def test_blocks_when_monthly_limit_reaches_100_percent(client, disable_async_and_image_router, usage_backend):
     user = User.objects.create_user(username="monthly-user", email="monthly@example.com", password="pass123")
     key = user.profile.key
 
@@ -84,3 +103,133 @@ def test_admin_visibility_is_sorted_for_top_keys():
     admin = ProfileUsageModelAdmin(ProfileUsage, AdminSite())
     assert admin.ordering == ("-monthly_count",)
     assert "profile_key" in admin.list_display
+
+
+@pytest.mark.django_db
+@override_settings(OSIG_DAILY_USAGE_LIMIT=100, OSIG_MONTHLY_USAGE_LIMIT=1000)
+def test_counting_needs_no_database_after_the_first_request(shared_usage_cache, django_assert_num_queries):
+    profile = User.objects.create_user(username="hot-key", password="pass123").profile
+
+    track_profile_usage(profile.id)
+    with django_assert_num_queries(0):
+        states = [track_profile_usage(profile.id) for _ in range(5)]
+
+    assert [state.daily_count for state in states] == [2, 3, 4, 5, 6]
+    assert not ProfileUsage.objects.filter(profile=profile).exists()
+
+
+@pytest.mark.django_db
+@override_settings(OSIG_DAILY_USAGE_LIMIT=100, OSIG_MONTHLY_USAGE_LIMIT=1000, OSIG_USAGE_FLUSH_SECONDS=60)
+def test_flush_writes_counters_back_in_bulk(shared_usage_cache, monkeypatch):
+    from core import usage
+
+    first = User.objects.create_user(username="flush-a", password="pass123").profile
+    second = User.objects.create_user(username="flush-b", password="pass123").profile
+    now = 1_000_000 * 60
+    monkeypatch.setattr(usage.time, "time", lambda: now)
+
+    for _ in range(3):
+        track_profile_usage(first.id)
+    track_profile_usage(second.id)
+
+    now += 60
+    assert flush_usage_counters() == "Flushed usage for 2 profiles"
+
+    rows = {row.profile_id: row for row in ProfileUsage.objects.all()}
+    assert (rows[first.id].daily_count, rows[first.id].monthly_count) == (3, 3)
+    assert rows[first.id].daily_date == timezone.now().date()
+    assert rows[second.id].daily_count == 1
+
+
+@pytest.mark.django_db
+def test_flush_keeps_the_row_when_a_counter_was_evicted(shared_usage_cache, monkeypatch):
+    from core import usage
+
+    profile = User.objects.create_user(username="flush-evicted", password="pass123").profile
+    today = timezone.now().date()
+    ProfileUsage.objects.create(
+        profile=profile, daily_count=5, monthly_count=20, daily_date=today, monthly_date=today.replace(day=1)
+    )
+    now = 1_000_000 * 60
+    monkeypatch.setattr(usage.time, "time", lambda: now)
+
+    track_profile_usage(profile.id)
+    cache.delete(usage._counter_key(profile.id, "daily", today))
+
+    now += 60
+    assert flush_usage_counters() == "Flushed usage for 0 profiles"
+
+    row = ProfileUsage.objects.get(profile=profile)
+    assert (row.daily_count, row.monthly_count) == (5, 20)
+
+
+@pytest.mark.django_db
+def test_flush_drops_the_interval_keys_it_consumed(shared_usage_cache, monkeypatch, settings):
+    from core import usage
+
+    settings.OSIG_USAGE_FLUSH_SECONDS = 60
+    profile = User.objects.create_user(username="flush-keys", password="pass123").profile
+    now = 1_000_000 * 60
+    monkeypatch.setattr(usage.time, "time", lambda: now)
+
+    track_profile_usage(profile.id)
+    interval_key = usage._interval_key(1_000_000)
+    assert usage._dirty_marker_ttl_seconds() == (usage.MAX_FLUSH_CATCH_UP_INTERVALS + 1) * 60
+
+    now += 60
+    flush_usage_counters()
+
+    assert cache.get_many([interval_key, f"{interval_key}:slot:1", f"{interval_key}:{profile.id}"]) == {}
+
+
+@pytest.mark.django_db
+@override_settings(OSIG_DAILY_USAGE_LIMIT=100, OSIG_MONTHLY_USAGE_LIMIT=1000)
+def test_counters_resume_from_flushed_row_and_roll_over_daily(usage_backend):
+    profile = User.objects.create_user(username="resume", password="pass123").profile
+    today = timezone.now().date()
+    ProfileUsage.objects.create(
+        profile=profile,
+        daily_count=7,
+        monthly_count=40,
+        daily_date=today - timedelta(days=1),
+        monthly_date=today.replace(day=1),
+    )
+    cache.clear()
+
+    state = track_profile_usage(profile.id)
+
+    assert (state.daily_count, state.monthly_count) == (1, 41)
+
+
+@pytest.mark.django_db
+@override_settings(OSIG_DAILY_USAGE_LIMIT=2, OSIG_MONTHLY_USAGE_LIMIT=1000)
+def test_blocked_request_survives_an_evicted_counter(shared_usage_cache, monkeypatch):
+    from core import usage
+
+    profile = User.objects.create_user(username="evicted", password="pass123").profile
+    track_profile_usage(profile.id)
+    shared = usage._usage_cache()
+    decr = shared.decr
+
+    def evicting_decr(key, delta=1, version=None):
+        shared.delete(key)
+        return decr(key, delta, version)
+
+    monkeypatch.setattr(shared, "decr", evicting_decr)
+    state = track_profile_usage(profile.id)
+
+    assert state.blocked_reasons == ("daily",)
+    assert state.daily_count == 1
+
+
+@pytest.mark.django_db
+@override_settings(OSIG_DAILY_USAGE_LIMIT=100, OSIG_MONTHLY_USAGE_LIMIT=1000, OSIG_USAGE_WARNING_PERCENT=0.02)
+def test_counts_go_straight_to_the_row_without_a_shared_cache():
+    profile = User.objects.create_user(username="no-redis", password="pass123").profile
+
+    states = [track_profile_usage(profile.id) for _ in range(3)]
+
+    assert [state.daily_count for state in states] == [1, 2, 3]
+    assert [state.warnings for state in states] == [(), ("daily",), ()]
+    usage = ProfileUsage.objects.get(profile=profile)
+    assert (usage.daily_count, usage.monthly_count, usage.daily_warning_sent) == (3, 3, True)
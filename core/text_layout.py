@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import functools
+from dataclasses import dataclass
+
+from core.render_timing import render_stage
+
+
+@dataclass(frozen=True)
+class LayoutLine:
+    text: str
+    width: int
+    height: int
+
+
+@dataclass(frozen=True)
+class TextLayout:
+    lines: tuple[LayoutLine, ...]
+
+
+@functools.lru_cache(maxsize=8192)
+def _measure_word(word, font):
+    """Advance width (where the next glyph starts) and ink right edge of a single word."""
+    return font.getlength(word), font.getbbox(word)[2]
+
+
+@functools.lru_cache(maxsize=256)
+def _space_advance(font):
+    return font.getlength(" ")
+
+
+def wrap_words(text, font, max_width) -> tuple[str, ...]:
+    """Greedy word wrap in one pass over the words.
+
+    A candidate line's right edge is the advance of the words already on it, plus a space,
+    plus the ink width of the new word, so nothing is re-measured as the line grows.
+    A word wider than `max_width` gets a line of its own.
+    """
+    space = _space_advance(font)
+    lines: list[str] = []
+    current_words: list[str] = []
+    current_advance = 0.0
+
+    for word in text.split():
+        advance, right = _measure_word(word, font)
+
+        if not current_words:
+            current_words = [word]
+            current_advance = advance
+            continue
+
+        if current_advance + space + right <= max_width:
+            current_words.append(word)
+            current_advance += space + advance
+        else:
+            lines.append(" ".join(current_words))
+            current_words = [word]
+            current_advance = advance
+
+    if current_words:
+        lines.append(" ".join(current_words))
+
+    return tuple(lines)
+
+
+@functools.lru_cache(maxsize=1024)
+@render_stage("layout")
+def layout_text(text, font, max_width) -> TextLayout:
+    """Wrap `text` to `max_width` and measure each line, memoized per (text, font face and size, width)."""
+    lines = []
+    for line in wrap_words(text, font, max_width):
+        bbox = font.getbbox(line)
+        lines.append(LayoutLine(text=line, width=bbox[2], height=bbox[3] - bbox[1]))
+
+    return TextLayout(lines=tuple(lines))
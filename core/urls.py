@@ -27,4 +27,5 @@ urlpatterns = [
     # app
     path("blank-square.png", views.blank_square_image, name="blank_square_image"),
     path("g", views.generate_image, name="generate_image"),
+    path("g/async", views.generate_image_async, name="generate_image_async"),
 ]
@@ -1,11 +1,24 @@
+import time
 from collections.abc import Iterable
 from dataclasses import dataclass
+from datetime import date
 
 from django.conf import settings
-from django.db import transaction
+from django.core.cache import caches
+from django.db.models import Case, F, Q, Value, When
 from django.utils import timezone
 
-from core.models import ProfileUsage
+from core.checks import cache_is_shared
+from core.models import Profile, ProfileUsage
+from osig.utils import get_osig_logger
+
+logger = get_osig_logger(__name__)
+
+USAGE_KEY_PREFIX = "osig:usage:"
+DAILY_COUNTER_TTL_SECONDS = 2 * 24 * 60 * 60
+MONTHLY_COUNTER_TTL_SECONDS = 32 * 24 * 60 * 60
+# How many missed flush intervals a single flush run catches up on.
+MAX_FLUSH_CATCH_UP_INTERVALS = 60
 
 
 def _is_enabled(limit: int | None) -> bool:
@@ -27,7 +40,7 @@ def _should_warn(count: int, limit: int | None) -> bool:
     return count >= _warn_threshold(limit)
 
 
-def _limits_for_profile():
+def usage_limits() -> dict[str, int | None]:
     return {
         "daily": settings.OSIG_DAILY_USAGE_LIMIT,
         "monthly": settings.OSIG_MONTHLY_USAGE_LIMIT,
@@ -49,74 +62,288 @@ def _as_tuple(values: Iterable[str]) -> tuple[str, ...]:
     return tuple(values)
 
 
-def track_profile_usage(profile) -> UsageState:
-    now = timezone.now()
-    today = now.date()
-    month_start = _month_start_for(today)
-    limits = _limits_for_profile()
-
-    with transaction.atomic():
-        usage, _ = ProfileUsage.objects.select_for_update().get_or_create(
-            profile=profile,
-            defaults={
-                "daily_date": today,
-                "monthly_date": month_start,
-            },
+def _usage_cache_alias() -> str:
+    return getattr(settings, "OSIG_USAGE_CACHE_ALIAS", "default")
+
+
+def _usage_cache():
+    return caches[_usage_cache_alias()]
+
+
+def _flush_interval_seconds() -> int:
+    return max(1, getattr(settings, "OSIG_USAGE_FLUSH_SECONDS", 60))
+
+
+def _dirty_marker_ttl_seconds() -> int:
+    """Long enough for a flush to catch up on the interval, and no longer."""
+    return (MAX_FLUSH_CATCH_UP_INTERVALS + 1) * _flush_interval_seconds()
+
+
+def _counter_key(profile_id: int, window: str, window_date: date) -> str:
+    return f"{USAGE_KEY_PREFIX}{profile_id}:{window}:{window_date.isoformat()}"
+
+
+def _warned_key(profile_id: int, window: str, window_date: date) -> str:
+    return f"{_counter_key(profile_id, window, window_date)}:warned"
+
+
+def _interval_key(interval_id: int) -> str:
+    return f"{USAGE_KEY_PREFIX}interval:{interval_id}"
+
+
+def _seed_counters(cache, profile_id: int, today: date, month_start: date):
+    """Start this window's counters from the last flushed row, e.g. after a cache restart."""
+    daily_key = _counter_key(profile_id, "daily", today)
+    monthly_key = _counter_key(profile_id, "monthly", month_start)
+
+    usage = ProfileUsage.objects.filter(profile_id=profile_id).first()
+    same_day = usage is not None and usage.daily_date == today
+    same_month = usage is not None and usage.monthly_date == month_start
+
+    daily_seeded = cache.add(daily_key, usage.daily_count if same_day else 0, timeout=DAILY_COUNTER_TTL_SECONDS)
+    if daily_seeded and same_day and usage.daily_warning_sent:
+        cache.add(_warned_key(profile_id, "daily", today), 1, timeout=DAILY_COUNTER_TTL_SECONDS)
+    monthly_seeded = cache.add(
+        monthly_key, usage.monthly_count if same_month else 0, timeout=MONTHLY_COUNTER_TTL_SECONDS
+    )
+    if monthly_seeded and same_month and usage.monthly_warning_sent:
+        cache.add(_warned_key(profile_id, "monthly", month_start), 1, timeout=MONTHLY_COUNTER_TTL_SECONDS)
+
+
+def _increment(cache, key: str, seed) -> int:
+    try:
+        return cache.incr(key)
+    except ValueError:
+        seed()
+        return cache.incr(key)
+
+
+def _decrement(cache, key: str, count: int) -> int:
+    try:
+        return cache.decr(key)
+    except ValueError:
+        # Evicted since this request incremented it, so there is nothing to take back.
+        return count - 1
+
+
+def _mark_dirty(cache, profile_id: int, today: date, month_start: date):
+    """Queue the profile for the next bulk flush, once per flush interval."""
+    interval_id = int(time.time() // _flush_interval_seconds())
+    interval_key = _interval_key(interval_id)
+    ttl = _dirty_marker_ttl_seconds()
+    if not cache.add(f"{interval_key}:{profile_id}", 1, timeout=ttl):
+        return
+
+    cache.add(interval_key, 0, timeout=ttl)
+    slot = cache.incr(interval_key)
+    cache.set(f"{interval_key}:slot:{slot}", (profile_id, today, month_start), timeout=ttl)
+
+
+def _blocked_reasons(daily_count: int, monthly_count: int, limits: dict[str, int | None]) -> list[str]:
+    blocked_reasons: list[str] = []
+
+    if _is_enabled(limits["daily"]) and daily_count >= limits["daily"]:
+        blocked_reasons.append("daily")
+
+    if _is_enabled(limits["monthly"]) and monthly_count >= limits["monthly"]:
+        blocked_reasons.append("monthly")
+
+    return blocked_reasons
+
+
+def _usage_state(
+    daily_count: int,
+    monthly_count: int,
+    limits: dict[str, int | None],
+    blocked_reasons: Iterable[str] = (),
+    warnings: Iterable[str] = (),
+) -> UsageState:
+    blocked_reasons = _as_tuple(blocked_reasons)
+    return UsageState(
+        blocked=bool(blocked_reasons),
+        blocked_reasons=blocked_reasons,
+        warnings=_as_tuple(warnings),
+        daily_count=daily_count,
+        monthly_count=monthly_count,
+        daily_limit=limits["daily"],
+        monthly_limit=limits["monthly"],
+    )
+
+
+def _track_in_cache(profile_id: int, today: date, month_start: date, limits: dict[str, int | None]) -> UsageState:
+    cache = _usage_cache()
+    daily_key = _counter_key(profile_id, "daily", today)
+    monthly_key = _counter_key(profile_id, "monthly", month_start)
+
+    def seed():
+        _seed_counters(cache, profile_id, today, month_start)
+
+    daily_count = _increment(cache, daily_key, seed)
+    monthly_count = _increment(cache, monthly_key, seed)
+
+    blocked_reasons = _blocked_reasons(daily_count, monthly_count, limits)
+    if blocked_reasons:
+        return _usage_state(
+            _decrement(cache, daily_key, daily_count),
+            _decrement(cache, monthly_key, monthly_count),
+            limits,
+            blocked_reasons=blocked_reasons,
         )
 
-        if usage.daily_date != today:
-            usage.daily_date = today
-            usage.daily_count = 0
-            usage.daily_warning_sent = False
+    _mark_dirty(cache, profile_id, today, month_start)
 
-        if usage.monthly_date != month_start:
-            usage.monthly_date = month_start
-            usage.monthly_count = 0
-            usage.monthly_warning_sent = False
+    warnings: list[str] = []
 
-        next_daily_count = usage.daily_count + 1
-        next_monthly_count = usage.monthly_count + 1
+    if _should_warn(daily_count, limits["daily"]) and cache.add(
+        _warned_key(profile_id, "daily", today), 1, timeout=DAILY_COUNTER_TTL_SECONDS
+    ):
+        warnings.append("daily")
 
-        blocked_reasons: list[str] = []
+    if _should_warn(monthly_count, limits["monthly"]) and cache.add(
+        _warned_key(profile_id, "monthly", month_start), 1, timeout=MONTHLY_COUNTER_TTL_SECONDS
+    ):
+        warnings.append("monthly")
 
-        if _is_enabled(limits["daily"]) and next_daily_count >= limits["daily"]:
-            blocked_reasons.append("daily")
+    return _usage_state(daily_count, monthly_count, limits, warnings=warnings)
 
-        if _is_enabled(limits["monthly"]) and next_monthly_count >= limits["monthly"]:
-            blocked_reasons.append("monthly")
 
-        if blocked_reasons:
-            return UsageState(
-                blocked=True,
-                blocked_reasons=_as_tuple(blocked_reasons),
-                warnings=(),
-                daily_count=usage.daily_count,
-                monthly_count=usage.monthly_count,
-                daily_limit=limits["daily"],
-                monthly_limit=limits["monthly"],
-            )
+def _track_in_database(profile_id: int, today: date, month_start: date, limits: dict[str, int | None]) -> UsageState:
+    """Count with single-statement `F()` updates on `ProfileUsage`; no lock outlives its statement."""
+    usage = ProfileUsage.objects.filter(profile_id=profile_id)
+    same_day = Q(daily_date=today)
+    same_month = Q(monthly_date=month_start)
+    increment = {
+        "daily_count": Case(When(same_day, then=F("daily_count") + 1), default=Value(1)),
+        "monthly_count": Case(When(same_month, then=F("monthly_count") + 1), default=Value(1)),
+        "daily_warning_sent": Case(When(same_day, then=F("daily_warning_sent")), default=Value(False)),
+        "monthly_warning_sent": Case(When(same_month, then=F("monthly_warning_sent")), default=Value(False)),
+        "daily_date": today,
+        "monthly_date": month_start,
+        "updated_at": timezone.now(),
+    }
+
+    if not usage.update(**increment):
+        ProfileUsage.objects.get_or_create(
+            profile_id=profile_id, defaults={"daily_date": today, "monthly_date": month_start}
+        )
+        usage.update(**increment)
 
-        usage.daily_count = next_daily_count
-        usage.monthly_count = next_monthly_count
+    daily_count, monthly_count = usage.values_list("daily_count", "monthly_count").get()
 
-        warnings: list[str] = []
+    blocked_reasons = _blocked_reasons(daily_count, monthly_count, limits)
+    if blocked_reasons:
+        usage.update(daily_count=F("daily_count") - 1, monthly_count=F("monthly_count") - 1)
+        return _usage_state(daily_count - 1, monthly_count - 1, limits, blocked_reasons=blocked_reasons)
 
-        if not usage.daily_warning_sent and _should_warn(usage.daily_count, limits["daily"]):
-            usage.daily_warning_sent = True
-            warnings.append("daily")
+    warnings: list[str] = []
 
-        if not usage.monthly_warning_sent and _should_warn(usage.monthly_count, limits["monthly"]):
-            usage.monthly_warning_sent = True
-            warnings.append("monthly")
+    if _should_warn(daily_count, limits["daily"]) and usage.filter(daily_warning_sent=False).update(
+        daily_warning_sent=True
+    ):
+        warnings.append("daily")
 
-        usage.save()
+    if _should_warn(monthly_count, limits["monthly"]) and usage.filter(monthly_warning_sent=False).update(
+        monthly_warning_sent=True
+    ):
+        warnings.append("monthly")
 
-        return UsageState(
-            blocked=False,
-            blocked_reasons=(),
-            warnings=_as_tuple(warnings),
-            daily_count=usage.daily_count,
-            monthly_count=usage.monthly_count,
-            daily_limit=limits["daily"],
-            monthly_limit=limits["monthly"],
+    return _usage_state(daily_count, monthly_count, limits, warnings=warnings)
+
+
+def track_profile_usage(profile_id: int, limits: dict[str, int | None] | None = None) -> UsageState:
+    """Count one request against the profile's daily and monthly limits.
+
+    With a cache shared across processes, counters are atomic cache increments keyed by
+    window date, so a busy key never waits on a row lock and a new day or month simply
+    starts a new key. `ProfileUsage` is brought up to date in bulk by `flush_usage_counters`.
+    A per-process cache would give every worker its own quota, so without a shared one the
+    counts go straight to `ProfileUsage` instead.
+
+    A request that would reach a limit is blocked and not counted.
+    """
+    today = timezone.now().date()
+    month_start = _month_start_for(today)
+    limits = limits if limits is not None else usage_limits()
+
+    if cache_is_shared(_usage_cache_alias()):
+        return _track_in_cache(profile_id, today, month_start, limits)
+    return _track_in_database(profile_id, today, month_start, limits)
+
+
+def flush_usage_counters() -> str:
+    """Write the cached counters of every profile active since the last flush to `ProfileUsage`.
+
+    Runs from the django-q schedule. Closed intervals are flushed with one upsert; a run
+    that was missed is caught up on the next one.
+    """
+    cache = _usage_cache()
+    current_interval = int(time.time() // _flush_interval_seconds())
+    flushed_through = cache.get(f"{USAGE_KEY_PREFIX}flushed-through")
+    first_interval = max(
+        (flushed_through or current_interval - 2) + 1,
+        current_interval - MAX_FLUSH_CATCH_UP_INTERVALS,
+    )
+
+    windows: dict[int, tuple[date, date]] = {}
+    flushed_keys = []
+    for interval_id in range(first_interval, current_interval):
+        interval_key = _interval_key(interval_id)
+        slot_count = cache.get(interval_key) or 0
+        slot_keys = [f"{interval_key}:slot:{slot}" for slot in range(1, slot_count + 1)]
+        flushed_keys += [interval_key, *slot_keys]
+        for profile_id, day, month_start in cache.get_many(slot_keys).values():
+            # Later intervals overwrite earlier ones, so each profile is flushed for its latest window.
+            windows[profile_id] = (day, month_start)
+            flushed_keys.append(f"{interval_key}:{profile_id}")
+
+    existing_profile_ids = set(Profile.objects.filter(id__in=windows).values_list("id", flat=True))
+    counter_keys = []
+    for profile_id, (day, month_start) in windows.items():
+        counter_keys += [
+            _counter_key(profile_id, "daily", day),
+            _counter_key(profile_id, "monthly", month_start),
+            _warned_key(profile_id, "daily", day),
+            _warned_key(profile_id, "monthly", month_start),
+        ]
+    values = cache.get_many(counter_keys)
+
+    rows = []
+    for profile_id, (day, month_start) in windows.items():
+        if profile_id not in existing_profile_ids:
+            continue
+        daily_key = _counter_key(profile_id, "daily", day)
+        monthly_key = _counter_key(profile_id, "monthly", month_start)
+        if daily_key not in values or monthly_key not in values:
+            # An evicted counter says nothing about the real count; the row keeps its last flush
+            # and the next request re-seeds the counter from it.
+            logger.warning("Usage counter evicted before flush", profile_id=profile_id)
+            continue
+        rows.append(
+            ProfileUsage(
+                profile_id=profile_id,
+                daily_date=day,
+                monthly_date=month_start,
+                daily_count=values[daily_key],
+                monthly_count=values[monthly_key],
+                daily_warning_sent=_warned_key(profile_id, "daily", day) in values,
+                monthly_warning_sent=_warned_key(profile_id, "monthly", month_start) in values,
+            )
         )
+    ProfileUsage.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["profile"],
+        update_fields=[
+            "daily_count",
+            "monthly_count",
+            "daily_date",
+            "monthly_date",
+            "daily_warning_sent",
+            "monthly_warning_sent",
+            "updated_at",
+        ],
+    )
+
+    cache.set(f"{USAGE_KEY_PREFIX}flushed-through", current_interval - 1, timeout=None)
+    cache.delete_many(flushed_keys)
+    return f"Flushed usage for {len(rows)} profiles"
@@ -1,32 +1,64 @@
+import hashlib
 import io
-from datetime import timedelta
 from time import perf_counter
 from urllib.parse import urlencode
 
 import stripe
 from allauth.account.models import EmailAddress
 from allauth.account.utils import send_email_confirmation
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.http import HttpResponse, HttpResponseForbidden
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django.views.decorators.http import require_GET
 from django.views.generic import DetailView, ListView, TemplateView, UpdateView
-from django_q.tasks import async_task
 from djstripe import models as djstripe_models, settings as djstripe_settings
 from PIL import Image
 
+from core.async_render import run_fetch, run_render
 from core.forms import ProfileUpdateForm
 from core.image_styles import generate_image_router
-from core.models import BlogPost, Image as ImageModel, Profile
-from core.render_observability import classify_render_error, is_transient_error, record_render_attempt
+from core.image_utils import DEFAULT_LOSSY_QUALITY, OUTPUT_CONTENT_TYPES, supported_output_formats
+from core.models import BlogPost, Profile
+from core.principal import resolve_render_principal
+from core.regeneration import request_regeneration
+from core.remote_assets import prefetch_remote_asset
+from core.render_cache import (
+    CachedRender,
+    CacheHitMode,
+    build_render_key,
+    cache_hit_mode,
+    content_version,
+    get_cached_render,
+    get_render_validators,
+    get_shared_render_content,
+    get_stored_render_location,
+    render_etag,
+    store_cached_render,
+    stored_render_body,
+    stored_render_url,
+    stream_stored_render_async,
+)
+from core.render_observability import (
+    RenderErrorType,
+    RenderFailedError,
+    classify_render_error,
+    is_transient_error,
+    record_render_attempt,
+)
+from core.render_pool import RenderPoolSaturatedError, render_in_pool, render_pool_enabled
+from core.render_timing import render_stage, snapshot_stage_timings, stage_timings_since, with_server_timing
+from core.save_pipeline import stage_generated_image
 from core.signing import ExpiredSignatureError, InvalidSignatureError, verify_signed_params
-from core.tasks import regenerate_and_update_image, save_generated_image
+from core.single_flight import single_flight
 from core.usage import track_profile_usage
 from core.utils import check_if_profile_has_pro_subscription
 from osig.utils import get_osig_logger
@@ -213,19 +245,52 @@ def blank_square_image(request):
     return response
 
 
+AUTO_OUTPUT_FORMAT = "auto"
+# Preference order when negotiating `format=auto`; PNG is the fallback.
+NEGOTIATED_OUTPUT_FORMATS = ("avif", "webp")
+
+
 def _normalize_output_format(raw_value: str | None) -> str:
     value = (raw_value or "png").lower().strip()
-    return value if value in {"png", "jpeg"} else "png"
+    if value == AUTO_OUTPUT_FORMAT:
+        return value
+    return value if value in supported_output_formats() else "png"
+
+
+def _accepted_media_types(accept_header: str) -> dict[str, float]:
+    accepted = {}
+    for media_range in accept_header.split(","):
+        media_type, *parameters = [part.strip() for part in media_range.split(";")]
+        weight = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if media_type:
+            accepted[media_type.lower()] = weight
+    return accepted
+
+
+def _negotiate_output_format(accept_header: str) -> str:
+    """Pick a modern format only when the client names it explicitly; `image/*` isn't enough."""
+    accepted = _accepted_media_types(accept_header)
+    for output_format in NEGOTIATED_OUTPUT_FORMATS:
+        if output_format in supported_output_formats() and accepted.get(OUTPUT_CONTENT_TYPES[output_format], 0) > 0:
+            return output_format
+    return "png"
 
 
 def _normalize_quality(raw_value: str | None, output_format: str) -> int | None:
     if raw_value in (None, ""):
-        return 85 if output_format == "jpeg" else None
+        return DEFAULT_LOSSY_QUALITY.get(output_format)
 
     try:
         parsed = int(raw_value)
     except ValueError:
-        return 85 if output_format == "jpeg" else None
+        return DEFAULT_LOSSY_QUALITY.get(output_format)
 
     return max(1, min(parsed, 100))
 
@@ -243,7 +308,7 @@ def _normalize_max_kb(raw_value: str | None) -> int | None:
 
 
 def _content_type_for_output_format(output_format: str) -> str:
-    return "image/jpeg" if output_format == "jpeg" else "image/png"
+    return OUTPUT_CONTENT_TYPES.get(output_format, "image/png")
 
 
 def _attach_usage_headers(response, usage_state) -> HttpResponse:
@@ -261,8 +326,14 @@ def _attach_usage_headers(response, usage_state) -> HttpResponse:
     return response
 
 
-def _build_image_response(image_content, output_format: str, signed_expires_at=None, usage_state=None) -> HttpResponse:
-    response = HttpResponse(image_content, content_type=_content_type_for_output_format(output_format))
+def _apply_image_cache_headers(response, signed_expires_at=None, vary_accept=False, etag=None, last_modified=None):
+    if vary_accept:
+        patch_vary_headers(response, ("Accept",))
+
+    if etag is not None:
+        response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
 
     if signed_expires_at is not None:
         max_age = max(0, int((signed_expires_at - timezone.now()).total_seconds()))
@@ -270,107 +341,117 @@ def _build_image_response(image_content, output_format: str, signed_expires_at=N
     else:
         response["Cache-Control"] = "public, max-age=31536000, immutable"
 
-    return _attach_usage_headers(response, usage_state)
 
+def _build_image_response(
+    image_content,
+    output_format: str,
+    signed_expires_at=None,
+    usage_state=None,
+    vary_accept=False,
+    content_length=None,
+    render_key=None,
+    last_modified=None,
+    version=None,
+) -> HttpResponse:
+    """`image_content` is rendered bytes, a local file, or a sync or async iterator of chunks from storage.
+
+    `version` is the render's content version for the ETag; for bytes it is hashed here when not given.
+    """
+    content_type = _content_type_for_output_format(output_format)
+    if version is None and isinstance(image_content, bytes):
+        version = content_version(image_content)
+    etag = render_etag(render_key, version) if render_key is not None and version is not None else None
+
+    if isinstance(image_content, bytes):
+        # The same bytes object that went into the render cache and the save task; no copy.
+        response = HttpResponse(image_content, content_type=content_type)
+        response["Content-Length"] = str(len(image_content))
+    elif hasattr(image_content, "read"):
+        response = FileResponse(image_content, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(image_content, content_type=content_type)
+        if content_length is not None:
+            response["Content-Length"] = str(content_length)
 
-@require_GET
-def generate_image(request):
-    try:
-        signed_expires_at = verify_signed_params(request.GET)
-    except (InvalidSignatureError, ExpiredSignatureError):
-        return HttpResponseForbidden("Invalid or expired signature")
+    _apply_image_cache_headers(response, signed_expires_at, vary_accept, etag, last_modified)
+    return _attach_usage_headers(response, usage_state)
 
-    output_format = _normalize_output_format(request.GET.get("format"))
-    quality = _normalize_quality(request.GET.get("quality"), output_format)
-    max_kb = _normalize_max_kb(request.GET.get("max_kb"))
 
-    image_url = request.GET.get("image_url") or request.GET.get("image_or_logo")
+def _not_modified_response(
+    request, render_key, signed_expires_at, usage_state, vary_accept=False
+) -> HttpResponse | None:
+    """304 when the client's validators still match, decided without storage or a render.
 
-    params = {
-        "key": request.GET.get("key", ""),
-        "style": request.GET.get("style", "base"),
-        "site": request.GET.get("site", "x"),
-        "font": request.GET.get("font"),
-        "title": request.GET.get("title"),
-        "subtitle": request.GET.get("subtitle"),
-        "eyebrow": request.GET.get("eyebrow"),
-        "image_url": image_url,
-    }
+    The ETag is the render key plus the content version, which a memory hit already has;
+    `updated_at` is only needed for clients that revalidate with If-Modified-Since alone.
+    """
+    if "If-None-Match" not in request.headers and "If-Modified-Since" not in request.headers:
+        return None
 
-    if output_format != "png":
-        params["format"] = output_format
-    if quality is not None:
-        params["quality"] = quality
-    if max_kb is not None:
-        params["max_kb"] = max_kb
+    version, last_modified = get_render_validators(
+        render_key, with_last_modified="If-None-Match" not in request.headers
+    )
+    if version is None and last_modified is None:
+        return None
 
-    cache_version = request.GET.get("v")
-    if cache_version:
-        params["v"] = cache_version
+    etag = render_etag(render_key, version) if version is not None else None
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified is not None else None,
+    )
+    if response is None or response.status_code != 304:
+        return None
 
-    usage_state = None
-    profile = None
-    if params["key"]:
-        try:
-            profile = Profile.objects.get(key=params["key"])
-            params["profile_id"] = profile.id
-            usage_state = track_profile_usage(profile)
-
-            if usage_state.blocked:
-                return HttpResponse(
-                    f"Usage quota exceeded: {'/'.join(usage_state.blocked_reasons)}",
-                    status=429,
-                )
-        except Profile.DoesNotExist:
-            logger.error("Profile not found for key", key=params["key"])
-
-    existing_image = ImageModel.objects.filter(image_data=params).first()
-    if existing_image and existing_image.generated_image:
-        two_days_ago = timezone.now() - timedelta(days=2)
-        should_update = (
-            settings.ENVIRONMENT == "prod" and existing_image.updated_at < two_days_ago
-        ) or settings.ENVIRONMENT == "dev"
-
-        if should_update:
-            async_task(regenerate_and_update_image, existing_image.id, params)
+    _apply_image_cache_headers(response, signed_expires_at, vary_accept, etag, last_modified)
+    return _attach_usage_headers(response, usage_state)
 
-        try:
-            return _build_image_response(existing_image.generated_image, output_format, signed_expires_at, usage_state=usage_state)
-        except FileNotFoundError:
-            logger.error(f"Generated image file not found for image_id: {existing_image.id}")
 
+def _render_and_store(params, render_key, principal) -> bytes:
     max_attempts = max(1, int(getattr(settings, "OSIG_RENDER_MAX_ATTEMPTS", 2)))
 
     for attempt_number in range(1, max_attempts + 1):
         attempt_started_at = perf_counter()
+        stages_before = snapshot_stage_timings()
 
         try:
-            image = generate_image_router(params)
+            if render_pool_enabled():
+                image = render_in_pool(params, principal)
+            else:
+                image = generate_image_router(params, principal)
             duration_ms = int((perf_counter() - attempt_started_at) * 1000)
 
             record_render_attempt(
-                profile=profile,
+                profile_id=principal.profile_id if principal is not None else None,
                 key=params.get("key", ""),
                 style=params.get("style", "base"),
                 success=True,
                 duration_ms=duration_ms,
                 attempt_number=attempt_number,
+                stage_timings=stage_timings_since(stages_before),
             )
 
-            async_task(save_generated_image, image, params)
-            return _build_image_response(image, output_format, signed_expires_at, usage_state=usage_state)
+            content = image.getvalue()
+            store_cached_render(
+                render_key, CachedRender(content=content, content_sha256=hashlib.sha256(content).hexdigest())
+            )
+            stage_generated_image(content, params)
+            return content
+        except RenderPoolSaturatedError:
+            raise
         except Exception as exc:
             duration_ms = int((perf_counter() - attempt_started_at) * 1000)
             error_type = classify_render_error(exc)
 
             record_render_attempt(
-                profile=profile,
+                profile_id=principal.profile_id if principal is not None else None,
                 key=params.get("key", ""),
                 style=params.get("style", "base"),
                 success=False,
                 duration_ms=duration_ms,
                 error_type=error_type,
                 attempt_number=attempt_number,
+                stage_timings=stage_timings_since(stages_before),
             )
 
             should_retry = is_transient_error(error_type) and attempt_number < max_attempts
@@ -386,6 +467,291 @@ def generate_image(request):
             if should_retry:
                 continue
 
-            return HttpResponse(f"Render failed: {error_type}", status=502)
+            raise RenderFailedError(error_type) from exc
+
+    raise RenderFailedError(RenderErrorType.UNKNOWN_ERROR)
+
+
+def _build_render_params(query, accept_header: str = "") -> tuple[dict, str, bool]:
+    """Render params, the output format to encode, and whether it was negotiated from Accept.
+
+    A negotiated format is stored in the params like an explicit one, so each format gets
+    its own render key.
+    """
+    output_format = _normalize_output_format(query.get("format"))
+    negotiated = output_format == AUTO_OUTPUT_FORMAT
+    if negotiated:
+        output_format = _negotiate_output_format(accept_header)
+
+    quality = _normalize_quality(query.get("quality"), output_format)
+    max_kb = _normalize_max_kb(query.get("max_kb"))
+
+    image_url = query.get("image_url") or query.get("image_or_logo")
+
+    params = {
+        "key": query.get("key", ""),
+        "style": query.get("style", "base"),
+        "site": query.get("site", "x"),
+        "font": query.get("font"),
+        "title": query.get("title"),
+        "subtitle": query.get("subtitle"),
+        "eyebrow": query.get("eyebrow"),
+        "image_url": image_url,
+    }
+
+    if output_format != "png":
+        params["format"] = output_format
+    if quality is not None:
+        params["quality"] = quality
+    if max_kb is not None:
+        params["max_kb"] = max_kb
+
+    cache_version = query.get("v")
+    if cache_version:
+        params["v"] = cache_version
 
-    return HttpResponse("Render failed: unknown_error", status=502)
+    return params, output_format, negotiated
+
+
+def _quota_exceeded_response(usage_state) -> HttpResponse:
+    return HttpResponse(
+        f"Usage quota exceeded: {'/'.join(usage_state.blocked_reasons)}",
+        status=429,
+    )
+
+
+def _render_pool_saturated_response(exc: RenderPoolSaturatedError) -> HttpResponse:
+    response = HttpResponse("Render capacity exceeded, try again shortly", status=503)
+    response["Retry-After"] = str(exc.retry_after_seconds)
+    return response
+
+
+def _stored_render_redirect(
+    params, signed_expires_at, usage_state, vary_accept=False, render_key=None
+) -> HttpResponse | None:
+    """302 to the stored object when OSIG_CACHE_HIT_MODE asks for it and the object exists."""
+    mode = cache_hit_mode()
+    if mode == CacheHitMode.PROXY:
+        return None
+
+    location = get_stored_render_location(render_key)
+    if location is None:
+        return None
+
+    request_regeneration(location.image_id, location.updated_at, params.get("style", "base"))
+
+    signed = mode == CacheHitMode.SIGNED_REDIRECT
+    response = HttpResponseRedirect(stored_render_url(location.storage_name, signed=signed))
+
+    # Regeneration stores the image under a new name, so the redirect itself must not be immutable.
+    max_age = getattr(settings, "OSIG_CACHE_HIT_REDIRECT_MAX_AGE_SECONDS", 60 * 60)
+    if signed:
+        max_age = min(max_age, getattr(settings, "OSIG_SIGNED_STORAGE_URL_EXPIRE_SECONDS", 60 * 60))
+    if signed_expires_at is not None:
+        max_age = min(max_age, max(0, int((signed_expires_at - timezone.now()).total_seconds())))
+    response["Cache-Control"] = f"public, max-age={max_age}"
+
+    if vary_accept:
+        patch_vary_headers(response, ("Accept",))
+
+    return _attach_usage_headers(response, usage_state)
+
+
+def _cached_render_response(
+    cached_render,
+    params,
+    output_format,
+    signed_expires_at,
+    usage_state,
+    vary_accept=False,
+    render_key=None,
+    image_content=None,
+) -> HttpResponse:
+    """`image_content` overrides the stored body, e.g. with an async stream for ASGI."""
+    request_regeneration(cached_render.image_id, cached_render.updated_at, params.get("style", "base"))
+
+    if image_content is None and cached_render.is_streamed:
+        image_content = stored_render_body(cached_render.source)
+    elif image_content is None:
+        image_content = cached_render.content
+
+    return _build_image_response(
+        image_content,
+        output_format,
+        signed_expires_at,
+        usage_state=usage_state,
+        vary_accept=vary_accept,
+        content_length=cached_render.content_length,
+        render_key=render_key,
+        last_modified=cached_render.updated_at,
+        version=cached_render.content_version,
+    )
+
+
+def _render_coalesced(params, render_key, principal) -> bytes:
+    content, _ = single_flight(
+        render_key,
+        lambda: _render_and_store(params, render_key, principal),
+        poll=lambda: get_shared_render_content(render_key),
+    )
+    return content
+
+
+@require_GET
+@with_server_timing
+def generate_image(request):
+    try:
+        signed_expires_at = verify_signed_params(request.GET)
+    except (InvalidSignatureError, ExpiredSignatureError):
+        return HttpResponseForbidden("Invalid or expired signature")
+
+    params, output_format, negotiated = _build_render_params(request.GET, request.headers.get("Accept", ""))
+
+    usage_state = None
+    principal = None
+    if params["key"]:
+        with render_stage("principal"):
+            principal = resolve_render_principal(params["key"])
+    if principal is not None:
+        params["profile_id"] = principal.profile_id
+        with render_stage("usage"):
+            usage_state = track_profile_usage(principal.profile_id, principal.usage_limits)
+
+        if usage_state.blocked:
+            return _quota_exceeded_response(usage_state)
+    elif params["key"]:
+        logger.error("Profile not found for key", key=params["key"])
+
+    render_key = build_render_key(params)
+
+    with render_stage("cache"):
+        not_modified_response = _not_modified_response(
+            request, render_key, signed_expires_at, usage_state, vary_accept=negotiated
+        )
+    if not_modified_response is not None:
+        return not_modified_response
+
+    with render_stage("cache"):
+        redirect_response = _stored_render_redirect(
+            params, signed_expires_at, usage_state, vary_accept=negotiated, render_key=render_key
+        )
+    if redirect_response is not None:
+        return redirect_response
+
+    with render_stage("cache"):
+        cached_render, _ = get_cached_render(render_key)
+    if cached_render is not None:
+        return _cached_render_response(
+            cached_render,
+            params,
+            output_format,
+            signed_expires_at,
+            usage_state,
+            vary_accept=negotiated,
+            render_key=render_key,
+        )
+
+    try:
+        content = _render_coalesced(params, render_key, principal)
+    except RenderFailedError as exc:
+        return HttpResponse(f"Render failed: {exc.error_type}", status=502)
+    except RenderPoolSaturatedError as exc:
+        return _render_pool_saturated_response(exc)
+
+    return _build_image_response(
+        content,
+        output_format,
+        signed_expires_at,
+        usage_state=usage_state,
+        vary_accept=negotiated,
+        render_key=render_key,
+    )
+
+
+@require_GET
+@with_server_timing
+async def generate_image_async(request):
+    """Same contract as `generate_image`, for ASGI deployments.
+
+    The request coroutine only awaits: DB and cache calls run through `sync_to_async`, storage
+    lookups and the remote image fetch run on the I/O pool, stored bodies are streamed chunk by
+    chunk from worker threads, and the render runs on the bounded render pool, so a slow
+    upstream host ties up a fetch thread rather than a server worker.
+    """
+    try:
+        signed_expires_at = verify_signed_params(request.GET)
+    except (InvalidSignatureError, ExpiredSignatureError):
+        return HttpResponseForbidden("Invalid or expired signature")
+
+    params, output_format, negotiated = _build_render_params(request.GET, request.headers.get("Accept", ""))
+
+    usage_state = None
+    principal = None
+    if params["key"]:
+        with render_stage("principal"):
+            principal = await sync_to_async(resolve_render_principal)(params["key"])
+    if principal is not None:
+        params["profile_id"] = principal.profile_id
+        with render_stage("usage"):
+            usage_state = await sync_to_async(track_profile_usage)(principal.profile_id, principal.usage_limits)
+
+        if usage_state.blocked:
+            return _quota_exceeded_response(usage_state)
+    elif params["key"]:
+        logger.error("Profile not found for key", key=params["key"])
+
+    render_key = build_render_key(params)
+
+    with render_stage("cache"):
+        not_modified_response = await sync_to_async(_not_modified_response)(
+            request, render_key, signed_expires_at, usage_state, vary_accept=negotiated
+        )
+    if not_modified_response is not None:
+        return not_modified_response
+
+    # Lookups that may reach object storage run on the I/O pool, like the remote-asset prefetch.
+    with render_stage("cache"):
+        redirect_response = await run_fetch(
+            _stored_render_redirect,
+            params,
+            signed_expires_at,
+            usage_state,
+            vary_accept=negotiated,
+            render_key=render_key,
+        )
+    if redirect_response is not None:
+        return redirect_response
+
+    with render_stage("cache"):
+        cached_render, _ = await run_fetch(get_cached_render, render_key)
+    if cached_render is not None:
+        return await run_fetch(
+            _cached_render_response,
+            cached_render,
+            params,
+            output_format,
+            signed_expires_at,
+            usage_state,
+            vary_accept=negotiated,
+            render_key=render_key,
+            image_content=(stream_stored_render_async(cached_render.source) if cached_render.is_streamed else None),
+        )
+
+    if params["image_url"]:
+        await run_fetch(prefetch_remote_asset, params["image_url"])
+
+    try:
+        content = await run_render(_render_coalesced, params, render_key, principal)
+    except RenderFailedError as exc:
+        return HttpResponse(f"Render failed: {exc.error_type}", status=502)
+    except RenderPoolSaturatedError as exc:
+        return _render_pool_saturated_response(exc)
+
+    return _build_image_response(
+        content,
+        output_format,
+        signed_expires_at,
+        usage_state=usage_state,
+        vary_accept=negotiated,
+        render_key=render_key,
+    )
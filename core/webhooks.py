@@ -2,6 +2,7 @@ from djstripe import webhooks
 from djstripe.models import Customer, Event, Subscription
 
 from core.models import Profile, ProfileStates
+from core.principal import invalidate_render_principal
 from osig.utils import get_osig_logger
 
 logger = get_osig_logger(__name__)
@@ -18,6 +19,7 @@ def handle_created_subscription(**kwargs):
     profile = Profile.objects.get(customer=customer)
     profile.subscription = subscription
     profile.save(update_fields=["subscription"])
+    invalidate_render_principal(profile.key)
 
     profile.track_state_change(
         to_state=ProfileStates.SUBSCRIBED,
@@ -82,6 +84,7 @@ def handle_updated_subscription(**kwargs):
 
         profile.subscription = subscription
         profile.save(update_fields=["subscription"])
+        invalidate_render_principal(profile.key)
 
     except (Customer.DoesNotExist, Subscription.DoesNotExist, Profile.DoesNotExist) as e:
         logger.error(
@@ -125,6 +128,7 @@ def handle_deleted_subscription(**kwargs):
 
         profile.subscription = None
         profile.save(update_fields=["subscription"])
+        invalidate_render_principal(profile.key)
 
         logger.info(
             "Subscription deleted for profile.",
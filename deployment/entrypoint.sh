@@ -32,7 +32,8 @@ if [ "$server" = true ]; then
     python manage.py collectstatic --noinput
     python manage.py migrate
     # python manage.py djstripe_sync_models
-    gunicorn ${PROJECT_NAME}.wsgi:application --bind 0.0.0.0:80 --workers 3 --threads 2 --reload
+    export WEB_CONCURRENCY="${WEB_CONCURRENCY:-3}"
+    gunicorn ${PROJECT_NAME}.wsgi:application --bind 0.0.0.0:80 --workers "$WEB_CONCURRENCY" --threads 2 --reload
 else
     python manage.py qcluster
 fi
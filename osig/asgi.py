@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "osig.settings")
 
 application = get_asgi_application()
+
+# Apps are loaded now; warm this server process before it takes requests.
+from core.image_styles import warm_serving_process
+
+warm_serving_process()
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 import logging
 import os
 from pathlib import Path
+from urllib.parse import urlparse
 
 import environ
 import logfire
@@ -61,8 +62,64 @@ CSRF_TRUSTED_ORIGINS = env.list("CSRF_TRUSTED_ORIGINS")
 OSIG_DAILY_USAGE_LIMIT = env.int("OSIG_DAILY_USAGE_LIMIT", default=1000)
 OSIG_MONTHLY_USAGE_LIMIT = env.int("OSIG_MONTHLY_USAGE_LIMIT", default=10000)
 OSIG_USAGE_WARNING_PERCENT = env.float("OSIG_USAGE_WARNING_PERCENT", default=0.8)
+OSIG_USAGE_CACHE_ALIAS = env("OSIG_USAGE_CACHE_ALIAS", default="default")
+OSIG_USAGE_FLUSH_SECONDS = env.int("OSIG_USAGE_FLUSH_SECONDS", default=60)
+OSIG_PRINCIPAL_CACHE_TTL_SECONDS = env.int("OSIG_PRINCIPAL_CACHE_TTL_SECONDS", default=60)
 OSIG_RENDER_MAX_ATTEMPTS = env.int("OSIG_RENDER_MAX_ATTEMPTS", default=2)
+OSIG_RENDER_ATTEMPT_SUCCESS_SAMPLE_RATE = env.float("OSIG_RENDER_ATTEMPT_SUCCESS_SAMPLE_RATE", default=1.0)
+OSIG_RENDER_ATTEMPT_BATCH_SIZE = env.int("OSIG_RENDER_ATTEMPT_BATCH_SIZE", default=200)
+OSIG_RENDER_ATTEMPT_FLUSH_SECONDS = env.float("OSIG_RENDER_ATTEMPT_FLUSH_SECONDS", default=5)
+OSIG_RENDER_METRICS_ROLLUP_MINUTES = env.int("OSIG_RENDER_METRICS_ROLLUP_MINUTES", default=10)
+OSIG_SERVER_TIMING_ENABLED = env.bool("OSIG_SERVER_TIMING_ENABLED", default=False)
 OSIG_IMAGE_FETCH_TIMEOUT_SECONDS = env.int("OSIG_IMAGE_FETCH_TIMEOUT_SECONDS", default=8)
+OSIG_IMAGE_FETCH_MAX_BYTES = env.int("OSIG_IMAGE_FETCH_MAX_BYTES", default=10 * 1024 * 1024)
+OSIG_IMAGE_MAX_PIXELS = env.int("OSIG_IMAGE_MAX_PIXELS", default=40_000_000)
+OSIG_HTTP_POOL_CONNECTIONS = env.int("OSIG_HTTP_POOL_CONNECTIONS", default=10)
+OSIG_HTTP_POOL_MAXSIZE = env.int("OSIG_HTTP_POOL_MAXSIZE", default=20)
+OSIG_HTTP_MAX_CONNECTIONS_PER_HOST = env.int("OSIG_HTTP_MAX_CONNECTIONS_PER_HOST", default=4)
+OSIG_HTTP_MAX_RETRIES = env.int("OSIG_HTTP_MAX_RETRIES", default=2)
+OSIG_HTTP_RETRY_BACKOFF_SECONDS = env.float("OSIG_HTTP_RETRY_BACKOFF_SECONDS", default=0.2)
+OSIG_FONT_CACHE_MAX_ENTRIES = env.int("OSIG_FONT_CACHE_MAX_ENTRIES", default=128)
+OSIG_QUALITY_CACHE_MAX_ENTRIES = env.int("OSIG_QUALITY_CACHE_MAX_ENTRIES", default=4096)
+OSIG_RENDER_WARM_ON_STARTUP = env.bool("OSIG_RENDER_WARM_ON_STARTUP", default=True)
+OSIG_RENDER_CACHE_ALIAS = env("OSIG_RENDER_CACHE_ALIAS", default="default")
+OSIG_RENDER_CACHE_MAX_BYTES = env.int("OSIG_RENDER_CACHE_MAX_BYTES", default=64 * 1024 * 1024)
+OSIG_RENDER_CACHE_MAX_ITEM_BYTES = env.int("OSIG_RENDER_CACHE_MAX_ITEM_BYTES", default=2 * 1024 * 1024)
+OSIG_RENDER_CACHE_TTL_SECONDS = env.int("OSIG_RENDER_CACHE_TTL_SECONDS", default=300)
+OSIG_RENDER_CACHE_SHARED_TTL_SECONDS = env.int("OSIG_RENDER_CACHE_SHARED_TTL_SECONDS", default=60 * 60 * 24)
+OSIG_RENDER_STREAM_MIN_BYTES = env.int("OSIG_RENDER_STREAM_MIN_BYTES", default=1024 * 1024)
+OSIG_CACHE_HIT_MODE = env("OSIG_CACHE_HIT_MODE", default="proxy")  # proxy | redirect | signed_redirect
+OSIG_CACHE_HIT_REDIRECT_MAX_AGE_SECONDS = env.int("OSIG_CACHE_HIT_REDIRECT_MAX_AGE_SECONDS", default=60 * 60)
+OSIG_SIGNED_STORAGE_URL_EXPIRE_SECONDS = env.int("OSIG_SIGNED_STORAGE_URL_EXPIRE_SECONDS", default=60 * 60)
+OSIG_REGENERATION_MAX_AGE_SECONDS = env.int(
+    "OSIG_REGENERATION_MAX_AGE_SECONDS", default={"prod": 60 * 60 * 24 * 2, "dev": 0}.get(ENVIRONMENT)
+)
+# e.g. "logo=86400;job_clean=604800"
+OSIG_REGENERATION_MAX_AGE_BY_STYLE = env.dict("OSIG_REGENERATION_MAX_AGE_BY_STYLE", cast={"value": int}, default={})
+OSIG_REGENERATION_MARKER_TTL_SECONDS = env.int("OSIG_REGENERATION_MARKER_TTL_SECONDS", default=60 * 60)
+OSIG_REGENERATION_SWEEP_MINUTES = env.int("OSIG_REGENERATION_SWEEP_MINUTES", default=10)
+OSIG_REGENERATION_SWEEP_BATCH_SIZE = env.int("OSIG_REGENERATION_SWEEP_BATCH_SIZE", default=50)
+OSIG_REGENERATION_REQUEUE_SECONDS = env.int("OSIG_REGENERATION_REQUEUE_SECONDS", default=60 * 60)
+OSIG_SAVE_BATCH_WINDOW_SECONDS = env.int("OSIG_SAVE_BATCH_WINDOW_SECONDS", default=10)
+OSIG_SAVE_SPOOL_TTL_SECONDS = env.int("OSIG_SAVE_SPOOL_TTL_SECONDS", default=15 * 60)
+OSIG_SAVE_UPLOAD_CONCURRENCY = env.int("OSIG_SAVE_UPLOAD_CONCURRENCY", default=8)
+OSIG_RENDER_COALESCE_TIMEOUT_SECONDS = env.float("OSIG_RENDER_COALESCE_TIMEOUT_SECONDS", default=10)
+OSIG_RENDER_LOCK_TTL_SECONDS = env.int("OSIG_RENDER_LOCK_TTL_SECONDS", default=30)
+OSIG_ASYNC_RENDER_WORKERS = env.int("OSIG_ASYNC_RENDER_WORKERS", default=4)
+OSIG_ASYNC_FETCH_WORKERS = env.int("OSIG_ASYNC_FETCH_WORKERS", default=32)
+OSIG_RENDER_POOL_ENABLED = env.bool("OSIG_RENDER_POOL_ENABLED", default=False)
+# Server processes per container, as read by gunicorn; the render pool splits the cores between them.
+WEB_CONCURRENCY = env.int("WEB_CONCURRENCY", default=1)
+OSIG_RENDER_POOL_WORKERS = env.int("OSIG_RENDER_POOL_WORKERS", default=0)
+OSIG_RENDER_POOL_MAX_QUEUE = env.int("OSIG_RENDER_POOL_MAX_QUEUE", default=16)
+OSIG_RENDER_POOL_TIMEOUT_SECONDS = env.int("OSIG_RENDER_POOL_TIMEOUT_SECONDS", default=30)
+OSIG_RENDER_POOL_RETRY_AFTER_SECONDS = env.int("OSIG_RENDER_POOL_RETRY_AFTER_SECONDS", default=2)
+OSIG_REMOTE_ASSET_CACHE_DIR = env("OSIG_REMOTE_ASSET_CACHE_DIR", default="")
+OSIG_REMOTE_ASSET_FRESH_SECONDS = env.int("OSIG_REMOTE_ASSET_FRESH_SECONDS", default=60 * 60)
+OSIG_REMOTE_ASSET_NEGATIVE_TTL_SECONDS = env.int("OSIG_REMOTE_ASSET_NEGATIVE_TTL_SECONDS", default=5 * 60)
+OSIG_REMOTE_ASSET_MEMORY_MAX_BYTES = env.int("OSIG_REMOTE_ASSET_MEMORY_MAX_BYTES", default=64 * 1024 * 1024)
+OSIG_REMOTE_ASSET_NEGATIVE_MAX_ENTRIES = env.int("OSIG_REMOTE_ASSET_NEGATIVE_MAX_ENTRIES", default=4096)
+OSIG_REMOTE_ASSET_DISK_MAX_BYTES = env.int("OSIG_REMOTE_ASSET_DISK_MAX_BYTES", default=512 * 1024 * 1024)
 
 INSTALLED_APPS = [
     "django.contrib.admin",
@@ -127,6 +184,15 @@ DATABASES = {
     "default": env.db_url(),
 }
 
+REDIS_URL = env("REDIS_URL")
+
+# The render cache, single-flight locks, save spool, usage counters and regeneration markers
+# must be shared by every web worker and the qcluster, so this defaults to Redis. It uses
+# database 1 of REDIS_URL, so `cache.clear()` can never flush the django-q queue.
+CACHES = {
+    "default": env.cache_url("CACHE_URL", default=urlparse(REDIS_URL)._replace(path="/1").geturl()),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -259,7 +325,7 @@ Q_CLUSTER = {
     "retry": 120,
     "workers": 4,
     "max_attempts": 2,
-    "redis": env("REDIS_URL"),
+    "redis": REDIS_URL,
     "error_reporter": {},
 }
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "osig.settings")
 
 application = get_wsgi_application()
+
+# Apps are loaded now; warm this server process before it takes requests.
+from core.image_styles import warm_serving_process
+
+warm_serving_process()